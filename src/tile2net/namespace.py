@@ -344,6 +344,17 @@ class Namespace(
 
     city_info_path: str = None
     eval_folder: str = None
+    virtual_stitch: bool = False
+    mosaic: bool = False
+    nodata_ratio: float = None
+    polygon_workers: int = None
+    polygonize_mosaic: bool = False
+    device: str = None
+    cpu_threads: int = None
+    cpu_interop_threads: int = None
+    channels_last: bool = False
+    bf16: bool = False
+    worker_per_socket: bool = False
 
     _assets_path: str = None
 
@@ -451,6 +462,8 @@ class Namespace(
     immutable: False
 
     dump_percent: int = None
+    cache: str | bool = None
+    storage: str = None
 
     # torch_version = torch_version_float()
     interactive: bool = False
@@ -558,7 +571,8 @@ class Namespace(
 
 
 
-        self.__dict__.pop('_functions_stack')
+        # set by argh when parsed from the command line
+        self.__dict__.pop('_functions_stack', None)
         self.update_cfg()
 
     _mutable = 'epoch dataset_inst'.split()
@@ -0,0 +1,58 @@
+"""
+Measure how fast the predictions are polygonized, in polygons per second,
+on random class-index masks whose regions range from fragmented to smooth,
+as those of dense sidewalks and of open roads:
+
+    python -m tile2net.raster.benchmark --size 1024 --sigmas 1 2 4
+"""
+from __future__ import annotations
+
+import time
+
+import argh
+import numpy as np
+import skimage
+
+from tile2net.logger import logger
+from tile2net.raster.tile import BACKGROUND, Tile
+
+
+def random_classes(size: int, sigma: float, seed: int = 0) -> np.ndarray:
+    """
+    A mask of the class index of each pixel, whose regions are those of
+    smoothed noise; the smaller the sigma, the more and smaller the regions.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.random((BACKGROUND + 1, size, size))
+    noise = skimage.filters.gaussian(noise, sigma, channel_axis=0)
+    return noise.argmax(0).astype(np.uint8)
+
+
+@argh.arg('--size', help='size of each mask in pixels')
+@argh.arg('--sigmas', nargs='+', type=float, help='smoothing of each mask; smaller is more fragmented')
+@argh.arg('--iterations', help='timed polygonizations of each mask')
+def benchmark(
+        size: int = 1024,
+        sigmas: list[float] = (1., 2., 4.),
+        iterations: int = 3,
+) -> dict[float, float]:
+    """Time Tile.labels_to_poly on each mask and log the polygons per second."""
+    rates = {}
+    for sigma in sigmas:
+        classes = random_classes(size, sigma)
+        mask = classes != BACKGROUND
+        start = time.perf_counter()
+        for _ in range(iterations):
+            polygons = Tile.labels_to_poly(classes, mask=mask)
+        elapsed = time.perf_counter() - start
+        rate = iterations * len(polygons) / elapsed
+        rates[sigma] = rate
+        logger.info(
+            f'Polygonized {len(polygons):,} polygons of a {size}x{size} mask with {sigma=} '
+            f'in {elapsed / iterations:.2f}s ({rate:,.0f} polygons/sec)'
+        )
+    return rates
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(benchmark)
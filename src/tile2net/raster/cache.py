@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from os import PathLike
+from pathlib import Path
+
+from tile2net.logger import logger
+from tile2net.raster import util
+from tile2net.raster.pack import PackFile
+
+# ioctl request to clone a file's extents on btrfs, xfs, etc.
+FICLONE = 0x40049409
+
+
+class TileCache:
+    """
+    Content-addressed store of raw tiles shared across projects.
+
+    Blobs are stored once per format under
+    objects/<digest[:2]>/<digest>.<extension>, and index.db maps
+    (source, zoom, x, y) to a digest. Tiles are materialized into a project
+    directory with a hard link, a reflink, or a copy, in that order of
+    preference. When the blobs exceed the budget, the least recently
+    used are evicted.
+    """
+
+    def __init__(
+            self,
+            path: PathLike = None,
+            budget: int = 50 * 2 ** 30,
+            batch: int = 512,
+    ):
+        """
+        Parameters
+        ----------
+        path : PathLike
+            directory of the cache; util.cache_dir('tiles') by default
+        budget : int
+            maximum size of the stored blobs, in bytes
+        batch : int
+            number of index updates that are buffered before they are committed
+        """
+        if path is None:
+            path = util.cache_dir('tiles')
+        self.path = Path(path)
+        self.objects = self.path / 'objects'
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+        self.batch = batch
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.puts: list[tuple] = []
+        self.touches: dict[tuple[str, str], float] = {}
+        with self.connection as con:
+            con.executescript('''
+                CREATE TABLE IF NOT EXISTS tiles (
+                    source TEXT, zoom INTEGER, x INTEGER, y INTEGER, digest TEXT,
+                    PRIMARY KEY (source, zoom, x, y)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT, size INTEGER, extension TEXT, accessed REAL,
+                    PRIMARY KEY (digest, extension)
+                );
+                CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed);
+            ''')
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.path} budget={self.budget / 2 ** 30:.1f}GB>'
+
+    def __bool__(self):
+        return True
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # one connection per thread; WAL allows readers in other processes during writes
+        try:
+            return self.local.connection
+        except AttributeError:
+            con = sqlite3.connect(self.path / 'index.db', timeout=60)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = con
+            return con
+
+    def blob(self, digest: str, extension: str) -> Path:
+        return self.objects / digest[:2] / f'{digest}.{extension}'
+
+    def digest(self, source: str, zoom: int, x: int, y: int) -> str | None:
+        row = self.connection.execute(
+            'SELECT digest FROM tiles WHERE source=? AND zoom=? AND x=? AND y=?',
+            (source, zoom, x, y),
+        ).fetchone()
+        if row is None:
+            with self.lock:
+                for put in self.puts:
+                    if put[:4] == (source, zoom, x, y):
+                        return put[4]
+            return None
+        return row[0]
+
+    @staticmethod
+    def link(src: Path, dst: Path | PackFile):
+        # hard link, then reflink, then copy
+        if isinstance(dst, PackFile):
+            dst.write_bytes(src.read_bytes())
+            return
+        try:
+            os.link(src, dst)
+            return
+        except FileExistsError:
+            return
+        except OSError:
+            ...
+        try:
+            # POSIX only; Windows falls back to a copy
+            import fcntl
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return
+        except (ImportError, OSError):
+            ...
+        shutil.copyfile(src, dst)
+
+    def materialize(
+            self,
+            source: str,
+            zoom: int,
+            x: int,
+            y: int,
+            dst: PathLike | PackFile,
+    ) -> bool:
+        """Place the cached tile at dst; returns False if the tile is not cached."""
+        digest = self.digest(source, zoom, x, y)
+        if digest is None:
+            return False
+        if not isinstance(dst, PackFile):
+            dst = Path(dst)
+        extension = dst.suffix.lstrip('.')
+        blob = self.blob(digest, extension)
+        if not blob.exists():
+            return False
+        self.link(blob, dst)
+        with self.lock:
+            self.touches[digest, extension] = time.time()
+            if len(self.touches) >= self.batch:
+                self._flush()
+        return True
+
+    def put(
+            self,
+            source: str,
+            zoom: int,
+            x: int,
+            y: int,
+            content: bytes,
+            dst: PathLike | PackFile = None,
+    ) -> str:
+        """
+        Store the content of a tile and, if dst is passed, materialize it there.
+        Returns the digest of the content.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        if dst is None:
+            extension = 'bin'
+        elif isinstance(dst, PackFile):
+            extension = dst.suffix.lstrip('.')
+        else:
+            dst = Path(dst)
+            extension = dst.suffix.lstrip('.')
+        blob = self.blob(digest, extension)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            # write then rename so that readers never see a partial blob
+            fd, tmp = tempfile.mkstemp(dir=blob.parent)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, blob)
+        if dst is not None:
+            self.link(blob, dst)
+        with self.lock:
+            self.puts.append((source, zoom, x, y, digest, len(content), extension, time.time()))
+            if len(self.puts) >= self.batch:
+                self._flush()
+        return digest
+
+    def flush(self):
+        """Commit the buffered index updates and evict if over budget."""
+        with self.lock:
+            self._flush()
+        self.evict()
+
+    def _flush(self):
+        puts, self.puts = self.puts, []
+        touches, self.touches = self.touches, {}
+        if not puts and not touches:
+            return
+        with self.connection as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)',
+                (put[:5] for put in puts),
+            )
+            con.executemany(
+                'INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)',
+                (put[4:] for put in puts),
+            )
+            con.executemany(
+                'UPDATE blobs SET accessed=? WHERE digest=? AND extension=?',
+                ((accessed, *key) for key, accessed in touches.items()),
+            )
+
+    @property
+    def size(self) -> int:
+        size, = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return size
+
+    def evict(self, budget: int = None):
+        """Delete the least recently used blobs until the cache is within budget."""
+        if budget is None:
+            budget = self.budget
+        size = self.size
+        if size <= budget:
+            return
+        # evict down to 90% so that eviction is not triggered by every flush
+        excess = size - int(budget * .9)
+        evicted: list[tuple[str, str]] = []
+        con = self.connection
+        for digest, blob_size, extension in con.execute(
+                'SELECT digest, size, extension FROM blobs ORDER BY accessed'
+        ):
+            if excess <= 0:
+                break
+            self.blob(digest, extension).unlink(missing_ok=True)
+            evicted.append((digest, extension))
+            excess -= blob_size
+        with con:
+            con.executemany('DELETE FROM blobs WHERE digest=? AND extension=?', evicted)
+            # a tile is cached while a blob of its content remains in any format
+            con.execute('DELETE FROM tiles WHERE digest NOT IN (SELECT digest FROM blobs)')
+        logger.info(f'Evicted {len(evicted):,} tiles from {self}')
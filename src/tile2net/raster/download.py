@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import email.utils
+import importlib.util
+import logging
+import random
+import ssl
+import threading
+import time
+from typing import Iterable, Iterator, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import certifi
+import httpx
+
+from tile2net.logger import logger
+
+# httpx logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+class Response(NamedTuple):
+    # index of the url in the iterable passed to Downloader.iter
+    index: int
+    url: str
+    # None if the tile could not be fetched
+    content: Optional[bytes]
+    # HTTP status of the last attempt; None if the last attempt failed in transport
+    status: Optional[int]
+
+    @property
+    def missing(self) -> bool:
+        # the server answered definitively that there is no tile, e.g. 404 outside coverage
+        return (
+                self.content is None
+                and self.status is not None
+                and self.status not in Downloader.retry_statuses
+        )
+
+
+class AIMD:
+    """
+    Additive-increase, multiplicative-decrease concurrency limit.
+    Each success grows the limit by roughly one slot per window of
+    requests; each throttling signal halves it, at most once per cooldown.
+    """
+
+    def __init__(
+            self,
+            initial: int,
+            minimum: int = 1,
+            maximum: int = 64,
+            increase: float = 1.,
+            decrease: float = .5,
+            cooldown: float = 1.,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.active = 0
+        self.decreased = 0.
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *args):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def throttle(self):
+        now = time.monotonic()
+        if now - self.decreased < self.cooldown:
+            return
+        self.decreased = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        logger.debug(f'Throttled; reducing download concurrency to {int(self.limit)}')
+
+
+class Downloader:
+    """
+    Asynchronous tile downloader with a connection pool per host,
+    AIMD concurrency, and per-tile exponential backoff with full jitter.
+    Retry-After is honored for 429 and 503 responses.
+    """
+    retry_statuses = frozenset({408, 429, 500, 502, 503, 504})
+
+    def __init__(
+            self,
+            max_connections: int = 32,
+            concurrency: int = 8,
+            min_concurrency: int = 1,
+            max_concurrency: int = None,
+            retries: int = 5,
+            backoff: float = .5,
+            max_backoff: float = 60.,
+            timeout: float = 30.,
+            http2: bool = True,
+            queue_size: int = 256,
+    ):
+        """
+        Parameters
+        ----------
+        max_connections : int
+            size of the connection pool for each host
+        concurrency : int
+            initial number of requests in flight
+        min_concurrency : int
+            lower bound for the adaptive concurrency
+        max_concurrency : int
+            upper bound for the adaptive concurrency; max_connections by default
+        retries : int
+            number of retries for each tile before it is considered failed
+        backoff : float
+            base of the exponential backoff, in seconds
+        max_backoff : float
+            upper bound of a single backoff, in seconds
+        timeout : float
+            timeout of a single request, in seconds
+        http2 : bool
+            negotiate HTTP/2 if the h2 package is installed
+        queue_size : int
+            maximum number of responses buffered for the consumer
+        """
+        if max_concurrency is None:
+            max_concurrency = max_connections
+        self.max_connections = max_connections
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.http2 = http2 and importlib.util.find_spec('h2') is not None
+        self.queue_size = queue_size
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__qualname__} '
+            f'{self.max_connections=} {self.concurrency=} {self.http2=}>'
+        )
+
+    def delay(self, attempt: int, response: httpx.Response = None) -> float:
+        # full jitter: uniform over [0, min(cap, base * 2 ** attempt)]
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is None:
+            return delay
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            return delay
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                date = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                return delay
+            seconds = date.timestamp() - time.time()
+        return max(delay, min(seconds, self.max_backoff))
+
+    def client(self, clients: dict[str, httpx.AsyncClient], url: str) -> httpx.AsyncClient:
+        host = urlsplit(url).netloc
+        if host not in clients:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            )
+            clients[host] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=limits,
+                timeout=self.timeout,
+                verify=ssl.create_default_context(cafile=certifi.where()),
+                follow_redirects=True,
+            )
+        return clients[host]
+
+    async def fetch(
+            self,
+            client: httpx.AsyncClient,
+            aimd: AIMD,
+            index: int,
+            url: str,
+    ) -> Response:
+        status = None
+        for attempt in range(self.retries + 1):
+            response = None
+            async with aimd:
+                try:
+                    response = await client.get(url)
+                except httpx.TransportError as e:
+                    logger.debug(f'{url} failed with {e!r}')
+                    status = None
+                    aimd.throttle()
+                else:
+                    status = response.status_code
+                    if response.is_success:
+                        aimd.success()
+                        return Response(index, url, response.content, status)
+                    if status not in self.retry_statuses:
+                        return Response(index, url, None, status)
+                    aimd.throttle()
+            if attempt < self.retries:
+                await asyncio.sleep(self.delay(attempt, response))
+        logger.debug(f'{url} failed after {self.retries} retries with {status=}')
+        return Response(index, url, None, status)
+
+    async def produce(self, urls: Iterable[str], queue: asyncio.Queue):
+        aimd = AIMD(
+            initial=self.concurrency,
+            minimum=self.min_concurrency,
+            maximum=self.max_concurrency,
+        )
+        clients: dict[str, httpx.AsyncClient] = {}
+        it = enumerate(urls)
+
+        async def worker():
+            for index, url in it:
+                client = self.client(clients, url)
+                response = await self.fetch(client, aimd, index, url)
+                await queue.put(response)
+
+        try:
+            await asyncio.gather(*(
+                worker()
+                for _ in range(self.max_concurrency)
+            ))
+        except Exception as e:
+            # surface the error to the consumer instead of hanging it
+            await queue.put(e)
+        else:
+            await queue.put(None)
+        finally:
+            # closed even if cancelled by the consumer exiting early
+            for client in clients.values():
+                with contextlib.suppress(Exception):
+                    await client.aclose()
+
+    def iter(self, urls: Iterable[str]) -> Iterator[Response]:
+        """
+        Yield a Response for each url as soon as it completes;
+        the event loop runs in a background thread and at most
+        queue_size responses are buffered ahead of the consumer.
+        """
+        loop = asyncio.new_event_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        async def start() -> asyncio.Task:
+            return asyncio.ensure_future(self.produce(urls, queue))
+
+        async def stop():
+            # cancelled if the consumer exits early; wait for the clients to close
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        task = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        try:
+            while True:
+                response = asyncio.run_coroutine_threadsafe(queue.get(), loop).result()
+                if response is None:
+                    break
+                if isinstance(response, Exception):
+                    raise response
+                yield response
+        finally:
+            asyncio.run_coroutine_threadsafe(stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def __call__(self, urls: Iterable[str]) -> list[Response]:
+        return list(self.iter(urls))
@@ -12,7 +12,14 @@ from tile2net.raster.raster import Raster
 def generate(args: Namespace) -> str:
     """Generate a JSON file representing the tile2net project file structure."""
     raster = Raster.from_info(args.__dict__)
-    raster.generate(args.stitch_step)
+    raster.generate(
+        args.stitch_step,
+        encoder=args.encoder,
+        compression=args.compression,
+        workers=args.stitch_workers,
+        virtual=args.virtual,
+        mosaic=args.mosaic,
+    )
     # raster.save_info_json(new_tstep=args.stitch_step)
     # json.dump(
     #     dict(raster.project.structure),
@@ -75,6 +75,37 @@ commandline = compose_left(
         default=0,
         help='The percentage of segmentation results to save. 100 means all, 0 means none.',
     ),
+    arg(
+        '--cache', nargs='?', const=True, default=None, type=str,
+        help='Use a tile cache shared across projects; optionally, the path to the cache '
+             'directory, otherwise $TILE2NET_CACHE or "~/.cache/tile2net"',
+    ),
+    arg(
+        '--storage', default='files', type=str, choices=('files', 'mbtiles'),
+        help='Store each tile in its own file, or the static and stitched tiles '
+             'in a single MBTiles file each',
+    ),
+    arg(
+        '--encoder', default='pil', type=str, choices=('pil', 'cv2'),
+        help='The library that encodes the stitched tiles',
+    ),
+    arg(
+        '--compression', default=None, type=int,
+        help='The zlib level of PNG stitched tiles, from 0 (fastest) to 9 (smallest)',
+    ),
+    arg(
+        '--stitch_workers', default=None, type=int,
+        help='The number of processes that stitch tiles; the number of CPUs by default',
+    ),
+    arg(
+        '--virtual', action='store_true', default=False,
+        help='Only download the tiles; inference with --virtual_stitch '
+             'assembles the stitched tiles without writing them',
+    ),
+    arg(
+        '--mosaic', action='store_true', default=False,
+        help='Also write the stitched tiles into a single Cloud Optimized GeoTIFF',
+    ),
 )
 
 class Namespace(argh.ArghNamespace):
@@ -93,3 +124,8 @@ class Namespace(argh.ArghNamespace):
     stitch_step: int
     quiet: bool
     source: str
+    encoder: str
+    compression: Optional[int]
+    stitch_workers: Optional[int]
+    virtual: bool
+    mosaic: bool
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import cached_property
+from os import PathLike
+from pathlib import Path
+from typing import Optional
+
+from geopy.geocoders import Nominatim
+from tqdm import tqdm
+
+from tile2net.logger import logger
+
+
+class GeocodeCache:
+    """
+    Persistent cache of Nominatim lookups, so that repeated and parallel
+    runs over the same study areas do not wait on the geocoder.
+
+    Forward lookups are keyed by the normalized query, and reverse lookups
+    by the centroid rounded to `precision` decimals (about 10 m by default).
+    Results are stored in an SQLite database in WAL mode, with a connection
+    per thread and per process. Lookups that miss are throttled to one
+    request per `delay` seconds within a process, per the Nominatim usage policy.
+    """
+
+    def __init__(
+            self,
+            path: PathLike = None,
+            precision: int = 4,
+            delay: float = 1.,
+            user_agent: str = 'tile2net',
+    ):
+        """
+        Parameters
+        ----------
+        path : PathLike
+            path of the database; util.cache_dir()/geocode.sqlite by default
+        precision : int
+            decimals to which reverse lookups are rounded
+        delay : float
+            minimum seconds between requests to the geocoder
+        user_agent : str
+            user agent sent to Nominatim
+        """
+        self._path = path
+        self.precision = precision
+        self.delay = delay
+        self.user_agent = user_agent
+        self.local = threading.local()
+        self.pid = None
+        self.lock = threading.Lock()
+        self.requested = 0.
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self._path}>'
+
+    @property
+    def path(self) -> Path:
+        if self._path is None:
+            # util imports this module
+            from tile2net.raster.util import cache_dir
+            self._path = cache_dir() / 'geocode.sqlite'
+        return Path(self._path)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections cannot be shared across processes or threads
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = threading.local()
+        try:
+            return self.local.connection
+        except AttributeError:
+            ...
+        con = sqlite3.connect(self.path, timeout=60)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        with con:
+            con.executescript('''
+                CREATE TABLE IF NOT EXISTS forward (
+                    query TEXT PRIMARY KEY, raw TEXT, fetched REAL
+                );
+                CREATE TABLE IF NOT EXISTS reverse (
+                    lat REAL, lon REAL, display_name TEXT, fetched REAL,
+                    PRIMARY KEY (lat, lon)
+                );
+            ''')
+        self.local.connection = con
+        return con
+
+    @cached_property
+    def geocoder(self) -> Nominatim:
+        return Nominatim(user_agent=self.user_agent)
+
+    def throttle(self):
+        with self.lock:
+            wait = self.requested + self.delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.requested = time.monotonic()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # 'New York,NY ' and 'new york, ny' are the same query
+        return ' '.join(query.casefold().replace(',', ', ').split())
+
+    def geocode(self, query: str) -> Optional[dict]:
+        """
+        Return the display_name and boundingbox of the query, as returned
+        by Nominatim, or None if it could not be geocoded.
+        """
+        key = self.normalize(query)
+        # misses are looked up again; they may have been transient
+        row = self.connection.execute(
+            "SELECT raw FROM forward WHERE query=? AND raw != 'null'", (key,)
+        ).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        logger.info(f"Geocoding {query}, this may take awhile...")
+        self.throttle()
+        nom = self.geocoder.geocode(query, timeout=None)
+        if nom is None:
+            return None
+        raw = dict(
+            display_name=nom.raw['display_name'],
+            boundingbox=nom.raw['boundingbox'],
+        )
+        with self.connection as con:
+            con.execute(
+                'INSERT OR REPLACE INTO forward VALUES (?, ?, ?)',
+                (key, json.dumps(raw), time.time()),
+            )
+        return raw
+
+    def reverse(self, lat: float, lon: float) -> str:
+        """Return the display_name of the address nearest to the point."""
+        key = round(lat, self.precision), round(lon, self.precision)
+        row = self.connection.execute(
+            'SELECT display_name FROM reverse WHERE lat=? AND lon=?', key
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        logger.info(f"Geocoding {(lat, lon)}, this may take awhile...")
+        self.throttle()
+        nom = self.geocoder.reverse((lat, lon), timeout=None)
+        if nom is None:
+            raise ValueError(f"Could not geocode '{(lat, lon)}'")
+        display_name = nom.raw['display_name']
+        with self.connection as con:
+            con.execute(
+                'INSERT OR REPLACE INTO reverse VALUES (?, ?, ?, ?)',
+                (*key, display_name, time.time()),
+            )
+        return display_name
+
+    def warm(self, path: PathLike):
+        """
+        Geocode the locations in a CSV ahead of a batch run. Each row is
+        either an address or a bounding box; the same lookups that a Raster
+        makes for that location are cached: the bounding box of an address,
+        and the address of the centroid of the bounding box.
+        """
+        from tile2net.raster import util
+
+        with open(path, newline='') as f:
+            locations = [
+                ','.join(row).strip()
+                for row in csv.reader(f)
+                if any(row)
+            ]
+        failed = 0
+        for location in tqdm(locations, desc='Geocoding'):
+            try:
+                util.name_from_location(location)
+                bbox = util.geocode(location)
+                util.reverse_geocode(bbox)
+            except (ValueError, TypeError) as e:
+                failed += 1
+                logger.warning(f'Could not geocode {location!r}: {e}')
+        logger.info(f'Cached {len(locations) - failed:,} of {len(locations):,} locations')
+
+
+if __name__ == '__main__':
+    import sys
+
+    from tile2net.raster.util import geocache
+
+    for path in sys.argv[1:]:
+        geocache.warm(path)
@@ -11,14 +11,13 @@ from affine import Affine
 import osmnx as ox
 from dataclasses import dataclass, field
 from functools import cached_property
-from geopy.geocoders import Nominatim
 
 from tile2net.raster.tile_utils.topology import fill_holes, replace_convexhull
 from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
 os.environ['USE_PYGEOS'] = '0'
 import geopandas as gpd
-from tile2net.raster.tile import Tile
+from tile2net.raster.tiles import TileArray, PoseDict
 from tile2net.raster.tile_utils.genutils import (
     deg2num, num2deg, createfolder,
 )
@@ -27,6 +26,7 @@ from tile2net.raster.tile_utils.geodata_utils import (
 )
 import logging
 from tile2net.raster.project import Project
+from tile2net.raster.util import geocache
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -36,8 +36,10 @@ class GeolocateRegion:
     location: str = field(default=str)
 
     def mygeolocator(self) -> dict:
-        app = Nominatim(user_agent="tile2net")
-        return app.geocode(self.location).raw
+        raw = geocache.geocode(self.location)
+        if raw is None:
+            raise ValueError(f"Could not geocode '{self.location}'")
+        return raw
 
     def get_latlon(self) -> list:
         location = self.mygeolocator()
@@ -134,33 +136,25 @@ class BaseGrid(BaseRegion):
     base_tilesize: int = field(default=256)
     padding: bool = field(default=True, repr=False)
     tile_step: int = field(default=1, repr=False)
-    tiles: np.ndarray = field(default_factory=lambda: np.array(Tile), init=False, repr=False)
+    tiles: TileArray = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
         self.xtile = deg2num(self.base_top, self.base_left, self.zoom)[0]
         self.ytile = deg2num(self.base_top, self.base_left, self.zoom)[1]
         self.xtilem = deg2num(self.base_bottom, self.base_right, self.zoom)[0]
         self.ytilem = deg2num(self.base_bottom, self.base_right, self.zoom)[1]
-        self.tiles = np.array([
-            [
-                Tile(
-                    self.xtile + col_idx,
-                    self.ytile + row_idx,
-                    position=(
-                        int(col_idx / self.tile_step), int(row_idx / self.stitch_step)
-                    ),
-                    idd=self.pos2id(
-                        int(col_idx / self.tile_step), int(row_idx / self.stitch_step)
-                    ),
-                    zoom=self.zoom,
-                    size=self.tile_size,
-                    crs=self.crs
-                )
-                for row_idx in np.arange(0, self.base_height, self.tile_step)
-            ]
-            for col_idx in np.arange(0, self.base_width, self.tile_step)
-        ])
-        self.pose_dict = {tile.idd: tile.position for col in self.tiles for tile in col}
+        self.tiles = TileArray.from_grid(
+            self.xtile,
+            self.ytile,
+            self.base_width,
+            self.base_height,
+            step=self.tile_step,
+            stride=self.base_height,
+            zoom=self.zoom,
+            size=self.tile_size,
+            crs=self.crs,
+        )
+        self.pose_dict = PoseDict(self.base_height, self.tiles.shape)
         # due to the rounding issues with deg2num and num2deg, we do this calculation again
         # deg2num(base_top, base_left, zoom) and then converting the nums to lat long will result in slightly different
         # lat long than original input
@@ -216,6 +210,7 @@ class Grid(BaseGrid):
         tempfile.gettempdir(),
         'tile2net'
     ), repr=False)
+    storage: str = field(default='files', repr=False)
 
     def __post_init__(self):
         super().__post_init__()
@@ -240,7 +235,7 @@ class Grid(BaseGrid):
             self.allow_pad = True
         # initialize the attribute values
         self.create_grid()
-        self.num_active = len(self.tiles)
+        self.num_active = int(self.tiles.active.sum())
 
     def __repr__(self):
         return f"{self.name} Grid. \nCRS: {self.crs} \n" \
@@ -368,34 +363,64 @@ class Grid(BaseGrid):
             Nothing is returned.
         """
         self.update_hw()
+        old = self.tiles
         if self.tile_step > 1:
-            self.tiles = np.array([[Tile(self.xtile + col_idx,
-                                         self.ytile + row_idx,
-                                         position=(col_idx // self.tile_step, row_idx // self.tile_step),
-                                         idd=((col_idx // self.tile_step * self.height) +
-                                              row_idx // self.tile_step),
-                                         zoom=self.zoom,
-                                         size=self.tile_size,
-                                         crs=self.crs)
-                                    for row_idx in np.arange(0, self.base_height, self.tile_step)]
-                                   for col_idx in np.arange(0, self.base_width, self.tile_step)])
-            self.pose_dict = {tile.idd: tile.position for col in self.tiles for tile in col}
-
-            for col_idx in range(self.width):
-                for row_idx in range(self.height):
-                    self.tiles[col_idx, row_idx].tile_step = self.tile_step
-
+            self.tiles = TileArray.from_grid(
+                self.xtile,
+                self.ytile,
+                self.base_width,
+                self.base_height,
+                step=self.tile_step,
+                stride=self.height,
+                zoom=self.zoom,
+                size=self.tile_size,
+                crs=self.crs,
+            )
+            self.pose_dict = PoseDict(self.height, self.tiles.shape)
         else:
-            self.tiles = np.array([[Tile(self.xtile + col_idx,
-                                         self.ytile + row_idx,
-                                         position=(col_idx, row_idx),
-                                         idd=(self.pos2id(col_idx, row_idx)),
-                                         zoom=self.zoom,
-                                         size=self.base_tilesize * self.tile_step,
-                                         crs=self.crs)
-                                    for row_idx in np.arange(0, self.height)]
-                                   for col_idx in np.arange(0, self.width)])
-            self.pose_dict = {tile.idd: tile.position for col in self.tiles for tile in col}
+            self.tiles = TileArray.from_grid(
+                self.xtile,
+                self.ytile,
+                self.width,
+                self.height,
+                stride=self.base_height,
+                zoom=self.zoom,
+                size=self.base_tilesize * self.tile_step,
+                crs=self.crs,
+            )
+            self.pose_dict = PoseDict(self.base_height, self.tiles.shape)
+        self._carry_active(old)
+
+    def _carry_active(self, old: TileArray):
+        """
+        Carry the active mask over from the tiles that update_tiles replaced:
+        a tile is active if any of the slippy tiles that it covers was active.
+        Tiles added by padding are only active if every old tile was.
+        """
+        tiles = self.tiles
+        if old is None or old.active.all():
+            self.num_active = tiles.size
+            return
+        col = (old.xtile.ravel() - self.xtile) // tiles.tile_step
+        row = (old.ytile.ravel() - self.ytile) // tiles.tile_step
+        within = (
+                (col >= 0) & (col < tiles.shape[0])
+                & (row >= 0) & (row < tiles.shape[1])
+        )
+        active = np.zeros(tiles.shape, dtype=bool)
+        np.logical_or.at(active, (col[within], row[within]), old.active.ravel()[within])
+        tiles.active = active
+        self.num_active = int(active.sum())
+
+    @property
+    def active(self) -> np.ndarray:
+        """Boolean mask of the tiles that are processed, with the shape of Grid.tiles"""
+        return self.tiles.active
+
+    @active.setter
+    def active(self, value: np.ndarray):
+        self.tiles.active = value
+        self.num_active = int(self.tiles.active.sum())
 
     @property
     def num_tiles(self):
@@ -463,17 +488,25 @@ class Grid(BaseGrid):
         dict | pd.DataFrame
 
         """
-        tileinfo: Dict[str, Dict[Union[str, Any], Union[Union[int, str], Any]]] = {}
-        for c, t in enumerate(self.tiles.flatten()):
-            t.setLatlon
-            if t.active:
-                tileinfo.update(
-                    {f'id{c}': dict(idd=c, zoom=t.zoom, xtile=t.xtile, ytile=t.ytile, topleft_x=t.left, topleft_y=t.top,
-                                    bottomright_x=t.right, bottomright_y=t.bottom)})
+        tiles = self.tiles.flatten()
+        left, bottom, right, top = tiles.bounds.T
+        idd = np.arange(tiles.size)
+        tileinfo_df = pd.DataFrame(dict(
+            idd=idd,
+            zoom=tiles.zoom,
+            xtile=tiles.xtile,
+            ytile=tiles.ytile,
+            topleft_x=left,
+            topleft_y=top,
+            bottomright_x=right,
+            bottomright_y=bottom,
+        ), index=np.char.add('id', idd.astype(str)))
+        tileinfo_df = tileinfo_df[tiles.active]
         if df:
-            tileinfo_df = pd.DataFrame.from_dict(tileinfo, orient='index')
             return tileinfo_df
         else:
+            tileinfo: Dict[str, Dict[Union[str, Any], Union[Union[int, str], Any]]]
+            tileinfo = tileinfo_df.to_dict(orient='index')
             return tileinfo
 
     def _create_pseudo_tiles(self) -> list:
@@ -485,11 +518,53 @@ class Grid(BaseGrid):
         list
             shapely polygons
         """
-        poly = []
-        for c, t in enumerate(self.tiles.flatten()):
-            t.setLatlon
-            poly.append(t.tile2poly())
-        return poly
+        left, bottom, right, top = self.tiles.flatten().bounds.T
+        # fix the rounding issues in plotting, as Tile.tile2poly does
+        poly = shapely.box(left, bottom - 0.00001, right, top - 0.00001, ccw=False)
+        return poly.tolist()
+
+    def tile_bounds(self, tiles: TileArray | Any = None) -> np.ndarray:
+        """
+        Returns the bounds of many tiles in one call
+
+        Parameters
+        ----------
+        tiles : TileArray | index
+            the tiles, or an index such as a slice into Grid.tiles;
+            all tiles if None
+
+        Returns
+        -------
+        np.ndarray
+            (left, bottom, right, top) of each tile, with shape (*tiles.shape, 4)
+        """
+        if tiles is None:
+            tiles = self.tiles
+        elif not isinstance(tiles, TileArray):
+            tiles = self.tiles[tiles]
+        return tiles.bounds
+
+    def tile_transforms(self, tiles: TileArray | Any = None) -> list[Affine]:
+        """
+        Returns the Affine transforms of many tiles in one call; the
+        transforms are computed once for the whole grid
+
+        Parameters
+        ----------
+        tiles : TileArray | index
+            the tiles, or an index such as a slice into Grid.tiles;
+            all tiles if None
+
+        Returns
+        -------
+        list[Affine]
+            the transform of each tile, in the order of tiles.flat
+        """
+        if tiles is None:
+            tiles = self.tiles
+        elif not isinstance(tiles, TileArray):
+            tiles = self.tiles[tiles]
+        return tiles.affines()
 
     def create_grid_gdf(self):
         """
@@ -501,7 +576,9 @@ class Grid(BaseGrid):
             Geopandas :class:`GeoDataFrame` of the grid with its tiles
         """
         tileinfo_df = self._create_info_dict(df=True)
-        poly = self._create_pseudo_tiles()
+        # the info only includes the active tiles
+        poly = np.asarray(self._create_pseudo_tiles(), dtype=object)
+        poly = poly[self.tiles.active.ravel()]
         gdf_grid = gpd.GeoDataFrame(tileinfo_df, geometry=poly, crs=self.crs)
         gdf_grid = gdf_grid.reset_index(drop=True)
         return gdf_grid
@@ -573,18 +650,20 @@ class Grid(BaseGrid):
             The new pseudo tiles clipped by the boundary or None if not clipped
         """
 
-        # create the pseudo tiles for the grid
-        g = self.create_grid_gdf()
         # get the boundary shapefile
         bound = self.get_boundary(city, address, path)
         if bound.crs != self.crs:
-            bound.to_crs(g.crs, inplace=True)
-        # clip the pseudo tiles with boundary
-        new = gpd.clip(g, bound).copy()
-        self.num_inside = len(new)
-        inactive = g[~(g.idd.isin(new.idd))].copy()
-        self.make_inactive(list(inactive.loc[:, 'idd']))
+            bound = bound.to_crs(self.crs)
+        boundary = shapely.union_all(bound.geometry.values)
+        shapely.prepare(boundary)
+        # intersect the bounds of every tile with the prepared boundary at once
+        left, bottom, right, top = self.tiles.flatten().bounds.T
+        inside = shapely.intersects(boundary, shapely.box(left, bottom, right, top))
+        self.num_inside = int(inside.sum())
+        self.make_inactive(np.flatnonzero(~inside))
         if clipped:
+            # clip the pseudo tiles of the active tiles with boundary
+            new = gpd.clip(self.create_grid_gdf(), bound).copy()
             return new
 
     def make_inactive(self, lst):
@@ -597,9 +676,11 @@ class Grid(BaseGrid):
         lst : list[int]
             list of tile ids to exclude
         """
-        for pos in lst:
-            self.tiles.flatten()[int(pos)].active = False
-        self.num_active = self.num_tiles - len(lst)
+        tiles = self.tiles.flatten()
+        active = tiles.active
+        active[np.asarray(lst, dtype=int)] = False
+        tiles.active = active
+        self.num_active = int(active.sum())
 
     # noinspection PyTypeChecker
     @cached_property
@@ -608,6 +689,7 @@ class Grid(BaseGrid):
             name=self.name,
             outdir=self.output_dir,
             raster=self,
+            storage=self.storage,
         )
 
     def save_ntw_polygon(self, crs_metric: int = 3857):
@@ -668,7 +750,9 @@ class Grid(BaseGrid):
         poly_fold = self.project.polygons.path
         createfolder(poly_fold)
         poly_network.reset_index(drop=True, inplace=True)
-        poly_network.set_crs(self.crs, inplace=True)
+        if poly_network.crs is None:
+            # the polygons of a predictions mosaic are already metric
+            poly_network.set_crs(self.crs, inplace=True)
         if poly_network.crs != crs_metric:
             poly_network.to_crs(crs_metric, inplace=True)
         poly_network.geometry = poly_network.simplify(0.6)
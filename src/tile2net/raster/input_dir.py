@@ -10,6 +10,8 @@ from typing import Iterable, Iterator, Type
 from numpy import ndarray
 from toolz import curried, curry as cur, pipe
 
+from tile2net.raster.pack import PackFile, TilePack
+from tile2net.raster.tiles import TileArray
 from tile2net.raster.util import cached_descriptor
 
 
@@ -34,6 +36,10 @@ class InputDir:
     def extension(self):
         ...
 
+    @cached_descriptor
+    def pack(self):
+        ...
+
     def _match(self, string: str, characters: dict[str]):
         c = '|'.join(characters)
         pattern = rf"^(.*)({c})(.*)$"
@@ -53,6 +59,15 @@ class InputDir:
 
         self.original = value
 
+        if value.endswith('.mbtiles'):
+            # tiles packed in a single MBTiles file rather than a file per tile
+            self.pack = TilePack(value)
+            self.extension = self.pack.metadata.get('format', 'png')
+            self.format = value
+            self.dir = value
+            return
+        self.pack = None
+
         try:
             self.extension = value.rsplit('.', 1)[1]
         except IndexError:
@@ -120,11 +135,18 @@ class InputDir:
     def __delete__(self, instance):
         del self.format
 
-    def __call__(self, tiles: ndarray = None) -> Iterator[Path]:
+    def __call__(self, tiles: TileArray | ndarray = None) -> Iterator[Path | PackFile]:
         if tiles is None:
             tiles = self.raster.tiles
-        if isinstance(tiles, ndarray):
+        if isinstance(tiles, (TileArray, ndarray)):
             tiles: Iterable[Tile] = tiles.flat
+        pack = self.pack
+        if pack is not None:
+            extension = self.extension
+            for tile in tiles:
+                name = f'{tile.xtile}_{tile.ytile}.{extension}'
+                yield PackFile(pack, tile.zoom, tile.xtile, tile.ytile, name)
+            return
         format = self.format
         for tile in tiles:
             res = format.format(
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import os
+import threading
+from os import PathLike
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from tile2net.raster.pack import PackFile
+
+
+class Inventory:
+    """
+    Record of the files that exist in a tile directory, so that a run does
+    not have to stat every tile to know what is left to do.
+
+    The first use scans the directory once with os.scandir and writes the
+    names of the nonempty files to a journal in the directory; afterwards,
+    the journal is read instead, and each file that a stage writes is
+    appended to it. The journal carries the modification time of the
+    directory when it was last written, so that files added or removed by
+    anything else cause a rescan. Instances are unique per directory within
+    a process.
+    """
+    inventories: dict[str, Inventory] = {}
+    lock = threading.Lock()
+    journal_name = '.inventory'
+
+    def __new__(cls, path: PathLike, batch: int = 1024):
+        path = os.path.abspath(path)
+        with cls.lock:
+            try:
+                return cls.inventories[path]
+            except KeyError:
+                self = super().__new__(cls)
+                self.path = Path(path)
+                self.journal = self.path / cls.journal_name
+                self.batch = batch
+                self.buffer: list[str] = []
+                self.buffer_lock = threading.Lock()
+                self._names: Optional[set[str]] = None
+                cls.inventories[path] = self
+                return self
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.path}>'
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    @property
+    def names(self) -> set[str]:
+        if self._names is None:
+            with self.buffer_lock:
+                if self._names is None:
+                    self._names = self._load()
+        return self._names
+
+    def _load(self) -> set[str]:
+        try:
+            stale = self.journal.stat().st_mtime_ns != self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            stale = True
+        if stale:
+            return self.scan()
+        with open(self.journal) as f:
+            return set(f.read().split('\n')) - {''}
+
+    def _stamp(self):
+        mtime = self.path.stat().st_mtime_ns
+        os.utime(self.journal, ns=(mtime, mtime))
+
+    def scan(self) -> set[str]:
+        """Rebuild the journal from a single pass over the directory."""
+        names: set[str] = set()
+        if self.path.is_dir():
+            with os.scandir(self.path) as it:
+                names.update(
+                    entry.name
+                    for entry in it
+                    if entry.name != self.journal_name
+                    and entry.is_file()
+                    and entry.stat().st_size
+                )
+            self._write(names)
+        self._names = names
+        return names
+
+    def _write(self, names: Iterable[str]):
+        tmp = self.journal.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            f.writelines(f'{name}\n' for name in names)
+        os.replace(tmp, self.journal)
+        self._stamp()
+
+    def bitmap(self, files: Iterable[Path | PackFile]) -> np.ndarray:
+        """Return a boolean array that is True where the file exists, aligned with files."""
+        files = list(files)
+        names = self.names
+        return np.fromiter(
+            (
+                file.exists()
+                if isinstance(file, PackFile)
+                else file.name in names
+                for file in files
+            ),
+            dtype=bool,
+            count=len(files),
+        )
+
+    def add(self, *names: str):
+        """Record that the files were written; the journal is appended in batches."""
+        self.names.update(names)
+        with self.buffer_lock:
+            self.buffer.extend(names)
+            if len(self.buffer) >= self.batch:
+                self._flush()
+
+    def discard(self, *names: str):
+        """Forget the files, e.g. after they were found to be invalid."""
+        self.flush()
+        self.names.difference_update(names)
+        with self.buffer_lock:
+            self._write(self.names)
+
+    def flush(self):
+        with self.buffer_lock:
+            self._flush()
+
+    def _flush(self):
+        buffer, self.buffer = self.buffer, []
+        if not buffer:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.journal, 'a') as f:
+            f.writelines(f'{name}\n' for name in buffer)
+        self._stamp()
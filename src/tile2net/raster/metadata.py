@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from os import PathLike
+from pathlib import Path
+from typing import Any, Callable
+
+from tile2net.logger import logger
+from tile2net.raster import util
+
+
+class MetadataCache:
+    """
+    JSON documents cached on disk by key, e.g. the layer_info of each
+    ArcGis source, so that resolving a source does not require a request
+    to every server on every run. An entry older than the ttl is fetched
+    again; if that fails, e.g. when offline, the stale entry is used.
+    """
+
+    def __init__(
+            self,
+            path: PathLike = None,
+            ttl: float = 7 * 24 * 60 * 60,
+    ):
+        """
+        Parameters
+        ----------
+        path : PathLike
+            directory of the cache; util.cache_dir('sources') by default
+        ttl : float
+            seconds after which an entry is fetched again
+        """
+        self._path = path
+        self.ttl = ttl
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self._path} ttl={self.ttl}>'
+
+    @property
+    def path(self) -> Path:
+        # the directory is only created when the cache is first used
+        if self._path is None:
+            self._path = util.cache_dir('sources')
+        return Path(self._path)
+
+    def file(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.path / f'{digest}.json'
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """Return the value cached for key, calling fetch if it is missing or expired."""
+        file = self.file(key)
+        entry = None
+        if file.exists():
+            try:
+                with open(file) as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                entry = None
+        if (
+                entry is not None
+                and time.time() - entry['fetched'] < self.ttl
+        ):
+            return entry['value']
+        try:
+            value = fetch()
+        except Exception as e:
+            if entry is None:
+                raise
+            logger.warning(
+                f'Could not refresh {key}, using the cached value from '
+                f'{time.ctime(entry["fetched"])}: {e}'
+            )
+            return entry['value']
+        self.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any):
+        file = self.file(key)
+        entry = dict(key=key, fetched=time.time(), value=value)
+        # write then rename so that concurrent runs never read a partial entry
+        fd, tmp = tempfile.mkstemp(dir=file.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, file)
+
+    def clear(self):
+        for file in self.path.glob('*.json'):
+            file.unlink(missing_ok=True)
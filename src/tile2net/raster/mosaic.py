@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from affine import Affine
+from rasterio.windows import Window
+
+from tile2net.logger import logger
+
+# circumference of the earth in web mercator, in metres
+EARTH = 2 * np.pi * 6378137
+
+
+def mercator_transform(xtile: int, ytile: int, zoom: int, step: int, size: int) -> Affine:
+    """
+    The Affine transform, in EPSG:3857, of a grid whose top left slippy tile
+    is (xtile, ytile), where every `size` pixels span `step` slippy tiles.
+    Slippy tiles are square in web mercator, so unlike EPSG:4326 a single
+    transform is exact for the whole grid.
+    """
+    length = EARTH / 2 ** zoom
+    res = length * step / size
+    left = xtile * length - EARTH / 2
+    top = EARTH / 2 - ytile * length
+    return Affine(res, 0, left, 0, -res, top)
+
+
+class Mosaic:
+    """
+    A single GeoTIFF of a grid of stitched tiles, such as the imagery or the
+    class-index predictions, rather than a file per tile.
+
+    Each stitched tile is written into its window as soon as it is ready,
+    from any thread; the file is tiled and compressed, and on close it is
+    converted to a Cloud Optimized GeoTIFF with internal overviews, so that
+    readers range-read the blocks that they need rather than scan a directory.
+    """
+
+    def __init__(
+            self,
+            path: os.PathLike | str,
+            xtile: int,
+            ytile: int,
+            shape: tuple[int, int],
+            zoom: int,
+            step: int,
+            size: int,
+            count: int = 3,
+            dtype: str = 'uint8',
+            nodata: int = None,
+            colormap: dict[int, tuple[int, ...]] = None,
+            compress: str = 'deflate',
+            resampling: str = 'average',
+    ):
+        """
+        Parameters
+        ----------
+        path : PathLike
+            path of the Cloud Optimized GeoTIFF
+        xtile : int
+            xtile of the top left slippy tile of the grid
+        ytile : int
+            ytile of the top left slippy tile of the grid
+        shape : tuple[int, int]
+            number of stitched tiles along x and along y
+        zoom : int
+            zoom level of the slippy tiles
+        step : int
+            number of slippy tiles along each side of a stitched tile
+        size : int
+            size of each stitched tile in pixels
+        count : int
+            number of bands; 3 for imagery, 1 for predictions
+        dtype : str
+            data type of the bands
+        nodata : int
+            value of the pixels of stitched tiles that are never written
+        colormap : dict[int, tuple[int, ...]]
+            color of each value of a single band, such as each class
+        compress : str
+            compression of the blocks
+        resampling : str
+            resampling of the overviews; 'average' for imagery,
+            'nearest' or 'mode' for classes
+        """
+        self.path = Path(path)
+        self.shape = shape
+        self.size = size
+        self.count = count
+        self.compress = compress
+        self.resampling = resampling
+        # blocks are aligned with the windows so that none is written twice
+        self.blocksize = 512 if size % 512 == 0 else 256
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.temp = self.path.with_name(f'.{self.path.stem}.tmp{self.path.suffix}')
+        self.dataset = rasterio.open(
+            self.temp, 'w',
+            driver='GTiff',
+            width=shape[0] * size,
+            height=shape[1] * size,
+            count=count,
+            dtype=dtype,
+            crs='EPSG:3857',
+            transform=mercator_transform(xtile, ytile, zoom, step, size),
+            nodata=nodata,
+            tiled=True,
+            blockxsize=self.blocksize,
+            blockysize=self.blocksize,
+            compress=compress,
+            BIGTIFF='IF_SAFER',
+        )
+        if colormap is not None:
+            self.dataset.write_colormap(1, colormap)
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.path} shape={self.shape}>'
+
+    def __enter__(self) -> Mosaic:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, array: np.ndarray, col: int, row: int):
+        """
+        Write a stitched tile, with shape (size, size) or (size, size, count),
+        into the window of the stitched tile at (col, row).
+        """
+        array = np.asarray(array)
+        if array.ndim == 2:
+            array = array[:, :, None]
+        if array.shape != (self.size, self.size, self.count):
+            raise ValueError(
+                f'{array.shape=} does not match {(self.size, self.size, self.count)}'
+            )
+        window = Window(col * self.size, row * self.size, self.size, self.size)
+        data = np.moveaxis(array, -1, 0).astype(self.dataset.dtypes[0], copy=False)
+        with self.lock:
+            self.dataset.write(data, window=window)
+            self.written += 1
+
+    def close(self) -> Optional[Path]:
+        """Convert the written tiles to a Cloud Optimized GeoTIFF with overviews."""
+        if self.dataset.closed:
+            return
+        self.dataset.close()
+        if not self.written:
+            self.temp.unlink(missing_ok=True)
+            return
+        rasterio.shutil.copy(
+            self.temp,
+            self.path,
+            driver='COG',
+            COMPRESS=self.compress,
+            BLOCKSIZE=self.blocksize,
+            OVERVIEW_RESAMPLING=self.resampling,
+            BIGTIFF='IF_SAFER',
+        )
+        self.temp.unlink(missing_ok=True)
+        logger.info(f'Wrote {self.written:,} tiles to {self.path}')
+        return self.path
+
+    def abort(self):
+        """Close and delete the partially written file."""
+        if not self.dataset.closed:
+            self.dataset.close()
+        self.temp.unlink(missing_ok=True)
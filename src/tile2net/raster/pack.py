@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import atexit
+import os
+import sqlite3
+import threading
+from os import PathLike
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+class TilePack:
+    """
+    Tiles stored in a single MBTiles (SQLite) file instead of one file per tile.
+
+    Tiles are indexed by (zoom_level, tile_column, tile_row); tile_row follows
+    the TMS convention of the MBTiles specification. Writes are buffered and
+    committed in batches of one transaction each. Instances are unique per path
+    within a process and pickle by path, so that a TilePack may be passed to
+    worker processes, each of which lazily opens its own connection.
+    """
+    packs: dict[str, TilePack] = {}
+    lock = threading.Lock()
+
+    def __new__(cls, path: PathLike, batch: int = 512):
+        path = os.path.abspath(path)
+        with cls.lock:
+            try:
+                return cls.packs[path]
+            except KeyError:
+                self = super().__new__(cls)
+                self._init(path, batch)
+                cls.packs[path] = self
+                return self
+
+    def _init(self, path: str, batch: int):
+        self.path = Path(path)
+        self.batch = batch
+        self.local = threading.local()
+        self.buffer: dict[tuple[int, int, int], bytes] = {}
+        self.buffer_lock = threading.Lock()
+        self.pid = None
+        self._keys: Optional[set[tuple[int, int, int]]] = None
+        atexit.register(self.flush)
+
+    def __reduce__(self):
+        return self.__class__, (self.path.__fspath__(), self.batch)
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.path}>'
+
+    def __fspath__(self):
+        return self.path.__fspath__()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # connections cannot be shared across processes or threads
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.local = threading.local()
+            self._keys = None
+        try:
+            return self.local.connection
+        except AttributeError:
+            ...
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.path, timeout=60)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        with con:
+            con.executescript('''
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS tiles (
+                    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS tile_index
+                    ON tiles (zoom_level, tile_column, tile_row);
+            ''')
+        self.local.connection = con
+        return con
+
+    @property
+    def keys(self) -> set[tuple[int, int, int]]:
+        # (zoom, x, y) of every tile in the pack, loaded once per process
+        connection = self.connection
+        if self._keys is None:
+            self._keys = {
+                (z, x, (1 << z) - 1 - row)
+                for z, x, row in connection.execute(
+                    'SELECT zoom_level, tile_column, tile_row FROM tiles'
+                )
+            }
+        return self._keys
+
+    @property
+    def metadata(self) -> dict[str, str]:
+        return dict(self.connection.execute('SELECT name, value FROM metadata'))
+
+    @metadata.setter
+    def metadata(self, value: dict):
+        with self.connection as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                ((str(k), str(v)) for k, v in value.items()),
+            )
+
+    def __contains__(self, key: tuple[int, int, int]) -> bool:
+        return key in self.keys
+
+    def read(self, z: int, x: int, y: int) -> bytes:
+        with self.buffer_lock:
+            if (z, x, y) in self.buffer:
+                return self.buffer[z, x, y]
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles '
+            'WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'{(z, x, y)} not in {self}')
+        return row[0]
+
+    def write(self, z: int, x: int, y: int, data: bytes):
+        keys = self.keys
+        with self.buffer_lock:
+            self.buffer[z, x, y] = data
+            keys.add((z, x, y))
+            if len(self.buffer) >= self.batch:
+                self._flush()
+
+    def delete(self, z: int, x: int, y: int):
+        self.flush()
+        with self.connection as con:
+            con.execute(
+                'DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                (z, x, (1 << z) - 1 - y),
+            )
+        self.keys.discard((z, x, y))
+
+    def flush(self):
+        """Commit the buffered writes in a single transaction."""
+        with self.buffer_lock:
+            self._flush()
+
+    def _flush(self):
+        buffer, self.buffer = self.buffer, {}
+        if not buffer:
+            return
+        with self.connection as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                (
+                    (z, x, (1 << z) - 1 - y, data)
+                    for (z, x, y), data in buffer.items()
+                ),
+            )
+
+    def files(self) -> Iterator[PackFile]:
+        # yields a PackFile for each tile in the pack; stitched packs name
+        # their files r_c_i from the metadata written by Stitched.write_metadata
+        self.flush()
+        metadata = self.metadata
+        extension = metadata.get('format', 'png')
+        for z, x, y in sorted(self.keys):
+            if 'step' in metadata:
+                step = int(metadata['step'])
+                r = (x - int(metadata['xtile'])) // step
+                c = (y - int(metadata['ytile'])) // step
+                i = r * int(metadata['columns']) + c
+                name = f'{r}_{c}_{i}.{extension}'
+            else:
+                name = f'{x}_{y}.{extension}'
+            yield PackFile(self, z, x, y, name)
+
+
+class PackFile:
+    """
+    A tile within a TilePack, implementing the subset of Path
+    that is used for tiles: exists, read_bytes, write_bytes, and unlink.
+    """
+    __slots__ = 'pack', 'zoom', 'xtile', 'ytile', 'name'
+
+    def __init__(self, pack: TilePack, zoom: int, xtile: int, ytile: int, name: str):
+        # numpy integers would be stored by sqlite as blobs
+        self.pack = pack
+        self.zoom = int(zoom)
+        self.xtile = int(xtile)
+        self.ytile = int(ytile)
+        self.name = name
+
+    def __reduce__(self):
+        return self.__class__, (self.pack, self.zoom, self.xtile, self.ytile, self.name)
+
+    def __repr__(self):
+        return f'{self.pack.path}{os.sep}{self.name}'
+
+    __str__ = __repr__
+
+    def __eq__(self, other):
+        return (
+                isinstance(other, PackFile)
+                and self.pack is other.pack
+                and self.key == other.key
+        )
+
+    def __hash__(self):
+        return hash((self.pack.path, self.key))
+
+    def __lt__(self, other: PackFile):
+        return self.name < other.name
+
+    @property
+    def key(self) -> tuple[int, int, int]:
+        return self.zoom, self.xtile, self.ytile
+
+    @property
+    def stem(self) -> str:
+        return self.name.rpartition('.')[0]
+
+    @property
+    def suffix(self) -> str:
+        return '.' + self.name.rpartition('.')[2]
+
+    def exists(self) -> bool:
+        return self.key in self.pack
+
+    def read_bytes(self) -> bytes:
+        return self.pack.read(*self.key)
+
+    def write_bytes(self, data: bytes):
+        self.pack.write(*self.key, data)
+
+    def unlink(self, missing_ok: bool = False):
+        if not missing_ok and not self.exists():
+            raise FileNotFoundError(self)
+        self.pack.delete(*self.key)
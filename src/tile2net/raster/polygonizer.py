@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import rasterio
+import shapely
+from affine import Affine
+from geopandas import GeoDataFrame
+from rasterio.windows import Window
+
+from tile2net.logger import logger
+from tile2net.raster.stitcher import attach, context
+from tile2net.raster.tile import BACKGROUND, CLASSES, Tile, fill_class_holes
+from tile2net.raster.tile_utils.geodata_utils import affine_transform
+
+
+def polygonize_slot(name, shape, slot, tile: Tile) -> Optional[GeoDataFrame]:
+    return tile.map_classes(attach(name, shape)[slot])
+
+
+def georeference(geoms: GeoDataFrame, transform: Affine, crs) -> Optional[GeoDataFrame]:
+    """
+    Simplifies polygons in the pixels of a mosaic, georeferences them in its
+    metric CRS, and fills their holes, as Tile.map_classes does those of a tile.
+
+    Parameters
+    ----------
+    geoms : :class:`GeoDataFrame`
+        polygons in pixels, with the class index of each in 'value'
+    transform : :class:`affine.Affine`
+        the transform of the mosaic
+    crs : :class:`rasterio.crs.CRS`
+        the metric CRS of the mosaic
+
+    Returns
+    -------
+    geoms : :class:`GeoDataFrame`
+        :class:`GeoDataFrame` of polygons in crs, or None if there are none
+    """
+    geometry = affine_transform(shapely.simplify(geoms.geometry.to_numpy(), .8), transform)
+    geoms = GeoDataFrame({'value': geoms['value'].to_numpy()}, geometry=geometry, crs=crs)
+    swcw = []
+    for class_name, class_id, class_hole_size in CLASSES:
+        geoms_class = geoms[geoms['value'] == class_id].reset_index(drop=True)
+        if geoms_class.empty:
+            continue
+        geoms_class['f_type'] = class_name
+        geoms_class = geoms_class[geoms_class['geometry'].notna()]
+        geoms_class = geoms_class[geoms_class['geometry'].is_valid]
+        swcw.append(fill_class_holes(geoms_class, class_hole_size))
+    if len(swcw) > 0:
+        # noinspection PyTypeChecker
+        rswcw: GeoDataFrame = pd.concat(swcw)
+        rswcw.reset_index(drop=True, inplace=True)
+        return rswcw
+
+
+def map_window(
+        classes: np.ndarray,
+        transform: Affine,
+        crs,
+        outer: Window,
+        core: Window = None,
+        nodata: int = None,
+) -> tuple[Optional[GeoDataFrame], GeoDataFrame]:
+    """
+    Converts the class indices of a window of a mosaic to polygons.
+
+    The regions are traced in the pixels of the whole mosaic, whose
+    coordinates are exact, so that the pieces of an object that are traced
+    in different windows match along their edges.
+
+    Parameters
+    ----------
+    classes : :class:`numpy.ndarray`
+        2D array of the class index of each pixel of outer
+    transform : :class:`affine.Affine`
+        the transform of the mosaic
+    crs : :class:`rasterio.crs.CRS`
+        the metric CRS of the mosaic
+    outer : :class:`rasterio.windows.Window`
+        the window of classes within the mosaic
+    core : :class:`rasterio.windows.Window`
+        the window within outer whose polygons are returned; outer by default
+    nodata : int
+        the value of the pixels that were never predicted
+
+    Returns
+    -------
+    polygons : :class:`GeoDataFrame`
+        the georeferenced polygons within core, or None if there are none
+    seams : :class:`GeoDataFrame`
+        the pieces within core of the regions that cross its edges, in
+        pixels, with the class index of each in 'value'; the pieces of all
+        windows are to be merged before they are georeferenced
+    """
+    mask = classes != BACKGROUND
+    if nodata is not None:
+        mask &= classes != nodata
+    geoms = Tile.labels_to_poly(
+        classes,
+        mask=mask,
+        transform=Affine.translation(outer.col_off, outer.row_off),
+        simplify=False,
+    )
+    if core is None:
+        core = outer
+    (top, bottom), (left, right) = core.toranges()
+    box = shapely.box(left, top, right, bottom)
+    geometry = geoms.geometry.to_numpy()
+    crossing = ~shapely.within(geometry, box)
+    # the regions that reach beyond the core are clipped to it, and those
+    # only within the halo are dropped
+    geometry = np.where(crossing, shapely.intersection(geometry, box), geometry)
+    kept = shapely.area(geometry) > 0
+    geoms = GeoDataFrame({'value': geoms['value'].to_numpy()[kept]}, geometry=geometry[kept])
+    crossing = crossing[kept]
+    seams = geoms[crossing].reset_index(drop=True)
+    polygons = geoms[~crossing]
+    if polygons.empty:
+        return None, seams
+    return georeference(polygons, transform, crs), seams
+
+
+def polygonize_window(
+        path: str,
+        window: Window,
+        halo: int,
+) -> tuple[Optional[GeoDataFrame], GeoDataFrame]:
+    """Polygonize a window of a predictions mosaic, reading a halo around it."""
+    with rasterio.open(path) as src:
+        full = Window(0, 0, src.width, src.height)
+        outer = Window(
+            window.col_off - halo,
+            window.row_off - halo,
+            window.width + 2 * halo,
+            window.height + 2 * halo,
+        ).intersection(full)
+        classes = src.read(1, window=outer)
+        return map_window(classes, src.transform, src.crs, outer, window, src.nodata)
+
+
+def polygonize_mosaic(
+        path: os.PathLike | str,
+        window: int = 4096,
+        halo: int = 256,
+        workers: int = None,
+) -> list[GeoDataFrame]:
+    """
+    Polygonizes a mosaic of class-index predictions, such as the Cloud
+    Optimized GeoTIFF written by Inference.validate, in windows rather than
+    tile by tile, in a pool of processes.
+
+    Each window keeps the polygons that are within it. The regions that
+    cross its edges are clipped to it, and their pieces from every window
+    are merged per class before they are simplified and their holes are
+    filled, so that objects of any extent are whole. Each window is read
+    with a halo so that the small regions across its edges are not dropped
+    for the area of their pieces. The polygons are in the CRS of the mosaic.
+
+    Parameters
+    ----------
+    path : PathLike
+        path of the mosaic
+    window : int
+        size of the windows in pixels; a multiple of the block size
+    halo : int
+        pixels around each window that are also read
+    workers : int
+        number of processes; os.cpu_count() by default
+
+    Returns
+    -------
+    list[GeoDataFrame]
+        the polygons within each window that has any, then those that
+        cross the windows
+    """
+    path = str(Path(path))
+    with rasterio.open(path) as src:
+        width, height = src.width, src.height
+        transform, crs = src.transform, src.crs
+    windows = [
+        Window(col, row, min(window, width - col), min(window, height - row))
+        for row in range(0, height, window)
+        for col in range(0, width, window)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(windows))
+    start = time.perf_counter()
+    polygons = []
+    seams = []
+    with ProcessPoolExecutor(workers, mp_context=context(__name__)) as pool:
+        for window_polygons, window_seams in pool.map(
+                polygonize_window, repeat(path), windows, repeat(halo),
+        ):
+            if window_polygons is not None:
+                polygons.append(window_polygons)
+            seams.append(window_seams)
+    seams: GeoDataFrame = pd.concat(seams)
+    if not seams.empty:
+        merged = (
+            seams
+            .dissolve('value')
+            .explode(index_parts=False)
+            .reset_index()
+        )
+        merged = georeference(merged, transform, crs)
+        if merged is not None:
+            polygons.append(merged)
+    logger.info(
+        f'Polygonized {len(windows):,} windows of {path} with {workers} workers '
+        f'in {time.perf_counter() - start:.1f}s'
+    )
+    return polygons
+
+
+class Polygonizer:
+    """
+    Polygonizes the predictions of stitched tiles in a pool of processes,
+    while the network infers the next batches.
+
+    The class indices of each prediction are copied into a slot that is
+    preallocated in shared memory, so that they are never pickled, and
+    only the polygons are returned. At most `slots` predictions are in
+    flight; submitting another blocks until one has been polygonized,
+    which bounds memory.
+    """
+
+    def __init__(
+            self,
+            workers: int = None,
+            slots: int = None,
+    ):
+        """
+        Parameters
+        ----------
+        workers : int
+            number of processes; os.cpu_count() by default
+        slots : int
+            number of predictions in flight; twice the number of workers by default
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.slots = slots or 2 * self.workers
+        # allocated once the size of the predictions is known
+        self.shape: Optional[tuple[int, int, int]] = None
+        self.shm: Optional[SharedMemory] = None
+        self.predictions: Optional[np.ndarray] = None
+        self.free = list(range(self.slots))
+        self.available = threading.Semaphore(self.slots)
+        self.lock = threading.Lock()
+        self.errors: list[BaseException] = []
+        self.polygons: dict[int, GeoDataFrame] = {}
+        self.count = 0
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=context(__name__))
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__qualname__} '
+            f'workers={self.workers} slots={self.slots}>'
+        )
+
+    def __enter__(self) -> Polygonizer:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _allocate(self, shape: tuple[int, ...]):
+        if self.shape is None:
+            self.shape = self.slots, *shape
+            self.shm = SharedMemory(create=True, size=int(np.prod(self.shape)))
+            self.predictions = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        elif self.shape[1:] != shape:
+            raise ValueError(f'prediction shape {shape} does not match {self.shape[1:]}')
+
+    def submit(self, tile: Tile, prediction: np.ndarray):
+        """Polygonize the class indices of the prediction of a tile in a worker."""
+        if self.errors:
+            raise self.errors[0]
+        self._allocate(prediction.shape)
+        # block until a slot is free
+        self.available.acquire()
+        with self.lock:
+            slot = self.free.pop()
+            index = self.count
+            self.count += 1
+
+        def done(future: Future):
+            try:
+                polygons = future.result()
+                if polygons is not None:
+                    with self.lock:
+                        self.polygons[index] = polygons
+            except BaseException as e:
+                self.errors.append(e)
+            finally:
+                with self.lock:
+                    self.free.append(slot)
+                self.available.release()
+
+        try:
+            self.predictions[slot] = prediction
+            future = self.pool.submit(
+                polygonize_slot, self.shm.name, self.shape, slot, tile,
+            )
+        except BaseException:
+            with self.lock:
+                self.free.append(slot)
+            self.available.release()
+            raise
+        future.add_done_callback(done)
+
+    def close(self) -> list[GeoDataFrame]:
+        """
+        Wait for the submitted predictions, release the slots, raise the
+        first error, and return the polygons in the order submitted.
+        """
+        start = time.perf_counter()
+        self.pool.shutdown(wait=True)
+        if self.count:
+            # the polygonizing that did not overlap with the network
+            logger.info(
+                f'Polygonized {self.count:,} tiles with {self.workers} workers, '
+                f'finishing {time.perf_counter() - start:.1f}s after the last was submitted'
+            )
+        if self.shm is not None:
+            self.predictions = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        if self.errors:
+            raise self.errors[0]
+        polygons, self.polygons = self.polygons, {}
+        return [polygons[index] for index in sorted(polygons)]
@@ -19,6 +19,9 @@ from more_itertools import *
 from numpy import ndarray
 from toolz.curried import *
 
+from tile2net.raster.inventory import Inventory
+from tile2net.raster.pack import PackFile, TilePack
+from tile2net.raster.tiles import TileArray
 
 if False:
     from tile2net.raster.raster import Raster
@@ -63,6 +66,21 @@ class Directory:
     def files(self, **kwargs) -> list[Path]:
         raise NotImplementedError
 
+    @property
+    def inventory(self) -> Inventory | None:
+        return None
+
+    def exists(self, files: list[Path | PackFile]) -> ndarray:
+        # whether each file exists, from the inventory if there is one
+        inventory = self.inventory
+        if inventory is None:
+            return np.fromiter(
+                (file.exists() for file in files),
+                dtype=bool,
+                count=len(files),
+            )
+        return inventory.bitmap(files)
+
     # @directory_property
     @property
     def path(self) -> Path:
@@ -290,14 +308,37 @@ class Static(Directory):
                 super().__fspath__(),
                 source.name,
                 f'{raster.base_tilesize}_{raster.zoom}'
-            )
+            ) + self.project.suffix
         elif raster.input_dir:
             return raster.input_dir.__fspath__()
         else:
             raise ValueError('raster has no source or input_dir')
 
+    @property
+    def pack(self) -> TilePack | None:
+        raster = self.project.raster
+        if raster.input_dir:
+            return raster.input_dir.pack
+        if self.project.storage == 'mbtiles':
+            return TilePack(self)
+
+    @property
+    def inventory(self) -> Inventory | None:
+        # an input_dir may be nested, e.g. z/x/y.png, and packs index themselves
+        if (
+                self.project.raster.input_dir
+                or self.project.storage == 'mbtiles'
+        ):
+            return None
+        return Inventory(self)
+
+    def mkdir(self):
+        if self.pack is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
 
-    def files(self, tiles: ndarray = None) -> Iterator[Path]:
+    def files(self, tiles: TileArray | ndarray = None) -> Iterator[Path | PackFile]:
         raster = self.project.raster
         if tiles is None:
             tiles = raster.tiles
@@ -307,39 +348,96 @@ class Static(Directory):
         # yield from raster.input_dir(tiles)
         if raster.input_dir:
             yield from raster.input_dir(tiles)
+            return
+        if isinstance(tiles, TileArray):
+            # read the columns rather than materializing each Tile
+            zoom = tiles.zoom
+            xy = zip(tiles.xtile.ravel().tolist(), tiles.ytile.ravel().tolist())
+        else:
+            zoom = raster.zoom
+            xy = ((tile.xtile, tile.ytile) for tile in tiles)
+        if self.project.storage == 'mbtiles':
+            pack = self.pack
+            yield from (
+                PackFile(pack, zoom, x, y, f'{x}_{y}.{extension}')
+                for x, y in xy
+            )
         else:
             dir = self.path
             dir.mkdir(parents=True, exist_ok=True)
             yield from (
-                dir / f'{tile.xtile}_{tile.ytile}.{extension}'
-                for tile in tiles
+                dir / f'{x}_{y}.{extension}'
+                for x, y in xy
             )
 
 
 
 class Stitched(Directory):
 
-    def files(self, tiles: ndarray = None) -> Iterator[str]:
+    def files(self, tiles: TileArray | ndarray = None) -> Iterator[Path | PackFile]:
         if tiles is None:
             tiles = self.project.raster.tiles
-        path = self.path
-        path.mkdir(parents=True, exist_ok=True)
-        path = path.__fspath__()
         R, C = np.meshgrid(
             np.arange(tiles.shape[0]),
             np.arange(tiles.shape[1]),
             indexing='ij'
         )
         extension = self.project.raster.extension
+        if self.project.storage == 'mbtiles':
+            # stitched tiles are keyed by their top left tile
+            pack = self.pack
+            for i, (r, c) in enumerate(zip(R.flat, C.flat)):
+                tile = tiles[r, c]
+                yield PackFile(pack, tile.zoom, tile.xtile, tile.ytile, f'{r}_{c}_{i}.{extension}')
+            return
+        path = self.path
+        path.mkdir(parents=True, exist_ok=True)
         for i, (r, c) in enumerate(zip(R.flat, C.flat)):
-            yield os.path.join(path, f'{r}_{c}_{i}.{extension}')
+            yield path / f'{r}_{c}_{i}.{extension}'
+
+    def write_metadata(self, tiles: TileArray | ndarray = None):
+        """
+        Record in the pack how the stitched tiles are named, so that the
+        r_c_i names can be derived from the keys when reading the pack;
+        tiles are those passed to files. Nothing is written without a pack.
+        """
+        pack = self.pack
+        if pack is None:
+            return
+        if tiles is None:
+            tiles = self.project.raster.tiles
+        tile = tiles[0, 0]
+        pack.metadata = dict(
+            format=self.project.raster.extension,
+            xtile=tile.xtile,
+            ytile=tile.ytile,
+            step=self.project.raster.stitch_step,
+            columns=tiles.shape[1],
+        )
+
+    @property
+    def pack(self) -> TilePack | None:
+        if self.project.storage == 'mbtiles':
+            return TilePack(self)
+
+    @property
+    def inventory(self) -> Inventory | None:
+        if self.project.storage == 'mbtiles':
+            return None
+        return Inventory(self)
+
+    def mkdir(self):
+        if self.pack is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
 
     def __fspath__(self):
         raster = self.project.raster
         return os.path.join(
             super().__fspath__(),
             f'{raster.base_tilesize}_{raster.zoom}_{raster.stitch_step}',
-        )
+        ) + self.project.suffix
 
 class Info(File):
     def __fspath__(self):
@@ -349,6 +447,25 @@ class Info(File):
             f'{raster.name}_{raster.tile_size}_{self.name}{self.extension}'
         )
 
+class MosaicFile(File):
+    def __fspath__(self):
+        raster = self.project.raster
+        return os.path.join(
+            self.parent,
+            f'{raster.name}_{raster.zoom}_{self.name}{self.extension}'
+        )
+
+
+class Mosaics(Directory):
+    def __get__(self, instance, owner) -> 'Mosaics':
+        # noinspection PyTypeChecker
+        return super().__get__(instance, owner)
+
+    # Cloud Optimized GeoTIFFs of the stitched tiles and of their predictions
+    imagery = MosaicFile('.tif')
+    predictions = MosaicFile('.tif')
+
+
 class Tiles(Directory):
     def __get__(self, instance, owner) -> 'Tiles':
         # noinspection PyTypeChecker
@@ -498,19 +615,27 @@ class Project(Directory):
     resources = Resources()
     config = Config('.py')
     segmentation = Segmentation()
+    mosaics = Mosaics()
+
+    storages = 'files', 'mbtiles'
 
     def __init__(
         self,
         name: str,
         outdir: PathLike,
-        raster: 'Raster'
+        raster: 'Raster',
+        storage: str = 'files',
     ):
         """
         file structure for tile2net project
         :param name:
         :param outdir:
         :param raster:
+        :param storage: 'files' for a file per tile, or 'mbtiles' for
+            static and stitched tiles packed in a single MBTiles file each
         """
+        if storage not in self.storages:
+            raise ValueError(f'{storage=} must be one of {self.storages}')
         # if ' ' in name:
         #     raise ValueError('Avoid spaces in project name')
         # if '.' in name:
@@ -527,6 +652,7 @@ class Project(Directory):
         self.parent = self.resources
         self.outdir = Path(outdir)
         self.raster = raster
+        self.storage = storage
 
         # noinspection PyTypeChecker
         # self.mkdirs()
@@ -559,6 +685,11 @@ class Project(Directory):
                 path = path.parent
             path.mkdir(parents=True, exist_ok=True)
 
+    @property
+    def suffix(self) -> str:
+        # suffix of the static and stitched tile directories
+        return '.mbtiles' if self.storage == 'mbtiles' else ''
+
     def rmdir(self):
         shutil.rmtree(self)
 
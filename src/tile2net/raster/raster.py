@@ -1,19 +1,17 @@
+import contextlib
 import inspect
 from tile2net.raster import util
-import subprocess
-import os
-import certifi
 import imageio.v2
 
 import sys
 
 import numpy as np
-import requests
 import itertools
+import threading
 
 from tqdm import tqdm
 
-from typing import Iterator, Optional, Type, Union
+from typing import Optional, Type, Union, TYPE_CHECKING
 
 from pathlib import Path
 from os import PathLike as _PathLike
@@ -23,15 +21,23 @@ from functools import cached_property
 
 from PIL import Image
 import toolz
-from toolz import curried, pipe, partial, curry
+from toolz import pipe, partial
 
 from tile2net.raster.grid import Grid
+from tile2net.raster.tiles import TileArray
+from tile2net.raster.tile import Tile
 from tile2net.raster.project import Project
 from tile2net.raster.source import Source
+from tile2net.raster.cache import TileCache
+from tile2net.raster.stitcher import Stitcher, VirtualTile
 from tile2net.raster.input_dir import InputDir
+from tile2net.raster.mosaic import Mosaic
 from tile2net.raster.validate import validate
 from tile2net.logger import logger
 
+if TYPE_CHECKING:
+    from tile2net.tileseg.inference import InferenceSession
+
 
 PathLike = Union[str, _PathLike]
 
@@ -157,6 +163,8 @@ class Raster(Grid):
         # extension: str = 'png',
         source: Source | Type[Source] = None,
         dump_percent: int = 0,
+        cache: TileCache | PathLike | bool = None,
+        storage: str = 'files',
     ):
         """
 
@@ -198,6 +206,14 @@ class Raster(Grid):
             tile source (default: None)
         dump_percent : int
             percentage of the tiles to dump (default: None)
+        cache : TileCache | PathLike | bool
+            tile cache shared across projects; True uses the default
+            cache directory, and a path uses a cache at that directory
+            (default: None)
+        storage : str
+            'files' to store each tile in its own file, or 'mbtiles' to store
+            the static and stitched tiles in a single MBTiles file each
+            (default: 'files')
         """
         if name is None:
             name = util.name_from_location(location)
@@ -246,6 +262,12 @@ class Raster(Grid):
             raise ValueError("Tile step must be a power of 2")
         if not 0 <= dump_percent <= 100:
             raise ValueError("Dump percent must be between 0 and 100")
+        if cache is True:
+            cache = TileCache()
+        elif not cache:
+            cache = None
+        elif not isinstance(cache, TileCache):
+            cache = TileCache(cache)
 
         self.zoom = zoom
         self.source = source
@@ -261,10 +283,10 @@ class Raster(Grid):
         self.input_dir: InputDir = input_dir
         self.source = source
         self.dump_percent = dump_percent
-
-        if boundary_path:
-            self.boundary_path = boundary_path
-            self.get_in_boundary(path=boundary_path)
+        self.cache: Optional[TileCache] = cache
+        # names of the static tiles that the source definitively does not
+        # have, e.g. outside its coverage, so that they are not requested again
+        self.absent: set[str] = set()
 
         super().__init__(
             location=location,
@@ -275,8 +297,14 @@ class Raster(Grid):
             tile_step=tile_step,
             padding=padding,
             output_dir=output_dir,
+            storage=storage,
         )
 
+        # the grid must exist before tiles can be made inactive
+        if boundary_path:
+            self.boundary_path = boundary_path
+            self.get_in_boundary(path=boundary_path)
+
     def __repr__(self):
         if self.boundary_path != -1:
             tiles_within = f"{(self.num_inside / self.num_tiles) * 100:.1f}"
@@ -339,7 +367,16 @@ class Raster(Grid):
     Stitch Tiles
     """
 
-    def stitch(self, step: int, force=False) -> None:
+    def stitch(
+            self,
+            step: int,
+            force=False,
+            stream=True,
+            encoder: str = 'pil',
+            compression: int = None,
+            workers: int = None,
+            mosaic: bool = False,
+    ) -> None:
         """
         Stitch tiles
 
@@ -349,6 +386,22 @@ class Raster(Grid):
             Stitch step.
                 The amount of tiles that an output file from the semantic segmentation will represent.
             For instance, to get a 512x512 tiles from the 256x256 base, the stitch step is 2
+        force : bool
+            Stitch all tiles, including those that were already stitched.
+        stream : bool
+            Stitch while downloading, assembling each stitched tile as soon as
+            its tiles have been downloaded; see Raster._stitch_stream.
+        encoder : str
+            'pil' or 'cv2'; the library that encodes the stitched tiles.
+        compression : int
+            The zlib level of PNG stitched tiles, from 0 (fastest) to 9 (smallest).
+            If None, the encoder's default is used.
+        workers : int
+            The number of processes that assemble and encode the stitched tiles.
+            If None, os.cpu_count() is used.
+        mosaic : bool
+            Also write the stitched tiles into a single Cloud Optimized GeoTIFF,
+            project.mosaics.imagery; every tile is stitched, as with force.
         extension : str
             File extension of the tiles. Default is 'png'.
         loc_abr : str
@@ -364,28 +417,21 @@ class Raster(Grid):
         self.stitch_step = step
         self.calculate_padding()
         self.update_tiles()
-        self.download()
-        self.project.tiles.stitched.path.mkdir(parents=True, exist_ok=True)
         if not (self.source or self.input_dir):
             raise RuntimeError(
                 "No source or input directory specified. Cannot stitch tiles."
             )
+        stitched = self.project.tiles.stitched
+        stitched.mkdir()
+        stitched.write_metadata(self.tiles[::step, ::step])
         outfiles = pipe(
             # self.tiles[:r:step, :c:step],
             self.tiles[::step, ::step],
-            self.project.tiles.stitched.files,
+            stitched.files,
             list,
         )
-        not_exists = [not os.path.exists(outfile) for outfile in outfiles]
-        if not force:
-            outfiles = list(itertools.compress(outfiles, not_exists))
-        if not outfiles:
-            logger.info(f"All tiles already stitched.")
-            return
+        not_exists = ~stitched.exists(outfiles)
 
-        infiles: np.ndarray = pipe(
-            self.tiles, self.project.tiles.static.files, list, np.array
-        )
         indices = np.arange(self.tiles.size).reshape((self.width, self.height))
         indices = (
             indices
@@ -399,145 +445,370 @@ class Raster(Grid):
             # flatten to get a list of merged tiles
             .reshape((-1, step * step))
         )
-        if not force:
+        # skip merged tiles that are entirely outside the boundary
+        keep = self.tiles.active.ravel()[indices].any(axis=1)
+        if not (force or mosaic):
             # filter for tiles that are not stitched
-            indices = indices[not_exists]
-        list_infiles = (
-            # get files from 2d indices to get list of lists
-            infiles
-            [indices]
-            .tolist()
-        )
-        assert len(list_infiles) == len(outfiles)
-        if not list_infiles:
-            # todo
+            keep &= not_exists
+        outfiles = list(itertools.compress(outfiles, keep))
+        indices = indices[keep]
+        if not outfiles:
+            self.download()
+            logger.info(f"All tiles already stitched.")
             return
 
-        threads = ThreadPoolExecutor()
-        if not any(
-                os.path.exists(file)
+        inventory = stitched.inventory
+
+        def write(file, data: bytes):
+            # encoded in memory so that files and tile packs are written alike
+            file.write_bytes(data)
+            if inventory is not None:
+                inventory.add(file.name)
+
+        # stitched tiles are written into the mosaic before the stitcher frees their canvas
+        mosaic = self.mosaic(self.project.mosaics.imagery) if mosaic else None
+        stitcher = Stitcher(
+            step,
+            size=self.base_tilesize,
+            extension=self.extension,
+            encoder=encoder,
+            compression=compression,
+            workers=workers,
+            mosaic=mosaic,
+        )
+        with mosaic or contextlib.nullcontext(), stitcher:
+            if stream and self.source:
+                done = self._stitch_stream(step, outfiles, indices, stitcher, write)
+                # groups with a tile that failed are retried by the download below
+                outfiles = list(itertools.compress(outfiles, ~done))
+                indices = indices[~done]
+            self.download()
+            if not outfiles:
+                self._flush_stitched()
+                return
+
+            static = self.project.tiles.static
+            infiles = list(static.files(self.tiles))
+            exists = static.exists(infiles)
+            # missing tiles are None so that they are not checked again
+            infiles: np.ndarray = np.array(infiles, dtype=object)
+            infiles[~exists] = None
+            list_infiles = (
+                # get files from 2d indices to get list of lists
+                infiles
+                [indices]
+                .tolist()
+            )
+            assert len(list_infiles) == len(outfiles)
+            if not list_infiles:
+                # todo
+                return
+
+            if not any(
+                    file is not None
+                    for file in itertools.chain.from_iterable(list_infiles)
+            ):
+                raise FileNotFoundError(
+                    f"No relevant tiles found in {self.project.tiles.static.path}. "
+                    f"If multiple sources were matched, consider specifying a different source."
+                )
+            sample: np.ndarray = next(
+                imageio.v3.imread(file.read_bytes())
                 for file in itertools.chain.from_iterable(list_infiles)
-        ):
-            raise FileNotFoundError(
-                f"No relevant tiles found in {self.project.tiles.static.path}. "
-                f"If multiple sources were matched, consider specifying a different source."
+                if file is not None
             )
-        sample: np.ndarray = next(
-            imageio.v3.imread(file)
-            for file in itertools.chain.from_iterable(list_infiles)
-            if os.path.exists(file)
+            if sample.shape[:2] != (self.base_tilesize, self.base_tilesize):
+                raise ValueError(
+                    f"Input tile size {sample.shape[:2]} does not match "
+                    f"expected tile size {self.base_tilesize}."
+                )
+
+            desc = f"Stitching {len(outfiles):,} tiles..."
+            desc = desc.rjust(len(desc) + 11).ljust(50)
+            for infiles, outfile, position in tqdm(
+                zip(list_infiles, outfiles, self._positions(indices, step)),
+                total=len(outfiles),
+                desc=desc,
+                # disable when piping
+                # disable=not sys.stdout.isatty()
+            ):
+                # workers read, assemble, and encode each group
+                stitcher.stitch(infiles, partial(write, outfile), position)
+        self._flush_stitched()
+
+    def _positions(self, indices: np.ndarray, step: int) -> list[tuple[int, int]]:
+        # the position of each stitched tile, from the flat index of its top left tile
+        col, row = np.divmod(indices[:, 0], self.height)
+        return list(zip((col // step).tolist(), (row // step).tolist()))
+
+    def _flush_stitched(self):
+        stitched = self.project.tiles.stitched
+        if stitched.inventory is not None:
+            stitched.inventory.flush()
+        if stitched.pack is not None:
+            stitched.pack.flush()
+
+    def mosaic(self, path: PathLike, count: int = 3, **kwargs) -> Mosaic:
+        """
+        A Mosaic covering the stitched tiles of the Raster, whether it is
+        stitching with stitch_step or was created with a tile_step that is
+        the stitch step, as in inference.
+
+        Parameters
+        ----------
+        path : PathLike
+            path of the Cloud Optimized GeoTIFF, such as project.mosaics.imagery
+        count : int
+            number of bands; 3 for imagery, 1 for predictions
+        kwargs
+            passed to Mosaic
+
+        Returns
+        -------
+        Mosaic
+            written with Mosaic.write(array, col, row), where (col, row) is
+            the position of the stitched tile r_c_i, that is (r, c)
+        """
+        step = self.stitch_step
+        shape = self.tiles[::step, ::step].shape
+        step *= self.tile_step
+        return Mosaic(
+            path,
+            self.xtile,
+            self.ytile,
+            shape,
+            zoom=self.zoom,
+            step=step,
+            size=self.base_tilesize * step,
+            count=count,
+            **kwargs,
         )
-        if sample.shape[:2] != (self.base_tilesize, self.base_tilesize):
-            raise ValueError(
-                f"Input tile size {sample.shape[:2]} does not match "
-                f"expected tile size {self.base_tilesize}."
-            )
 
-        gval = 0
-        gray = np.full(
-            (self.base_tilesize, self.base_tilesize, 3), gval, dtype=np.uint8
+    def virtual_stitched(self) -> list[VirtualTile]:
+        """
+        The stitched tiles of a Raster whose tile_step is the stitch step,
+        such as one created with Raster.from_info after Raster.generate,
+        as VirtualTiles that are assembled from the static tiles when read;
+        no stitched files are read or written. Stitched tiles without any
+        static tile on disk are skipped, as Raster.stitch skips them.
+
+        Returns
+        -------
+        list[VirtualTile]
+            named as the files of Raster.stitch, in the same order
+        """
+        step = self.tile_step
+        width, height = self.tiles.shape
+        base = TileArray.from_grid(
+            self.xtile,
+            self.ytile,
+            width * step,
+            height * step,
+            zoom=self.zoom,
+            size=self.base_tilesize,
+            crs=self.crs,
         )
-        gval = np.full(3, 0)
-
-        def imread(file) -> np.ndarray:
-            # just returns a gray tile if the file doesn't exist
-            if not os.path.exists(file):
-                return gray
-            res = imageio.v3.imread(file)
-            return res
-
-        def gen_infiles():
-            """
-            Generator that yields lists of lists of input files.
-            Each list of input files is a list of files to merge into a single output file.
-            The generator yields a list of input files each time a list of output files is yielded.
-            This allows the generator to preemptively load the next list of input files while the
-            current list of input files is being processed.
-
-            Returns
-            -------
-            list[list[str]]
-                List of lists of input files.
-            """
-            it_infiles = iter(list_infiles)
-            # load first two lists
-            # first: list[Future] = [
-            #     threads.submit(imageio.v2.imread, infile)
-            #     for infile in next(it_infiles)
-            # ]
-            first: list[Future] = [
-                threads.submit(imread, infile)
-                for infile in next(it_infiles)
-            ]
-            try:
-                second: list[Future] = [
-                    threads.submit(imread, infile)
-                    for infile in next(it_infiles)
-                ]
-            except StopIteration:
-                yield [
-                    future.result()
-                    for future in first
-                ]
-                return
-            else:
-                yield [
-                    future.result()
-                    for future in first
-                ]
-            first = second
-
-            # preemptively load the next list each time a list is yielded
-
-            while True:
-                try:
-                    second = [
-                        threads.submit(imread, infile)
-                        for infile in next(it_infiles)
-                    ]
-                except StopIteration:
-                    break
-                yield [
-                    future.result()
-                    for future in first
-                ]
-                first = second
-            yield [
-                future.result()
-                for future in first
-            ]
+        static = self.project.tiles.static
+        infiles = list(static.files(base))
+        exists = static.exists(infiles)
+        # missing tiles are None so that they are assembled as black
+        infiles: np.ndarray = np.array(infiles, dtype=object)
+        infiles[~exists] = None
+        indices = np.arange(base.size).reshape(base.shape)
+        indices = (
+            indices
+            [::step, ::step]
+            .reshape((-1, 1, 1))
+            .__add__(indices[:step, :step])
+            .reshape((-1, step * step))
+        )
+        keep = exists[indices].any(axis=1)
+        extension = self.extension
+        return [
+            VirtualTile(infiles[group].tolist(), step, self.base_tilesize, f'{r}_{c}_{i}.{extension}')
+            for i, ((r, c), group) in enumerate(zip(np.ndindex(width, height), indices))
+            if keep[i]
+        ]
 
+    def _stitch_stream(
+            self,
+            step: int,
+            outfiles: list,
+            indices: np.ndarray,
+            stitcher: Stitcher,
+            write,
+    ) -> np.ndarray:
+        """
+        Stitch while downloading. Each tile is decoded once, and each group of
+        step x step tiles is assembled and written as soon as all of its tiles
+        are present. Downloads are requested group by group; the tiles of a
+        group that are already on disk are only read once its downloads have
+        arrived, and groups that are entirely on disk are assembled alongside
+        the downloads. Only the groups with downloads in flight hold decoded
+        tiles, and at most queue_size tiles wait to be decoded or assembled,
+        so memory is bounded regardless of the size of the raster.
+        Downloaded tiles are still written to the static directory, but they
+        are not read back. Tiles that the source definitively does not have
+        are gray, and are recorded in Raster.absent so that they are not
+        requested again.
+
+        Parameters
+        ----------
+        step : int
+            stitch step
+        outfiles : list
+            stitched files to be written
+        indices : np.ndarray
+            flat indices of the tiles of each stitched file, in column-major order
+        stitcher : Stitcher
+            assembles and encodes each group as it is completed
+        write : Callable
+            writes an encoded stitched file
+
+        Returns
+        -------
+        np.ndarray
+            whether each stitched file was written; a group with a tile that
+            failed to download is not written
+        """
+        paths, missing = self._missing()
         size = self.base_tilesize
-        writes = []
-        shape = self.base_tilesize * step, self.base_tilesize * step, 4
+        n = step * step
+        gray = np.zeros((size, size, 3), dtype=np.uint8)
+
+        # the group of each tile, and its position within the group
+        group = np.full(self.tiles.size, -1)
+        member = np.full(self.tiles.size, -1)
+        group[indices.ravel()] = np.repeat(np.arange(len(indices)), n)
+        member[indices.ravel()] = np.tile(np.arange(n), len(indices))
+        failed = np.zeros(len(indices), dtype=bool)
+        done = np.zeros(len(indices), dtype=bool)
+        # the downloaded tiles of the groups that are still downloading
+        images: dict[int, list[np.ndarray]] = {}
+        lock = threading.Lock()
+        errors: list[Exception] = []
+
+        is_missing = np.zeros(self.tiles.size, dtype=bool)
+        is_missing[missing] = True
+        members = indices.ravel()
+        downloads = members[is_missing[members]]
+        # the downloads that each group waits for
+        pending = np.bincount(group[downloads], minlength=len(indices))
+        # tiles that are not downloaded are read if they are on disk; inactive
+        # tiles and those that the source does not have are otherwise gray
+        reads = members[~is_missing[members]]
+        static = self.project.tiles.static
+        is_read = np.zeros(self.tiles.size, dtype=bool)
+        is_read[reads] = static.exists([paths[index] for index in reads])
+        tiles = self.tiles.flat
+        positions = self._positions(indices, step)
+
         desc = f"Stitching {len(outfiles):,} tiles..."
         desc = desc.rjust(len(desc) + 11).ljust(50)
-        # shape = imageio.imread_v2(infiles[0]).shape
-        CANVAS = np.zeros(shape, dtype=np.uint8)
-        CANVAS[:, :, 3] = 255
-        for infiles, outfile in tqdm(
-            zip(gen_infiles(), outfiles),
-            total=len(outfiles),
-            desc=desc,
-            # disable when piping
-            # disable=not sys.stdout.isatty()
-        ):
-            canvas = CANVAS.copy()
-            for i, infile in enumerate(infiles):
-                # the grid is transposed so the row and column indices are swapped
-                r = i % step * size
-                c = i // step * size
-                infile = np.array(infile)
-                canvas[r : r + size, c : c + size, : infile.shape[2]] = infile
-            loc = canvas[:, :, 3] != 255
-            loc |= (canvas[:, :, :3] == 0).all(axis=2)
-            canvas[loc, :3] = gval
-            canvas = canvas[:, :, :3]
-            writes.append(threads.submit(imageio.v3.imwrite, outfile, canvas))
-
-        for write in writes:
-            write.result()
-        threads.shutdown(wait=True)
+        progress = tqdm(total=len(outfiles), desc=desc)
+
+        def check(image: np.ndarray):
+            if image.shape[:2] != (size, size):
+                raise ValueError(
+                    f"Input tile size {image.shape[:2]} does not match "
+                    f"expected tile size {size}."
+                )
+
+        def assemble(g: int, group_images: list[np.ndarray] = None):
+            # read the tiles of the group that are on disk, then encode it
+            if group_images is None:
+                group_images = [gray] * n
+            for index in indices[g]:
+                if is_read[index]:
+                    image = imageio.v3.imread(paths[index].read_bytes())
+                    check(image)
+                    group_images[member[index]] = image
+            stitcher.encode(group_images, partial(written, g), positions[g])
+
+        def place(index: int, image: Optional[np.ndarray]):
+            # image is None if the tile failed to download
+            if image is not None:
+                check(image)
+            g = group[index]
+            with lock:
+                if image is None:
+                    failed[g] = True
+                else:
+                    images.setdefault(g, [gray] * n)[member[index]] = image
+                pending[g] -= 1
+                if pending[g]:
+                    return
+                group_images = images.pop(g, None)
+                if failed[g]:
+                    return
+            assemble(g, group_images)
+
+        def written(g: int, data: bytes):
+            write(outfiles[g], data)
+            done[g] = True
+            progress.update()
+
+        def decode(index: int, content: bytes):
+            try:
+                image = imageio.v3.imread(content)
+            except (ValueError, OSError):
+                place(index, None)
+                return
+            self._store(tiles[index], paths[index], content)
+            place(index, image)
+
+        slots = threading.BoundedSemaphore(self.source.downloader.queue_size)
+
+        def task(func, *args):
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor() as threads:
+            def submit(func, *args):
+                # block rather than buffer decoded tiles without bound
+                slots.acquire()
+                threads.submit(task, func, *args)
+
+            def feed():
+                # the groups that are entirely on disk do not wait for the network
+                for g in np.flatnonzero(pending == 0):
+                    if errors:
+                        break
+                    submit(assemble, g)
+
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            try:
+                urls = list(self.source[[tiles[index] for index in downloads]])
+                responses = self.source.downloader.iter(urls) if urls else ()
+                for response in responses:
+                    if errors:
+                        break
+                    index = downloads[response.index]
+                    if response.content is not None:
+                        submit(decode, index, response.content)
+                    elif response.missing:
+                        self.absent.add(paths[index].name)
+                        submit(place, index, gray)
+                    else:
+                        submit(place, index, None)
+            except Exception as e:
+                # stop the feeder before the threads shut down
+                errors.append(e)
+                raise
+            finally:
+                feeder.join()
+        # wait for the groups that are still being encoded
+        stitcher.join()
+        progress.close()
+        self._flush_static()
+        if errors:
+            raise errors[0]
+        return done
 
     """
     Download Tiles 
@@ -547,111 +818,155 @@ class Raster(Grid):
         """
         Download tiles from the source.
 
+        Tiles are fetched by the source's downloader, which retries each tile
+        individually with backoff; tiles that still fail are attempted once more.
+        If the Raster has a cache, cached tiles are linked into the project
+        instead of downloaded, and downloaded tiles are added to the cache.
+        Which tiles exist is read from the directory's inventory rather
+        than checked file by file.
+
         Parameters
         ----------
         retry : bool
-            When True, tries to serialize tiles a second time if the first time fails
+            When True, tries to download the tiles that failed a second time
         Returns
         -------
         None
         """
-        with (
-            ThreadPoolExecutor(max_workers=5) as threads,
-            requests.Session() as session,
-        ):
-            if not self.source:
-                return
-            self.project.tiles.static.path.mkdir(parents=True, exist_ok=True)
-
-            paths = self.project.tiles.static.files()
-            urls = list(self.source[self.tiles.flat])
-            desc = f"Checking {self.tiles.size:,} files..."
-            desc = desc.rjust(len(desc) + 11).ljust(50)
-            submit = partial(session.get, verify=certifi.where())
-            downloads = {
-                threads.submit(submit, url=url): path
-                for url, path in tqdm(
-                    zip(urls, paths),
-                    total=self.tiles.size,
-                    desc=desc,
-                    # disable when piping
-                    # disable=not sys.stdout.isatty()
+        if not self.source:
+            return
+        paths, missing = self._missing()
+        tiles = [self.tiles.flat[index] for index in missing]
+        paths = [paths[index] for index in missing]
+        if missing.size:
+            failed = self._download(tiles, paths)
+        else:
+            failed = {}
+
+        if failed:
+            path, url = next(iter(failed.items()))
+            if retry:
+                logger.error(
+                    f"{len(failed):,} tiles failed to download, one of which is "
+                    f"{path} from {url}. Trying again."
                 )
-                if not path.exists()
-            }
-
-            def submit(
-                path: Path,
-                content: bytes,
-            ) -> Optional[Path]:
-                # return path if failed
-                path.write_bytes(content)
-                try:
-                    imageio.v3.imread(path)
-                except ValueError:
-                    path.unlink()
-                    return path
-
-            def write(futures: Iterator[Future]):
-                for future in futures:
-                    response: requests.Response = future.result()
-                    path = downloads[future]
-                    try:
-                        response.raise_for_status()
-                    except requests.exceptions.HTTPError:
-                        continue
-                    else:
-                        yield threads.submit(submit, path, response.content)
-
-            if downloads:
-                desc = f"Downloading {len(downloads):,} tiles..."
-                desc = desc.rjust(len(desc) + 11).ljust(50)
-                writes = pipe(
-                    downloads,
-                    as_completed,
-                    curry(
-                        tqdm,
-                        total=len(downloads),
-                        desc=desc,
-                        # disable when piping
-                        # disable=not sys.stdout.isatty(),
-                    ),
-                    write,
-                    list,
+                tiles, paths = zip(*(
+                    (tile, path)
+                    for tile, path in zip(tiles, paths)
+                    if path in failed
+                ))
+                failed = self._download(tiles, paths)
+            if failed:
+                path, url = next(iter(failed.items()))
+                raise FileNotFoundError(
+                    f"{len(failed):,} tiles failed to download, one of which is "
+                    f"{path} from {url}."
                 )
-                if not writes:
-                    logger.warning(
-                        f"Downloads were attempted, but not a single image was written to file. "
-                        f"Check that everything is correct for {self.source=}."
-                    )
-            else:
-                writes = []
-
-            failed_paths = pipe(
-                writes,
-                as_completed,
-                curried.map(Future.result),
-                curried.filter(Path.__instancecheck__),
-                list,
+        if self.absent:
+            logger.info(
+                f"{self.num_active - len(self.absent):,} of {self.num_active:,} active "
+                f"tiles are on disk; the source does not have the other {len(self.absent):,}.",
             )
-            if any(failed_paths):
-                path: Path = failed_paths[0]
-                i = next(i for i, p in enumerate(downloads.values()) if p == path)
-                url = urls[i]
-                if retry:
-                    logger.error(
-                        f"{len(failed_paths):,} tiles failed to serialize, one of which is "
-                        f"{failed_paths[0]} from {url}. Trying again."
-                    )
-                    self.download(retry=False)
-                else:
-                    raise FileNotFoundError(
-                        f"{len(failed_paths):,} tiles failed to serialize, one of which is "
-                        f"{failed_paths[0]} from {url}."
-                    )
+        else:
             logger.info(
-                f"All {self.tiles.size} tiles are on disk.",
+                f"All {self.num_active:,} active tiles are on disk.",
+            )
+
+    def _missing(self) -> tuple[list[Path], np.ndarray]:
+        """
+        Returns the static files of all tiles and the flat indices of
+        the active tiles that are missing, after linking any that are cached.
+        """
+        static = self.project.tiles.static
+        static.mkdir()
+        paths = list(static.files())
+        missing = np.flatnonzero(~static.exists(paths) & self.tiles.active.ravel())
+        if self.absent:
+            missing = missing[np.array(
+                [paths[index].name not in self.absent for index in missing], dtype=bool,
+            )]
+        if missing.size and self.cache:
+            name = self.source.name
+            materialized = np.fromiter(
+                (
+                    self.cache.materialize(name, tile.zoom, tile.xtile, tile.ytile, paths[index])
+                    for index in missing
+                    for tile in [self.tiles.flat[index]]
+                ),
+                dtype=bool,
+                count=missing.size,
             )
+            self.cache.flush()
+            if static.inventory is not None:
+                static.inventory.add(*(paths[index].name for index in missing[materialized]))
+            missing = missing[~materialized]
+        return paths, missing
+
+    def _store(self, tile: Tile, path: Path, content: bytes):
+        # write a downloaded tile to the static directory and the cache
+        if self.cache:
+            self.cache.put(
+                self.source.name, tile.zoom, tile.xtile, tile.ytile, content, dst=path
+            )
+        else:
+            path.write_bytes(content)
+        inventory = self.project.tiles.static.inventory
+        if inventory is not None:
+            inventory.add(path.name)
+
+    def _flush_static(self):
+        static = self.project.tiles.static
+        if self.cache:
+            self.cache.flush()
+        if static.inventory is not None:
+            static.inventory.flush()
+        if static.pack is not None:
+            static.pack.flush()
+
+    def _download(self, tiles: list[Tile], paths: list[Path]) -> dict[Path, str]:
+        # returns the paths that failed, mapped to their urls
+        urls = list(self.source[tiles])
+        failed: dict[Path, str] = {}
+
+        def write(index: int, content: bytes) -> Optional[int]:
+            # return index if failed
+            try:
+                imageio.v3.imread(content)
+            except (ValueError, OSError):
+                return index
+            self._store(tiles[index], paths[index], content)
+
+        desc = f"Downloading {len(urls):,} tiles..."
+        desc = desc.rjust(len(desc) + 11).ljust(50)
+        with ThreadPoolExecutor() as threads:
+            writes: list[Future] = []
+            for response in tqdm(
+                    self.source.downloader.iter(urls),
+                    total=len(urls),
+                    desc=desc,
+                    # disable when piping
+                    # disable=not sys.stdout.isatty(),
+            ):
+                path = paths[response.index]
+                if response.content is not None:
+                    writes.append(threads.submit(write, response.index, response.content))
+                elif response.missing:
+                    self.absent.add(path.name)
+                else:
+                    failed[path] = response.url
+
+            if not writes:
+                logger.warning(
+                    f"Downloads were attempted, but not a single image was written to file. "
+                    f"Check that everything is correct for {self.source=}."
+                )
+            for future in as_completed(writes):
+                index = future.result()
+                if index is not None:
+                    failed[paths[index]] = urls[index]
+        self._flush_static()
+
+        return failed
 
     def save_info_json(self, **kwargs):
         """
@@ -673,6 +988,7 @@ class Raster(Grid):
             "zoom": self.zoom,
             "crs": self.crs,
             "tile_step": self.tile_step,
+            "storage": self.storage,
             "project": dict(self.project.structure),
         }
         if self.source:
@@ -714,7 +1030,15 @@ class Raster(Grid):
             json.dump(data, f, indent=4)
 
     @validate
-    def generate(self, step):
+    def generate(
+            self,
+            step,
+            encoder: str = 'pil',
+            compression: int = None,
+            workers: int = None,
+            virtual: bool = False,
+            mosaic: bool = False,
+    ):
         """
         generates the project structure,
         creates the tiles and saves the info json file
@@ -723,8 +1047,29 @@ class Raster(Grid):
         ----------
         step : int
             tile step to stitch the tiles
+        encoder : str
+            'pil' or 'cv2'; see Raster.stitch
+        compression : int
+            zlib level of PNG stitched tiles; see Raster.stitch
+        workers : int
+            number of processes that stitch; see Raster.stitch
+        virtual : bool
+            only download the tiles, without writing stitched tiles;
+            inference then assembles them with --virtual_stitch
+        mosaic : bool
+            also write the stitched tiles into a Cloud Optimized GeoTIFF;
+            see Raster.stitch
         """
-        self.stitch(step)
+        if virtual and mosaic:
+            raise ValueError('The imagery mosaic is written while stitching; it requires virtual=False')
+        if virtual:
+            # see Raster.virtual_stitched
+            self.stitch_step = step
+            self.calculate_padding()
+            self.update_tiles()
+            self.download()
+        else:
+            self.stitch(step, encoder=encoder, compression=compression, workers=workers, mosaic=mosaic)
         self.save_info_json(new_tstep=step)
         logger.info(f"Dumping to {self.project.tiles.info}")
         json.dump(
@@ -738,49 +1083,84 @@ class Raster(Grid):
     def inference(
         self,
         eval_folder: str = None,
+        virtual_stitch: bool = False,
+        mosaic: bool = False,
+        polygonize_mosaic: bool = False,
+        device: str = None,
+        channels_last: bool = False,
+        bf16: bool = False,
+        batch_size: int = None,
+        session: "InferenceSession" = None,
     ):
         """
-        runs the inference on the tiles
+        runs the inference on the tiles in this process
 
         Parameters
         ----------
         eval_folder : str
             path to the folder containing the images to run inference on
+        virtual_stitch : bool
+            assemble the stitched tiles from the static tiles while loading
+            them, rather than reading them from the stitched folder
+        mosaic : bool
+            also write the predictions into a Cloud Optimized GeoTIFF,
+            project.mosaics.predictions
+        polygonize_mosaic : bool
+            write the predictions mosaic and polygonize it in windows,
+            rather than polygonizing each stitched tile
+        device : str
+            'cpu', 'cuda', or 'cuda:N'; the GPU if there is one by default
+        channels_last : bool
+            run the network in the channels_last memory format
+        bf16 : bool
+            run the network under bfloat16 autocast where it is supported
+        batch_size : int
+            stitched tiles per forward pass; 1 by default
+        session : InferenceSession
+            reuse the network that a session has already loaded, e.g. for
+            successive rasters; device, channels_last, bf16, and batch_size
+            are then those of the session, and may not be passed
         """
-        info = toolz.get_in(
-            "project tiles info".split(),
-            self.save_info_json(return_dict=True),
-            no_default=True,
-        )
-        args = [
-            "python",
-            "-m",
-            "tile2net",
-            "inference",
-            "--city_info",
-            str(info),
-            "--interactive",
-            "--dump_percent",
-            str(self.dump_percent),
-        ]
-        logger.info(f"Running {args}")
-        if eval_folder:
-            args.extend(["--eval_folder", str(eval_folder)])
-        try:
-            # todo: capture_outputs=False if want instant printout
-            subprocess.run(
-                args,
-                check=True,
-                capture_output=True,
-                text=True,
+        from tile2net.tileseg.inference import InferenceSession
+
+        if session is not None:
+            given = [
+                name
+                for name, value in dict(
+                    device=device,
+                    channels_last=channels_last,
+                    bf16=bf16,
+                    batch_size=batch_size,
+                ).items()
+                if value not in (None, False)
+            ]
+            if given:
+                raise ValueError(
+                    f"{', '.join(given)} cannot be passed with a session, "
+                    f"which has its own; pass them to InferenceSession instead"
+                )
+        else:
+            session = InferenceSession(
+                device=device,
+                batch_size=batch_size,
+                channels_last=channels_last,
+                bf16=bf16,
             )
-        except subprocess.CalledProcessError as e:
-            logger.error(
-                f"Command {e.cmd} returned non-zero exit status {e.returncode}.\n"
-                f"Stdout: {e.stdout}\n"
-                f"Stderr: {e.stderr}"
+        with tqdm(desc=f"Inferring {self.name}", unit="tile") as bar:
+
+            def progress(done: int, total: int):
+                bar.total = total
+                bar.update(done - bar.n)
+
+            session.infer(
+                self,
+                eval_folder=eval_folder,
+                virtual_stitch=virtual_stitch,
+                mosaic=mosaic,
+                polygonize_mosaic=polygonize_mosaic,
+                dump_percent=self.dump_percent,
+                progress=progress,
             )
-            raise e
 
     def __hash__(self):
         return id(self)
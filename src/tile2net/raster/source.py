@@ -7,15 +7,19 @@ from abc import ABC, ABCMeta
 from typing import Iterator, Optional, Type
 from weakref import WeakKeyDictionary
 
+import numpy as np
 import pandas as pd
 import pyproj
 import requests
+import shapely
 import shapely.geometry
 import shapely.geometry
 import shapely.ops
 from geopandas import GeoSeries
 from toolz import curry, pipe
 from tile2net.raster import util
+from tile2net.raster.download import Downloader
+from tile2net.raster.metadata import MetadataCache
 
 from tile2net.logger import logger
 
@@ -23,70 +27,91 @@ from tile2net.logger import logger
 if False:
     from tile2net.raster.tile import Tile
 
+@functools.cache
+def transformer() -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs('epsg:4326', 'epsg:3857', always_xy=True)
+
+
 class SourceMeta(ABCMeta):
     catalog: dict[str, Type[Source]] = {}
+    # layer_info and coverages persist across runs; see MetadataCache
+    metadata_cache = MetadataCache()
 
     @classmethod
     @property
-    def coverage(cls) -> GeoSeries:
+    def projected(cls) -> GeoSeries:
+        # coverage of every source in EPSG:3857; the geometries are cached on disk
         coverages: list[GeoSeries] = []
         for source in cls.catalog.values():
-            try:
-                axis = pd.Index([source.name] * len(source.coverage), name='source')
-                coverage = (
+            def fetch() -> list[str]:
+                return (
                     source.coverage
                     .set_crs('epsg:4326')
-                    .set_axis(axis)
+                    .to_crs(3857)
+                    .to_wkb(hex=True)
+                    .tolist()
                 )
+
+            try:
+                wkb = cls.metadata_cache.get(f'coverage {source.name} {source.tiles}', fetch)
             except Exception as e:
                 logger.error(
                     f'Could not get coverage for {source.name}, skipping:\n'
                     f'{e}'
                 )
             else:
+                axis = pd.Index([source.name] * len(wkb), name='source')
+                coverage = GeoSeries.from_wkb(wkb, index=axis, crs=3857)
                 coverages.append(coverage)
 
-        coverage = pd.concat(coverages)
+        projected = pd.concat(coverages)
+        cls.projected = projected
+        return projected
+
+    @classmethod
+    @property
+    def coverage(cls) -> GeoSeries:
+        coverage = SourceMeta.projected.to_crs(4326)
         cls.coverage = coverage
         return coverage
 
+    @classmethod
+    @property
+    def tree(cls) -> shapely.STRtree:
+        # spatial index over the projected coverages, aligned by position
+        tree = shapely.STRtree(SourceMeta.projected.values)
+        cls.tree = tree
+        return tree
+
     def __getitem__(
         cls: Type[Source],
         item: list[float] | str | shapely.geometry.base.BaseGeometry,
     ) -> Optional['Source']:
         # todo: index index for which sources contain keyword
         original = item
-        matches: GeoSeries = (
-            cls.__class__.coverage.geometry
-            .to_crs(3857)
-        )
+        projected: GeoSeries = SourceMeta.projected
+        loc = np.ones(len(projected), dtype=bool)
         if isinstance(item, list):
             s, w, n, e = item
             display_name = util.reverse_geocode(item).casefold()
-            # noinspection PyTypeChecker
-            coverage: GeoSeries = SourceMeta.coverage
-            index = set(coverage.index)
-            loc = [
+            names = [
                 source.name
-                for source in cls.catalog.values() if
-                source.name in index
-                and source.keyword.casefold() in display_name
+                for source in cls.catalog.values()
+                if source.keyword.casefold() in display_name
             ]
-            matches = matches.loc[loc]
-            if matches.empty:
+            loc = projected.index.isin(names)
+            if not loc.any():
                 logger.warning(
                     f'No source was found to have a matching keyword with {display_name}'
                 )
             item = shapely.geometry.box(w, s, e, n)
 
         if isinstance(item, shapely.geometry.base.BaseGeometry):
-            trans = pyproj.Transformer.from_crs(
-                'epsg:4326', 'epsg:3857', always_xy=True
-            ).transform
-            item = shapely.ops.transform(trans, item)
+            item = shapely.ops.transform(transformer().transform, item)
 
-            loc = matches.intersects(item)
-            matches = matches.loc[loc]
+            hits = np.zeros(len(projected), dtype=bool)
+            hits[SourceMeta.tree.query(item, predicate='intersects')] = True
+            matches = projected.loc[loc & hits]
             if matches.empty:
                 return None
                 # raise KeyError(f'No source found for {item}')
@@ -134,6 +159,7 @@ class Source(ABC, metaclass=SourceMeta):
     tiles: str = None
     tilesize: int = 256  # pixels per tile side
     keyword: str  # required match when reverse geolocating address from point
+    downloader = Downloader()  # fetches the tiles; override to tune the pool or concurrency per server
 
     def __getitem__(self, item: Iterator[Tile]):
         tiles = self.tiles
@@ -209,17 +235,23 @@ class ArcGis(Source, ABC):
     @class_attr
     @property
     def layer_info(cls):
-        response = requests.get(cls.metadata)
-        response.raise_for_status()
-        text = response.text
-        try:
-            res = json.loads(text)
-        except json.JSONDecodeError as e:
-            logger.error(f'Could not parse JSON from stdin: {e}')
-            logger.error(f'{cls.metadata=}; {cls.server=}')
-            logger.error(f'JSON: {text}')
-            raise
-        return res
+        def fetch():
+            response = requests.get(cls.metadata)
+            response.raise_for_status()
+            text = response.text
+            try:
+                res = json.loads(text)
+            except json.JSONDecodeError as e:
+                logger.error(f'Could not parse JSON from stdin: {e}')
+                logger.error(f'{cls.metadata=}; {cls.server=}')
+                logger.error(f'JSON: {text}')
+                raise
+            if 'error' in res:
+                # ArcGIS reports errors with a successful status; do not cache them
+                raise ValueError(f'{cls.metadata} returned {res["error"]}')
+            return res
+
+        return SourceMeta.metadata_cache.get(cls.metadata, fetch)
 
     @class_attr
     @property
@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import imageio.v3
+import numpy as np
+
+from tile2net.logger import logger
+from tile2net.raster.mosaic import Mosaic
+from tile2net.raster.pack import PackFile
+
+ENCODERS = 'pil', 'cv2'
+
+# canvases attached by each worker process, by the name of their shared memory
+attached: dict[str, tuple[SharedMemory, np.ndarray]] = {}
+
+
+def context(module: str) -> multiprocessing.context.BaseContext:
+    """The context of a pool of processes whose work is in a module."""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        # workers are forked from a server that has imported the module once,
+        # rather than from a parent that may be running threads
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([module])
+    else:
+        context = multiprocessing.get_context('spawn')
+    return context
+
+
+def attach(name: str, shape: tuple[int, ...]) -> np.ndarray:
+    try:
+        return attached[name][1]
+    except KeyError:
+        ...
+    shm = SharedMemory(name)
+    canvases = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    attached[name] = shm, canvases
+    return canvases
+
+
+def mask(canvas: np.ndarray) -> np.ndarray:
+    """
+    Black out the pixels of an RGBA canvas that are not fully opaque and
+    return its RGB view. Pixels that are already black need no masking.
+    """
+    rgb = canvas[:, :, :3]
+    np.copyto(rgb, 0, where=canvas[:, :, 3:] != 255)
+    return rgb
+
+
+def assemble(canvas: np.ndarray, images: Sequence[Optional[np.ndarray]], step: int) -> np.ndarray:
+    """
+    Assemble step x step tiles, listed in column-major order, into an
+    RGBA canvas; missing tiles, which are None, are black.
+    """
+    size = canvas.shape[0] // step
+    canvas[:, :, 3] = 255
+    for i, image in enumerate(images):
+        # the grid is transposed so the row and column indices are swapped
+        r = i % step * size
+        c = i // step * size
+        if image is None:
+            canvas[r: r + size, c: c + size, :3] = 0
+            continue
+        image = np.asarray(image)
+        if image.shape[:2] != (size, size):
+            raise ValueError(
+                f"Input tile size {image.shape[:2]} does not match "
+                f"expected tile size {size}."
+            )
+        canvas[r: r + size, c: c + size, : image.shape[2]] = image
+    return canvas
+
+
+def encode(
+        rgb: np.ndarray,
+        extension: str,
+        encoder: str = 'pil',
+        compression: int = None,
+) -> bytes:
+    """
+    Encode an RGB image with Pillow or OpenCV; compression is the zlib
+    level, from 0 to 9, of PNG images, and is ignored by other formats.
+    """
+    extension = extension.lstrip('.').lower()
+    if encoder == 'cv2':
+        import cv2
+        params = []
+        if compression is not None and extension == 'png':
+            params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+        ok, buffer = cv2.imencode(f'.{extension}', rgb[:, :, ::-1], params)
+        if not ok:
+            raise ValueError(f'OpenCV could not encode .{extension}')
+        return buffer.tobytes()
+    if encoder == 'pil':
+        from PIL import Image
+        kwargs = {}
+        if compression is not None and extension == 'png':
+            kwargs['compress_level'] = compression
+        buffer = io.BytesIO()
+        format = Image.registered_extensions()[f'.{extension}']
+        Image.fromarray(rgb).save(buffer, format=format, **kwargs)
+        return buffer.getvalue()
+    raise ValueError(f'{encoder=} must be one of {ENCODERS}')
+
+
+def imread(file: Optional[Path | PackFile]) -> Optional[np.ndarray]:
+    # missing tiles are None
+    if file is None:
+        return None
+    try:
+        return imageio.v3.imread(file.read_bytes())
+    except FileNotFoundError:
+        # the inventory is stale
+        return None
+
+
+class VirtualTile:
+    """
+    A stitched tile that is assembled from its step x step tiles when it is
+    read, rather than read from a stitched file. It is picklable, so that
+    DataLoader workers read and assemble the tiles themselves.
+    """
+    __slots__ = 'files', 'step', 'size', 'name'
+
+    def __init__(
+            self,
+            files: Sequence[Optional[Path | PackFile]],
+            step: int,
+            size: int,
+            name: str,
+    ):
+        """
+        Parameters
+        ----------
+        files : Sequence[Optional[Path | PackFile]]
+            the step x step tiles in column-major order; missing tiles are None
+        step : int
+            stitch step
+        size : int
+            size of each tile in pixels
+        name : str
+            name of the stitched file that this tile replaces
+        """
+        self.files = list(files)
+        self.step = step
+        self.size = size
+        self.name = name
+
+    def __reduce__(self):
+        return self.__class__, (self.files, self.step, self.size, self.name)
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.name}>'
+
+    def __lt__(self, other: VirtualTile):
+        return self.name < other.name
+
+    @property
+    def stem(self) -> str:
+        return self.name.rpartition('.')[0]
+
+    @property
+    def suffix(self) -> str:
+        return '.' + self.name.rpartition('.')[2]
+
+    @property
+    def missing(self) -> float:
+        """The fraction of the stitched tile that is black because its tiles are missing."""
+        return sum(file is None for file in self.files) / len(self.files)
+
+    def read(self) -> np.ndarray:
+        """Assemble the tiles into an RGB array, as Raster.stitch would have encoded it."""
+        length = self.size * self.step
+        canvas = np.empty((length, length, 4), dtype=np.uint8)
+        assemble(canvas, [imread(file) for file in self.files], self.step)
+        return mask(canvas)
+
+
+def encode_slot(name, shape, slot, extension, encoder, compression) -> bytes:
+    canvas = attach(name, shape)[slot]
+    return encode(mask(canvas), extension, encoder, compression)
+
+
+def stitch_slot(name, shape, slot, files, step, extension, encoder, compression) -> bytes:
+    canvas = attach(name, shape)[slot]
+    assemble(canvas, [imread(file) for file in files], step)
+    return encode(mask(canvas), extension, encoder, compression)
+
+
+class Stitcher:
+    """
+    Assembles and encodes stitched tiles in a pool of processes.
+
+    Canvases are preallocated in shared memory, one per slot, so that
+    pixels are never pickled: a worker either reads the tiles of a group
+    itself and assembles them in its slot, or encodes a slot that was
+    assembled by the caller, and only the encoded file is returned. At
+    most `slots` groups are in flight, which bounds memory.
+    """
+
+    def __init__(
+            self,
+            step: int,
+            size: int = 256,
+            extension: str = 'png',
+            encoder: str = 'pil',
+            compression: int = None,
+            workers: int = None,
+            slots: int = None,
+            mosaic: Mosaic = None,
+    ):
+        """
+        Parameters
+        ----------
+        step : int
+            stitch step; each canvas is step x step tiles
+        size : int
+            size of each tile in pixels
+        extension : str
+            format of the stitched tiles
+        encoder : str
+            'pil' or 'cv2'
+        compression : int
+            zlib level of PNG images, from 0 (fastest) to 9 (smallest);
+            the encoder's default if None
+        workers : int
+            number of processes; os.cpu_count() by default
+        slots : int
+            number of canvases; twice the number of workers by default
+        mosaic : Mosaic
+            also writes each group that has a position into this mosaic
+        """
+        if encoder not in ENCODERS:
+            raise ValueError(f'{encoder=} must be one of {ENCODERS}')
+        if compression is not None and not 0 <= compression <= 9:
+            raise ValueError(f'{compression=} must be between 0 and 9')
+        self.step = step
+        self.extension = extension
+        self.encoder = encoder
+        self.compression = compression
+        self.mosaic = mosaic
+        self.workers = workers or os.cpu_count() or 1
+        slots = slots or 2 * self.workers
+        self.shape = slots, size * step, size * step, 4
+        self.shm = SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self.canvases = np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.free = list(range(slots))
+        self.available = threading.Semaphore(slots)
+        self.lock = threading.Lock()
+        self.errors: list[BaseException] = []
+        self.count = 0
+        self.start = time.perf_counter()
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=context(__name__))
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__qualname__} step={self.step} '
+            f'workers={self.workers} slots={self.shape[0]}>'
+        )
+
+    def __enter__(self) -> Stitcher:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _acquire(self) -> int:
+        # block until a canvas is free
+        self.available.acquire()
+        with self.lock:
+            return self.free.pop()
+
+    def _submit(self, slot: int, write: Callable[[bytes], None], position, func, *args):
+        def done(future: Future):
+            try:
+                data = future.result()
+                if position is not None and self.mosaic is not None:
+                    # the worker assembled and masked the canvas in place
+                    self.mosaic.write(self.canvases[slot][:, :, :3], *position)
+                write(data)
+            except BaseException as e:
+                self.errors.append(e)
+            finally:
+                with self.lock:
+                    self.free.append(slot)
+                    self.count += 1
+                self.available.release()
+
+        if self.errors:
+            self.available.release()
+            with self.lock:
+                self.free.append(slot)
+            raise self.errors[0]
+        future = self.pool.submit(
+            func, self.shm.name, self.shape, slot, *args,
+            self.extension, self.encoder, self.compression,
+        )
+        future.add_done_callback(done)
+
+    def stitch(
+            self,
+            files: Sequence[Optional[Path | PackFile]],
+            write: Callable[[bytes], None],
+            position: tuple[int, int] = None,
+    ):
+        """
+        Read, assemble, and encode a group of files in a worker, then write
+        the result, and the canvas into the mosaic at position (col, row).
+        """
+        slot = self._acquire()
+        self._submit(slot, write, position, stitch_slot, list(files), self.step)
+
+    def encode(
+            self,
+            images: Sequence[Optional[np.ndarray]],
+            write: Callable[[bytes], None],
+            position: tuple[int, int] = None,
+    ):
+        """
+        Assemble a group of decoded tiles, encode it in a worker, then write
+        the result, and the canvas into the mosaic at position (col, row).
+        """
+        slot = self._acquire()
+        try:
+            assemble(self.canvases[slot], images, self.step)
+        except BaseException:
+            with self.lock:
+                self.free.append(slot)
+            self.available.release()
+            raise
+        self._submit(slot, write, position, encode_slot)
+
+    def join(self):
+        """Wait until every submitted group has been written, and raise the first error."""
+        slots = self.shape[0]
+        for _ in range(slots):
+            self.available.acquire()
+        for _ in range(slots):
+            self.available.release()
+        if self.errors:
+            raise self.errors[0]
+
+    def close(self):
+        """Wait for the submitted groups, release the canvases, and raise the first error."""
+        self.pool.shutdown(wait=True)
+        elapsed = time.perf_counter() - self.start
+        tiles = self.count * self.step * self.step
+        if tiles:
+            logger.info(
+                f'Stitched {tiles:,} tiles in {elapsed:.1f}s '
+                f'({tiles / elapsed:,.0f} tiles/sec) with {self.workers} workers'
+            )
+        del self.canvases
+        self.shm.close()
+        self.shm.unlink()
+        if self.errors:
+            raise self.errors[0]
@@ -7,7 +7,7 @@ import skimage
 import shapely
 import geopandas as gpd
 import pyproj
-from shapely.geometry import Polygon, shape
+from shapely.geometry import Polygon
 from pyproj import Transformer
 from affine import Affine
 import json
@@ -19,7 +19,7 @@ from rasterio import features
 from tile2net.raster.tile_utils.genutils import num2deg
 from tile2net.raster.tile_utils.topology import fill_holes, replace_convexhull
 from tile2net.raster.tile_utils.geodata_utils import _reduce_geom_precision, list_to_affine, _check_skimage_im_load, \
-    to_metric
+    to_metric, affine_transform
 
 from dataclasses import dataclass, field
 from functools import cached_property
@@ -28,6 +28,28 @@ from typing import Optional
 
 tempdir = tempfile.gettempdir()
 
+# the classes of the predictions that are polygonized, in order: the name,
+# the class index, and the maximum area of the holes that are filled
+CLASSES = (
+    ('sidewalk', 0, 25),
+    ('crosswalk', 2, 15),
+    ('road', 1, 30),
+)
+# the class index of the background, which is not polygonized
+BACKGROUND = 3
+
+
+def fill_class_holes(geoms_class: gpd.GeoDataFrame, class_hole_size) -> gpd.GeoDataFrame:
+    """
+    Fills the holes of the polygons of a class, in a metric CRS, that are
+    smaller than class_hole_size, and replaces the convex polygons with
+    their hulls
+    """
+    exploded = geoms_class.explode(index_parts=False).reset_index(drop=True)
+    filtered = exploded[~exploded["geometry"].isna()]
+    filtered["geometry"] = filtered.apply(fill_holes, args=(class_hole_size,), axis=1)
+    return replace_convexhull(filtered)
+
 
 @dataclass
 class Tile:
@@ -49,17 +71,12 @@ class Tile:
         """
         Initialize the tile object
         """
-        self.top = num2deg(self.xtile, self.ytile, self.zoom)[0]  # latitude of top left
-
-        self.left = num2deg(self.xtile, self.ytile, self.zoom)[1]  # longitude of top left
-
-        self.bottom = \
-            num2deg(self.xtile + self.tile_step, self.ytile + self.tile_step, self.zoom)[
-                0]  # latitude of bottom right
-
-        self.right = \
-            num2deg(self.xtile + self.tile_step, self.ytile + self.tile_step, self.zoom)[
-                1]  # longitude of bottom right
+        # latitude, longitude of top left
+        self.top, self.left = num2deg(self.xtile, self.ytile, self.zoom)
+        # latitude, longitude of bottom right
+        self.bottom, self.right = num2deg(
+            self.xtile + self.tile_step, self.ytile + self.tile_step, self.zoom
+        )
 
         self.im_name = f'{self.xtile}_{self.ytile}.{self.extension}'
         # self.ped_poly = gpd.GeoDataFrame()
@@ -113,7 +130,7 @@ class Tile:
         self.bottom, self.right = num2deg(self.xtile + self.tile_step,
                                           self.ytile + self.tile_step, self.zoom)
 
-    @property
+    @cached_property
     def bbox(self):
         """
         Returns the bounding box of the tile
@@ -126,10 +143,11 @@ class Tile:
         self.setLatlon()
         return self.bottom, self.top, self.left, self.right
 
-    @property
+    @cached_property
     def tfm(self):
         """
-        Calculate the affinity object of each tile from its bounding box
+        Calculate the affinity object of each tile from its bounding box;
+        computed once, as the tile does not move
 
         Returns
         -------
@@ -272,33 +290,48 @@ class Tile:
             mask_image = skimage.io.imread(os.path.join(src_img, f'{self.im_name}'))
         # using the masks defined here, the sidewalks are blue and hence index 2(3rd position in RGB)
         # sidewalks
-        tfm_ = self.tfm
         f_class = mask_image[:, :, class_id]
         has_class: bool = np.any(f_class != 0)
         if has_class is not False:
             geoms_class: gpd.GeoDataFrame = self.mask_to_poly_geojson(f_class)
-            if not geoms_class.empty:
-                geoms_class['geometry'] = geoms_class['geometry'].apply(self.convert_poly_coords, affine_obj=tfm_)
-                geoms_class = geoms_class.set_crs(epsg=str(self.crs))
-                geoms_class['f_type'] = class_name
-                geoms_class = geoms_class[geoms_class['geometry'].notna()]
-                geoms_class = geoms_class[geoms_class['geometry'].apply(lambda x: x.is_valid)]
-
-                if class_hole_size is not None:
-                    goems_class_met = to_metric(geoms_class).explode().reset_index(drop=True)
-                    goems_class_filtered = goems_class_met[~goems_class_met["geometry"].isna()]
-                    goems_class_filtered["geometry"] = \
-                        goems_class_filtered.apply(fill_holes, args=(class_hole_size,), axis=1)
-                    simplified = replace_convexhull(goems_class_filtered)
-                    simplified.to_crs(self.crs, inplace=True)
-                    return simplified
-                else:
-                    return geoms_class
-            else:
-                return False
+            return self.georeference(geoms_class, class_name, class_hole_size)
         else:
             return False
 
+    def georeference(self, geoms_class, class_name, class_hole_size=25):
+        """
+        Converts the polygons of a class from pixel coordinates to the
+        coordinates of the tile, and fills their holes
+
+        Parameters
+        ----------
+        geoms_class : :class:`GeoDataFrame`
+            polygons of the class in pixel coordinates
+        class_name : str
+            name of the class, exp: 'sidewalk'
+        class_hole_size : int, optional
+            the maximum area of holes to be filled, by default 25
+
+        Returns
+        -------
+        geoms : :class:`GeoDataFrame`
+            :class:`GeoDataFrame` of polygons, or False if there are none
+        """
+        if geoms_class.empty:
+            return False
+        geoms_class['geometry'] = affine_transform(geoms_class['geometry'], self.tfm)
+        geoms_class = geoms_class.set_crs(epsg=str(self.crs))
+        geoms_class['f_type'] = class_name
+        geoms_class = geoms_class[geoms_class['geometry'].notna()]
+        geoms_class = geoms_class[geoms_class['geometry'].apply(lambda x: x.is_valid)]
+
+        if class_hole_size is not None:
+            simplified = fill_class_holes(to_metric(geoms_class), class_hole_size)
+            simplified.to_crs(self.crs, inplace=True)
+            return simplified
+        else:
+            return geoms_class
+
     def map_features(self, src_img, img_array=True):
         """
         Converts a raster mask to a :class:`GeoDataFrame` of polygons
@@ -345,6 +378,37 @@ class Tile:
             rswcw.reset_index(drop=True, inplace=True)
             return rswcw
 
+    def map_classes(self, classes: np.ndarray) -> Optional[gpd.GeoDataFrame]:
+        """
+        Converts a prediction of class indices to a :class:`GeoDataFrame` of
+        polygons, as map_features does its colorized mask, but labeling the
+        regions of every class in a single pass
+
+        Parameters
+        ----------
+        classes : :class:`numpy.ndarray`
+            2D array of the class index of each pixel
+
+        Returns
+        -------
+        geoms : :class:`GeoDataFrame`
+            :class:`GeoDataFrame` of polygons, or None if there are none
+        """
+        classes = np.asarray(classes, dtype=np.uint8)
+        # each region is a connected component of a single class, as in its own binary mask
+        geoms = self.labels_to_poly(classes, mask=classes != BACKGROUND)
+        swcw = []
+        for class_name, class_id, class_hole_size in CLASSES:
+            geoms_class = geoms[geoms['value'] == class_id].reset_index(drop=True)
+            geoms_class = self.georeference(geoms_class, class_name, class_hole_size)
+            if geoms_class is not False:
+                swcw.append(geoms_class)
+        if len(swcw) > 0:
+            # noinspection PyTypeChecker
+            rswcw: gpd.GeoDataFrame = pd.concat(swcw)
+            rswcw.reset_index(drop=True, inplace=True)
+            return rswcw
+
     def get_region(self, gdf: gpd.GeoDataFrame, spatial_index, crs=3857):
         """
         Clips the overlapping region between a given GeoDataframe and a :class:`GeoDataFrame.sindex` when creating masks. 
@@ -524,7 +588,6 @@ class Tile:
             A :class:`GeoDataFrame` of polygons.
 
         """
-        from shapely.validation import make_valid
         mask_arr = self.preds_to_binary(pred_arr, channel_scaling, bg_threshold)
 
         if do_transform and reference_im is None:
@@ -543,27 +606,74 @@ class Tile:
         mask = mask_arr > bg_threshold
         mask = mask.astype('uint8')
 
-        polygon_generator = features.shapes(mask_arr,
-                                            transform=transform,
-                                            mask=mask)
-        polygons = []
-        values = []  # pixel values for the polygon in mask_arr
-        for polygon, value in polygon_generator:
+        return self.labels_to_poly(mask_arr, mask, transform, crs, min_area, simplify, tolerance)
 
-            p = shape(polygon).buffer(0.0)
-            polygon = make_valid(p)
-            if p.area >= min_area:
-                polygons.append(shape(polygon).buffer(0.0))
-                values.append(value)
+    @staticmethod
+    def labels_to_poly(labels, mask, transform=None, crs=None, min_area=20, simplify=True, tolerance=0.8):
+        """
+        Get the polygons of the regions of equal value of an array, as
+        mask_to_poly_geojson does those of a binary mask.
+
+        Parameters
+        ----------
+        labels : :class:`numpy.ndarray`
+            A 2D array of integers
+        mask : :class:`numpy.ndarray`
+            A 2D boolean array of the pixels to polygonize
+        transform : :class:`affine.Affine`, optional
+            The transform of the polygons; the identity by default
+        crs : :class:`rasterio.crs.CRS`, optional
+            The CRS of the polygons; none by default
+        min_area, simplify, tolerance
+            as in mask_to_poly_geojson
+
+        Returns
+        -------
+        gdf : :class:`geopandas.GeoDataFrame`
+            A :class:`GeoDataFrame` of polygons, with the value of each in 'value'.
+        """
+        if transform is None:
+            transform = Affine(1, 0, 0, 0, 1, 0)  # identity transform
+        if crs is None:
+            crs = rasterio.crs.CRS()
+
+        rings = []
+        ring_counts = []
+        values = []  # pixel values for the polygon in labels
+        for polygon, value in features.shapes(labels, transform=transform, mask=mask):
+            coordinates = polygon['coordinates']
+            rings.extend(coordinates)
+            ring_counts.append(len(coordinates))
+            values.append(value)
+
+        if rings:
+            # construct every polygon at once; the first ring of each is its exterior
+            ring_lengths = [len(ring) for ring in rings]
+            coords = np.fromiter(
+                (xy for ring in rings for point in ring for xy in point),
+                dtype=float,
+                count=2 * sum(ring_lengths),
+            ).reshape(-1, 2)
+            linearrings = shapely.linearrings(
+                coords, indices=np.repeat(np.arange(len(rings)), ring_lengths),
+            )
+            polygons = shapely.polygons(
+                linearrings, indices=np.repeat(np.arange(len(values)), ring_counts),
+            )
+            polygons = shapely.buffer(polygons, 0.0)
+            keep = shapely.area(polygons) >= min_area
+            polygons = shapely.buffer(shapely.make_valid(polygons[keep]), 0.0)
+            values = np.asarray(values)[keep]
+            if simplify:
+                polygons = shapely.simplify(polygons, tolerance)
+        else:
+            polygons = []
 
         polygon_gdf = gpd.GeoDataFrame({'geometry': polygons, 'value': values},
                                        crs=crs.to_wkt())
-        if simplify:
-            polygon_gdf['geometry'] = polygon_gdf['geometry'].apply(
-                lambda x: x.simplify(tolerance=tolerance)
-            )
 
         return polygon_gdf
+
     @staticmethod
     def get_geo_transform(raster_src):
         """
@@ -3,6 +3,8 @@ import os
 import glob
 import math
 import shutil
+
+import numpy as np
 from PIL import Image
 import psutil
 import random
@@ -61,6 +63,62 @@ def num2deg(xtile, ytile, zoom):
     return lat_deg, lon_deg
 
 
+def deg2num_array(lat_deg, lon_deg, zoom):
+    """
+    vectorized deg2num: converts arrays of lat/lon to the tiles of the
+    EPSG:3857 pyramid that contain them
+    Parameters
+    ----------
+    lat_deg: array_like
+        latitudes in degrees
+    lon_deg: array_like
+        longitudes in degrees
+    zoom: int
+        zoom level of the tiles
+
+    Returns
+    -------
+    xtile: np.ndarray
+        xcoordinates of the tiles in xyz system
+    ytile: np.ndarray
+        ycoordinates of the tiles in xyz system
+    """
+    lat_rad = np.radians(np.asarray(lat_deg, dtype=float))
+    lon_deg = np.asarray(lon_deg, dtype=float)
+    n = 2.0 ** zoom
+    # truncate, as int() does in deg2num
+    xtile = ((lon_deg + 180.0) / 360.0 * n).astype(np.int64)
+    ytile = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+    return xtile, ytile
+
+
+def num2deg_array(xtile, ytile, zoom):
+    """
+    vectorized num2deg: converts arrays of tile coordinates of the
+    EPSG:3857 pyramid to the lat/lon of their top left corners
+    Parameters
+    ----------
+    xtile: array_like
+        xcoordinates of the tiles in xyz system
+    ytile: array_like
+        ycoordinates of the tiles in xyz system
+    zoom: int
+        zoom level of the tiles
+
+    Returns
+    -------
+    lat_deg: np.ndarray
+
+    lon_deg: np.ndarray
+
+    """
+    n = 2.0 ** zoom
+    lon_deg = np.asarray(xtile, dtype=float) / n * 360.0 - 180.0
+    lat_rad = np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(ytile, dtype=float) / n)))
+    lat_deg = np.degrees(lat_rad)
+    return lat_deg, lon_deg
+
+
 def path_check(pathchk):
     """
     Checks if the output file exists and asks the user if he wants to overwrite it or not
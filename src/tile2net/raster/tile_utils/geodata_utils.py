@@ -128,6 +128,31 @@ def list_to_affine(xform_mat: list):
         return Affine(*xform_mat)
 
 
+def affine_transform(geoms, affine_obj: affine.Affine) -> np.ndarray:
+    """
+    Apply an affine transformation to the coordinates of every geometry at
+    once with :func:`shapely.transform`, rather than to each geometry in turn
+
+    Parameters
+    ----------
+    geoms : array_like
+        shapely geometries, such as a :class:`GeoSeries`
+    affine_obj : :class:`affine.Affine`
+        the transformation, such as from pixel to geospatial coordinates
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        the transformed geometries
+    """
+    matrix = np.array([
+        [affine_obj.a, affine_obj.d],
+        [affine_obj.b, affine_obj.e],
+    ])
+    offset = np.array([affine_obj.xoff, affine_obj.yoff])
+    return shapely.transform(np.asarray(geoms), lambda coords: coords @ matrix + offset)
+
+
 def _check_rasterio_im_load(im):
     """Check if `im` is already loaded in; if not, load it in."""
     if isinstance(im, str):
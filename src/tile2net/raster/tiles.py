@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import copy
+from collections.abc import Mapping
+from typing import Iterator, Union
+
+import numpy as np
+from affine import Affine
+from numpy import ndarray
+
+from tile2net.raster.tile import Tile
+from tile2net.raster.tile_utils.genutils import num2deg_array
+
+
+class TileArray:
+    """
+    The tiles of a Grid, stored as columns rather than as an object array
+    of Tile instances, so that building a grid of millions of tiles is a
+    handful of array operations.
+
+    The columns xtile, ytile, idd, and active are shared by every view of
+    the grid, and Tile instances are only materialized when indexed; each is
+    created once, so that state such as Tile.ped_poly persists. Indexing
+    behaves like the object array it replaces: grid.tiles[c, r] is a Tile,
+    slices are views, and .flat, .flatten(), .shape, and .size are supported.
+    """
+
+    def __init__(
+            self,
+            xtile: ndarray,
+            ytile: ndarray,
+            idd: ndarray,
+            zoom: int = 19,
+            size: int = 256,
+            crs: int = 4326,
+            tile_step: int = 1,
+    ):
+        """
+        Parameters
+        ----------
+        xtile : ndarray
+            slippy xtile of each tile, with shape (width, height)
+        ytile : ndarray
+            slippy ytile of each tile, with shape (width, height)
+        idd : ndarray
+            id of each tile, with shape (width, height)
+        zoom : int
+            zoom level of the tiles
+        size : int
+            size of each tile in pixels
+        crs : int
+            crs of the tiles
+        tile_step : int
+            the integer length, in slippy tiles, of each tile
+        """
+        shape = np.shape(xtile)
+        self.zoom = zoom
+        self.tilesize = size
+        self.crs = crs
+        self.tile_step = tile_step
+        self._xtile = np.ravel(xtile).astype(np.int64)
+        self._ytile = np.ravel(ytile).astype(np.int64)
+        self._idd = np.ravel(idd).astype(np.int64)
+        self._active = np.ones(self._xtile.size, dtype=bool)
+        # position of each tile within the grid
+        self._col, self._row = np.unravel_index(np.arange(self._xtile.size), shape)
+        self._tiles: dict[int, Tile] = {}
+        # arrays computed for the whole grid, such as bounds and transforms
+        self._cache: dict[str, ndarray] = {}
+        # flat indices into the columns of the tiles in this view
+        self.index = np.arange(self._xtile.size).reshape(shape)
+
+    @classmethod
+    def from_grid(
+            cls,
+            xtile: int,
+            ytile: int,
+            width: int,
+            height: int,
+            step: int = 1,
+            stride: int = None,
+            **kwargs,
+    ) -> TileArray:
+        """
+        Build the tiles of a grid whose top left tile is (xtile, ytile),
+        with one tile every `step` slippy tiles over width by height slippy
+        tiles. The idd of the tile at position (c, r) is c * stride + r.
+        """
+        cols = np.arange(0, width, step)
+        rows = np.arange(0, height, step)
+        if stride is None:
+            stride = len(rows)
+        c, r = np.meshgrid(np.arange(len(cols)), np.arange(len(rows)), indexing='ij')
+        x, y = np.meshgrid(xtile + cols, ytile + rows, indexing='ij')
+        return cls(x, y, c * stride + r, tile_step=step, **kwargs)
+
+    def _view(self, index: ndarray) -> TileArray:
+        view = copy.copy(self)
+        view.index = index
+        return view
+
+    def _tile(self, i: int) -> Tile:
+        try:
+            return self._tiles[i]
+        except KeyError:
+            ...
+        tile = Tile(
+            int(self._xtile[i]),
+            int(self._ytile[i]),
+            idd=int(self._idd[i]),
+            position=(int(self._col[i]), int(self._row[i])),
+            size=self.tilesize,
+            zoom=self.zoom,
+            crs=self.crs,
+            tile_step=self.tile_step,
+            active=bool(self._active[i]),
+        )
+        if 'transform' in self._cache:
+            # reuse the transform that was computed for the grid
+            tile.tfm = Affine(*self._cache['transform'][i].tolist())
+        return self._tiles.setdefault(i, tile)
+
+    def __getitem__(self, item) -> Union[Tile, TileArray]:
+        index = self.index[item]
+        if np.ndim(index):
+            return self._view(index)
+        return self._tile(int(index))
+
+    def __iter__(self) -> Iterator[Union[Tile, TileArray]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __array__(self, dtype=None):
+        # for callers that still expect an object array of Tile
+        array = np.empty(self.size, dtype=object)
+        array[:] = list(self.flat)
+        return array.reshape(self.shape)
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} shape={self.shape}>'
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.index.shape
+
+    @property
+    def size(self) -> int:
+        return self.index.size
+
+    @property
+    def ndim(self) -> int:
+        return self.index.ndim
+
+    @property
+    def flat(self) -> Flat:
+        return Flat(self)
+
+    def flatten(self) -> TileArray:
+        return self._view(self.index.ravel())
+
+    ravel = flatten
+
+    @property
+    def xtile(self) -> ndarray:
+        return self._xtile[self.index]
+
+    @property
+    def ytile(self) -> ndarray:
+        return self._ytile[self.index]
+
+    @property
+    def idd(self) -> ndarray:
+        return self._idd[self.index]
+
+    @property
+    def position(self) -> tuple[ndarray, ndarray]:
+        return self._col[self.index], self._row[self.index]
+
+    @property
+    def active(self) -> ndarray:
+        return self._active[self.index]
+
+    @active.setter
+    def active(self, value: ndarray | bool):
+        self._active[self.index] = value
+        # keep the tiles that were already materialized in sync
+        for i, tile in self._tiles.items():
+            tile.active = bool(self._active[i])
+
+    @property
+    def bounds(self) -> ndarray:
+        """
+        The (left, bottom, right, top) of each tile in degrees, with shape
+        (*shape, 4); computed once for the whole grid and shared by its views.
+        """
+        try:
+            bounds = self._cache['bounds']
+        except KeyError:
+            step = self.tile_step
+            top, left = num2deg_array(self._xtile, self._ytile, self.zoom)
+            bottom, right = num2deg_array(self._xtile + step, self._ytile + step, self.zoom)
+            bounds = self._cache['bounds'] = np.stack((left, bottom, right, top), axis=-1)
+        return bounds[self.index]
+
+    @property
+    def transform(self) -> ndarray:
+        """
+        The coefficients (a, b, c, d, e, f) of the Affine transform from the
+        pixels of each tile to degrees, with shape (*shape, 6), as returned
+        by rasterio.transform.from_bounds.
+        """
+        try:
+            transform = self._cache['transform']
+        except KeyError:
+            self.bounds
+            left, bottom, right, top = self._cache['bounds'].T
+            transform = np.zeros((self._xtile.size, 6))
+            transform[:, 0] = (right - left) / self.tilesize
+            transform[:, 2] = left
+            transform[:, 4] = (bottom - top) / self.tilesize
+            transform[:, 5] = top
+            self._cache['transform'] = transform
+        return transform[self.index]
+
+    def affines(self) -> list[Affine]:
+        """The Affine transform of each tile, in the order of .flat"""
+        return [
+            Affine(*coefficients)
+            for coefficients in self.transform.reshape(-1, 6).tolist()
+        ]
+
+    @property
+    def top(self) -> ndarray:
+        return self.bounds[..., 3]
+
+    @property
+    def left(self) -> ndarray:
+        return self.bounds[..., 0]
+
+    @property
+    def bottom(self) -> ndarray:
+        return self.bounds[..., 1]
+
+    @property
+    def right(self) -> ndarray:
+        return self.bounds[..., 2]
+
+
+class Flat:
+    """A flat iterator over TileArray, like ndarray.flat."""
+    __slots__ = 'tiles',
+
+    def __init__(self, tiles: TileArray):
+        self.tiles = tiles
+
+    def __len__(self):
+        return self.tiles.size
+
+    def __iter__(self) -> Iterator[Tile]:
+        tiles = self.tiles
+        for i in tiles.index.flat:
+            yield tiles._tile(int(i))
+
+    def __getitem__(self, item) -> Union[Tile, TileArray]:
+        index = self.tiles.index.ravel()[item]
+        if np.ndim(index):
+            return self.tiles._view(index)
+        return self.tiles._tile(int(index))
+
+
+class PoseDict(Mapping):
+    """
+    Maps the idd of each tile to its position in the grid, computed
+    from the idd rather than stored for every tile.
+    """
+    __slots__ = 'stride', 'shape'
+
+    def __init__(self, stride: int, shape: tuple[int, int]):
+        self.stride = int(stride)
+        self.shape = shape
+
+    def __getitem__(self, idd: int) -> tuple[int, int]:
+        # when the grid is padded beyond the stride, idds overlap; the tile
+        # in the last column wins, as it did when positions were a dict
+        idd = int(idd)
+        col = min(idd // self.stride, self.shape[0] - 1)
+        row = idd - col * self.stride
+        if (
+                col < 0
+                or not 0 <= row < self.shape[1]
+        ):
+            raise KeyError(idd)
+        return col, row
+
+    @property
+    def idd(self) -> ndarray:
+        col, row = np.meshgrid(
+            np.arange(self.shape[0]),
+            np.arange(self.shape[1]),
+            indexing='ij',
+        )
+        return np.unique(col * self.stride + row)
+
+    def __iter__(self) -> Iterator[int]:
+        yield from self.idd.tolist()
+
+    def __len__(self):
+        return len(self.idd)
@@ -2,18 +2,30 @@ import inspect
 import json
 import os
 import time
+from pathlib import Path
 from weakref import WeakKeyDictionary
 
-import geopy
 import numpy as np
 import toolz
 from geopy.exc import GeocoderTimedOut
-from geopy.geocoders import Nominatim
 from toolz import curried, pipe
 
 # import logging
 from tile2net.logger import logger
+from tile2net.raster.geocache import GeocodeCache
 
+# Nominatim lookups persist across runs; see GeocodeCache
+geocache = GeocodeCache()
+
+
+def cache_dir(*parts: str) -> Path:
+    # persistent cache shared across projects; $TILE2NET_CACHE or ~/.cache/tile2net
+    root = os.environ.get('TILE2NET_CACHE')
+    if root is None:
+        root = Path.home() / '.cache' / 'tile2net'
+    path = Path(root, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 def round_loc(location: list[float], decimals=10) -> list[float]:
     return list(np.around(np.array(location), decimals=decimals))
@@ -69,13 +81,12 @@ def geocode(location) -> list[float]:
                 list
             )
         except (ValueError, AttributeError):  # fails if address or list
-            logger.info(f"Geocoding {location}, this may take awhile...")
-            nom: geopy.Location = Nominatim(user_agent='tile2net').geocode(location, timeout=None)
-            if nom is None:
+            raw = geocache.geocode(location)
+            if raw is None:
                 raise ValueError(f"Could not geocode '{location}'")
-            logger.info(f"Geocoded '{location}' to\n\t'{nom.raw['display_name']}'")
+            logger.info(f"Geocoded '{location}' to\n\t'{raw['display_name']}'")
             location = pipe(
-                nom.raw['boundingbox'],
+                raw['boundingbox'],
                 # convert lon, lon, lat, lat
                 # to lat, lon, lat, lon
                 curried.get([0, 2, 1, 3]),
@@ -92,23 +103,12 @@ def geocode(location) -> list[float]:
 
 def reverse_geocode(location: list[float]) -> str:
     # from bbox, get address of centroid
-    logger.info(f"Geocoding {location}, this may take awhile...")
     # nom: geopy.Location = Nominatim(user_agent='tile2net').reverse(location, timeout=None)
     y = (location[0] + location[2]) / 2
     x = (location[1] + location[3]) / 2
-    centroid = (y, x)
-    nom: geopy.Location = Nominatim(
-        user_agent='tile2net',
-    ).reverse(centroid, timeout=None)
-    result = nom.raw['display_name']
+    result = geocache.reverse(y, x)
     return result
 
-
-    if nom is None:
-        raise ValueError(f"Could not geocode '{location}'")
-    logger.info(f"Geocoded '{location}' to\n\t'{nom.raw['display_name']}'")
-    return nom.raw['display_name']
-
 def name_from_location(location: str | list[float, str]):
 
     if isinstance(location, str):
@@ -128,10 +128,8 @@ def name_from_location(location: str | list[float, str]):
             (location[0] + location[2]) / 2,
             (location[1] + location[3]) / 2,
         )
-        logger.info(f"Geocoding {centroid}, this may take awhile...")
-        nom: geopy.Location = Nominatim(user_agent='tile2net').reverse(centroid, timeout=None)
-        logger.info(f"Geocoded '{centroid}' to\n\t'{nom.raw['display_name']}'")
-        location = nom.raw['display_name']
+        location = geocache.reverse(*centroid)
+        logger.info(f"Geocoded '{centroid}' to\n\t'{location}'")
 
     if isinstance(location, str):
         # location is address
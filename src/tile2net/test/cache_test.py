@@ -0,0 +1,39 @@
+from tile2net.raster.cache import TileCache
+
+
+def test_put_materialize(tmp_path):
+    cache = TileCache(tmp_path / 'cache')
+    dst = tmp_path / 'a.png'
+    digest = cache.put('source', 19, 1, 2, b'tile', dst)
+    assert dst.read_bytes() == b'tile'
+    # buffered puts are found before they are flushed
+    assert cache.digest('source', 19, 1, 2) == digest
+    cache.flush()
+    assert cache.materialize('source', 19, 1, 2, tmp_path / 'b.png')
+    assert (tmp_path / 'b.png').read_bytes() == b'tile'
+    assert not cache.materialize('source', 19, 1, 3, tmp_path / 'c.png')
+    # the same content in another format is a blob of its own
+    cache.put('other', 19, 1, 2, b'tile', tmp_path / 'a.jpg')
+    cache.flush()
+    assert cache.blob(digest, 'png').exists()
+    assert cache.blob(digest, 'jpg').exists()
+    assert cache.size == 8
+
+
+def test_evict(tmp_path):
+    cache = TileCache(tmp_path / 'cache')
+    old = cache.put('source', 19, 0, 0, b'a' * 100, tmp_path / 'old.png')
+    new = cache.put('source', 19, 0, 1, b'b' * 100, tmp_path / 'new.png')
+    cache.flush()
+    # using the first tile makes the second the least recently used
+    assert cache.materialize('source', 19, 0, 0, tmp_path / 'again.png')
+    cache.flush()
+    cache.evict(150)
+    assert cache.blob(old, 'png').exists()
+    assert not cache.blob(new, 'png').exists()
+    assert cache.digest('source', 19, 0, 1) is None
+    assert cache.size == 100
+    cache.evict(0)
+    assert not cache.blob(old, 'png').exists()
+    assert not cache.materialize('source', 19, 0, 0, tmp_path / 'gone.png')
+    assert cache.size == 0
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+import torch
+
+from tile2net.tileseg.utils.device import autocast, get_device, sockets
+
+
+def test_get_device():
+    assert get_device('cpu') == torch.device('cpu')
+    assert get_device().type == ('cuda' if torch.cuda.is_available() else 'cpu')
+    if not torch.cuda.is_available():
+        with pytest.raises(ValueError):
+            get_device('cuda')
+
+
+def test_sockets():
+    groups = sockets()
+    cpus = [cpu for group in groups for cpu in group]
+    assert sorted(cpus) == sorted(os.sched_getaffinity(0))
+
+
+def test_autocast():
+    device = torch.device('cpu')
+    conv = torch.nn.Conv2d(3, 4, 3)
+    x = torch.rand(1, 3, 8, 8)
+    with autocast(device, False):
+        assert conv(x).dtype == torch.float32
+    with autocast(device, True):
+        assert conv(x).dtype == torch.bfloat16
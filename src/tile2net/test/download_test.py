@@ -0,0 +1,197 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import imageio.v3
+import numpy as np
+import pytest
+
+from tile2net.raster.download import Downloader
+from tile2net.raster.source import Source
+
+
+PNG = imageio.v3.imwrite('<bytes>', np.zeros((256, 256, 3), dtype=np.uint8), extension='.png')
+
+
+class Handler(BaseHTTPRequestHandler):
+    # the first request for each tile is throttled
+    throttled: set[str] = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[0] != 'tile' or len(parts) != 4:
+            self.send_response(404)
+            self.end_headers()
+            return
+        z, y, x = map(int, parts[1:])
+        if x < 0:
+            self.send_response(404)
+            self.end_headers()
+            return
+        with self.lock:
+            first = self.path not in self.throttled
+            self.throttled.add(self.path)
+        if first:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, *args):
+        ...
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_download(server: str):
+    class Local(Source, init=False):
+        name = 'local'
+        tiles = server + '/tile/{z}/{y}/{x}'
+        downloader = Downloader(concurrency=4, backoff=.01, http2=False)
+
+    class Tile:
+        zoom = 19
+
+        def __init__(self, xtile, ytile):
+            self.xtile = xtile
+            self.ytile = ytile
+
+    tiles = [Tile(x, y) for x in range(-1, 8) for y in range(8)]
+    urls = list(Local()[tiles])
+    responses = Local.downloader(urls)
+    assert len(responses) == len(urls)
+    assert sorted(r.index for r in responses) == list(range(len(urls)))
+    missing = [r for r in responses if r.missing]
+    assert len(missing) == 8
+    for response in responses:
+        if not response.missing:
+            assert response.content == PNG
+            assert imageio.v3.imread(io.BytesIO(response.content)).shape == (256, 256, 3)
+    assert 'local' not in Source.catalog
+
+
+def test_iter_early_exit(server: str):
+    # the clients are closed when the consumer stops iterating early
+    clients = []
+
+    class Recording(Downloader):
+        def client(self, *args):
+            client = super().client(*args)
+            if client not in clients:
+                clients.append(client)
+            return client
+
+    downloader = Recording(concurrency=4, queue_size=1, backoff=.01, http2=False)
+    urls = [f'{server}/tile/19/{y}/{x}' for x in range(8) for y in range(8)]
+    for response in downloader.iter(urls):
+        break
+    assert clients
+    assert all(client.is_closed for client in clients)
+
+
+def color(x: int, y: int) -> int:
+    return (x * 7 + y * 13) % 251 + 1
+
+
+class Tiles(BaseHTTPRequestHandler):
+    # a tile of a single color for each (x, y), except those outside the coverage
+    requests: list[str] = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        _, z, y, x = self.path.strip('/').split('/')
+        x, y = int(x), int(y)
+        if (x + y) % 5 == 0:
+            self.send_response(404)
+            self.end_headers()
+            return
+        image = np.full((256, 256, 3), color(x, y), dtype=np.uint8)
+        body = imageio.v3.imwrite('<bytes>', image, extension='.png')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        ...
+
+
+@pytest.fixture
+def stream(tmp_path):
+    from tile2net import Raster
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Tiles)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Tiles.requests = []
+
+    class Local(Source, init=False):
+        name = 'local'
+        zoom = 19
+        tiles = f'http://127.0.0.1:{server.server_port}/tile/{{z}}/{{y}}/{{x}}'
+        downloader = Downloader(concurrency=4, queue_size=4, backoff=.01, http2=False)
+
+    raster = Raster(
+        location=[40.7, -74.0, 40.7015, -73.998],
+        name='stream',
+        source=Local(),
+        output_dir=tmp_path,
+    )
+    # a resumed run: some of the tiles are already on disk
+    static = raster.project.tiles.static
+    static.mkdir()
+    for tile, path in list(zip(raster.tiles.flat, static.files()))[::3]:
+        if (tile.xtile + tile.ytile) % 5:
+            image = np.full((256, 256, 3), color(tile.xtile, tile.ytile), dtype=np.uint8)
+            imageio.v3.imwrite(path, image)
+    yield raster
+    server.shutdown()
+
+
+def check_stitched(raster):
+    stitched = raster.tiles[::2, ::2]
+    files = list(raster.project.tiles.stitched.files(stitched))
+    assert all(file.exists() for file in files)
+    for (r, c), file in zip(np.ndindex(stitched.shape), files):
+        image = imageio.v3.imread(file)
+        for i in range(2):
+            for j in range(2):
+                x = raster.xtile + 2 * r + i
+                y = raster.ytile + 2 * c + j
+                # tiles outside the coverage are black
+                expected = 0 if (x + y) % 5 == 0 else color(x, y)
+                assert (image[256 * j:256 * (j + 1), 256 * i:256 * (i + 1)] == expected).all()
+
+
+def test_stitch_stream(stream):
+    raster = stream
+    raster.stitch(2)
+    check_stitched(raster)
+    # tiles on disk, and those that the source does not have, are requested once at most
+    assert len(Tiles.requests) == len(set(Tiles.requests))
+    assert len(raster.absent) == sum(
+        (tile.xtile + tile.ytile) % 5 == 0
+        for tile in raster.tiles.flat
+    )
+
+
+def test_stitch_stream_again(stream):
+    raster = stream
+    raster.stitch(2)
+    requests = len(Tiles.requests)
+    # the tiles that the source does not have are neither read nor requested again
+    raster.stitch(2, force=True)
+    check_stitched(raster)
+    assert len(Tiles.requests) == requests
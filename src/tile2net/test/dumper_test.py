@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+from tile2net.tileseg.utils.misc import BoundedWriter
+
+
+def test_bounded_writer():
+    writer = BoundedWriter(workers=2, bound=3)
+    gate = threading.Event()
+    saved = []
+    for i in range(3):
+        writer.submit(gate.wait)
+    # a fourth save blocks until one of the pending saves completes
+    blocked = threading.Thread(target=writer.submit, args=(saved.append, 3))
+    blocked.start()
+    blocked.join(.2)
+    assert blocked.is_alive()
+    gate.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.wait()
+    assert saved == [3]
+    assert not writer.pending
+
+
+def test_bounded_writer_error():
+    writer = BoundedWriter(workers=1)
+    writer.submit(int, 'not a number')
+    with pytest.raises(ValueError):
+        writer.shutdown()
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from tile2net.raster.geocache import GeocodeCache
+
+
+class Geocoder:
+    """Stands in for Nominatim, failing the first lookup of each query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def geocode(self, query, timeout=None):
+        self.queries.append(query)
+        if self.queries.count(query) == 1:
+            return None
+        return SimpleNamespace(raw=dict(
+            display_name=query.title(),
+            boundingbox=['40.0', '40.1', '-74.1', '-74.0'],
+            osm_id=1,
+        ))
+
+
+def test_geocode(tmp_path):
+    cache = GeocodeCache(tmp_path / 'geocode.sqlite', delay=0)
+    cache.geocoder = geocoder = Geocoder()
+    # a miss is not cached, so that it is looked up again
+    assert cache.geocode('New York, NY') is None
+    expected = dict(
+        display_name='New York, Ny',
+        boundingbox=['40.0', '40.1', '-74.1', '-74.0'],
+    )
+    assert cache.geocode('New York, NY') == expected
+    assert len(geocoder.queries) == 2
+    # a hit is cached under the normalized query, across instances
+    other = GeocodeCache(tmp_path / 'geocode.sqlite', delay=0)
+    other.geocoder = geocoder
+    assert other.geocode('new york,ny ') == expected
+    assert len(geocoder.queries) == 2
@@ -0,0 +1,48 @@
+import geopandas as gpd
+import numpy as np
+import shapely.geometry
+
+from tile2net.raster.grid import Grid
+from tile2net.raster.tile_utils.genutils import deg2num, deg2num_array
+
+
+def test_deg2num_array():
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-85, 85, 1000)
+    lon = rng.uniform(-180, 180, 1000)
+    xtile, ytile = deg2num_array(lat, lon, 19)
+    assert list(zip(xtile.tolist(), ytile.tolist())) == [
+        deg2num(a, o, 19) for a, o in zip(lat.tolist(), lon.tolist())
+    ]
+
+
+def test_get_in_boundary(tmp_path):
+    grid = Grid(
+        name='boundary',
+        location=[40.7, -74.0, 40.703, -73.996],
+        output_dir=str(tmp_path),
+    )
+    # a concave boundary, so that some tiles of its bounding box are outside it
+    boundary = shapely.geometry.Polygon([
+        (-73.9995, 40.7005), (-73.9965, 40.7005), (-73.9965, 40.7025),
+        (-73.998, 40.7025), (-73.998, 40.7012), (-73.9995, 40.7012),
+    ])
+    path = tmp_path / 'boundary.geojson'
+    gpd.GeoDataFrame(geometry=[boundary], crs=4326).to_file(path)
+    # the tiles that intersect the boundary, tile by tile
+    expected = np.array([
+        boundary.intersects(tile.tile2poly(tile.left, tile.bottom, tile.right, tile.top))
+        for tile in grid.tiles.flat
+    ])
+    assert expected.any() and not expected.all()
+
+    grid.get_in_boundary(path=str(path))
+    active = grid.tiles.active.ravel()
+    assert (active == expected).all()
+    assert grid.num_inside == grid.num_active == expected.sum()
+    # the vertices of the boundary are in active tiles
+    x, y = np.asarray(boundary.exterior.coords).T
+    xtile, ytile = deg2num_array(y, x, grid.zoom)
+    xtile = xtile - grid.xtile
+    ytile = ytile - grid.ytile
+    assert grid.tiles.active[xtile, ytile].all()
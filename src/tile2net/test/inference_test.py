@@ -0,0 +1,164 @@
+import copy
+from types import SimpleNamespace
+
+import argh
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import tile2net.tileseg.inference as inference
+from tile2net.tileseg.config import cfg
+from tile2net.tileseg.inference import Inference
+
+NUM_CLASSES = 4
+
+
+class Net(torch.nn.Module):
+    # a small deterministic network that predicts each pixel's class
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, NUM_CLASSES, 3, padding=1)
+
+    def forward(self, inputs):
+        return {'pred': self.conv(inputs['images'])}
+
+
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.setitem(cfg.DATASET, 'NUM_CLASSES', NUM_CLASSES)
+    dataset = SimpleNamespace(
+        colorize_mask=lambda mask: Image.fromarray(np.asarray(mask, dtype=np.uint8) * 60),
+    )
+    monkeypatch.setitem(cfg, 'DATASET_INST', dataset)
+    # logx is only initialized by Inference.setup
+    monkeypatch.setattr(inference.logx, 'msg', lambda msg: None)
+
+
+def validate(tmp_path, monkeypatch, batch_size: int) -> dict[str, np.ndarray]:
+    # infer the same images in batches of batch_size; return the dumped composites
+    monkeypatch.setitem(cfg, 'RESULT_DIR', str(tmp_path))
+    torch.manual_seed(1)
+    images = torch.rand(5, 3, 16, 16)
+    names = [f'tile_0_{i}_{i}' for i in range(5)]
+    gts = torch.zeros(5, 16, 16, dtype=torch.long)
+    batches = [slice(i, i + batch_size) for i in range(0, 5, batch_size)]
+    # the loader yields each batch, and the number of tiles without data
+    loader = [((images[b], gts[b], names[b], 1.0), 0) for b in batches]
+    args = SimpleNamespace(
+        device='cpu',
+        default_scale=1.0,
+        multi_scale_inference=False,
+        do_flip=False,
+        channels_last=False,
+        bf16=False,
+        dump_assets=False,
+        dump_percent=100,
+        mosaic=False,
+        polygonize_mosaic=False,
+        distributed=False,
+        polygon_workers=None,
+        options=SimpleNamespace(test_mode=False),
+    )
+    session = Inference.__new__(Inference)
+    session.args = args
+    session.validate(
+        loader, Net().eval(), criterion=None, optim=None, epoch=0,
+        calc_metrics=False, dump_all_images=True, testing=True,
+    )
+    return {
+        path.name: np.asarray(Image.open(path))
+        for path in (tmp_path / 'seg_results').glob('sidebside_*.png')
+    }
+
+
+def test_batched_validate(config, tmp_path, monkeypatch):
+    single = validate(tmp_path / 'single', monkeypatch, 1)
+    batched = validate(tmp_path / 'batched', monkeypatch, 3)
+    # every image of each batch is inferred and dumped, as one at a time
+    assert sorted(single) == [f'sidebside_tile_0_{i}_{i}.png' for i in range(5)]
+    assert sorted(batched) == sorted(single)
+    for name, image in single.items():
+        assert (batched[name] == image).all()
+
+
+def test_bs_val():
+    # --bs_val is a model option, so that it reaches cfg.MODEL.BS_VAL and the loader
+    parser = argh.ArghParser()
+    parser.set_default_command(inference.inference)
+    args = parser.parse_args(['--bs_val', '3'])
+    assert vars(args)['model.bs_val'] == 3
+
+
+@pytest.fixture
+def raster(tmp_path):
+    from tile2net import Raster
+    from tile2net.raster.source import Source
+
+    class Local(Source, init=False):
+        name = 'local'
+        zoom = 19
+        tiles = 'http://127.0.0.1/tile/{z}/{y}/{x}'
+
+    return Raster(
+        location=[40.7, -74.0, 40.7015, -73.998],
+        name='session',
+        source=Local(),
+        output_dir=tmp_path,
+    )
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    # the Inference of each session, which would load the network once
+    loads = []
+
+    class Loaded:
+        def __init__(self, args):
+            self.args = args
+            self.inferred = []
+            loads.append(self)
+
+        def inference(self, rasterfactory=None, progress=None):
+            self.inferred.append((rasterfactory, self.args.eval_folder, self.args.result_dir))
+
+    # the Namespace of a session writes its options into the global config
+    saved = copy.deepcopy(dict(cfg))
+    monkeypatch.setattr(inference, 'Inference', Loaded)
+    yield loads
+    for key, value in saved.items():
+        dict.__setitem__(cfg, key, value)
+
+
+def test_session_reuse(raster, loads, tmp_path):
+    from tile2net import Raster
+
+    other = Raster(
+        location=[40.71, -74.0, 40.7115, -73.998],
+        name='other',
+        source=raster.source,
+        output_dir=tmp_path,
+    )
+    session = inference.InferenceSession(device='cpu', batch_size=2)
+    raster.inference(session=session)
+    other.inference(session=session, virtual_stitch=True)
+    # the network is loaded once, and each raster is inferred with its own folders
+    assert len(loads) == 1
+    loaded, = loads
+    assert loaded.args.device == 'cpu'
+    assert loaded.args.model.bs_val == 2
+    assert [inferred[0] for inferred in loaded.inferred] == [raster, other]
+    # the directories are shared descriptors, so their paths are read at once
+    folders = [str(raster.project.tiles.stitched), str(other.project.tiles.stitched)]
+    assert [inferred[1] for inferred in loaded.inferred] == folders
+    assert loaded.inferred[1][2] == str(other.project.segmentation)
+    assert loaded.args.virtual_stitch
+
+
+def test_session_options(raster, loads):
+    session = inference.InferenceSession(device='cpu')
+    for options in (dict(device='cpu'), dict(bf16=True), dict(batch_size=4)):
+        with pytest.raises(ValueError, match=next(iter(options))):
+            raster.inference(session=session, **options)
+    assert not loads
@@ -0,0 +1,49 @@
+import os
+
+from tile2net.raster.inventory import Inventory
+
+
+def fresh(path) -> Inventory:
+    # instances are unique per directory within a process, as if in a new run
+    Inventory.inventories.pop(os.path.abspath(path), None)
+    return Inventory(path)
+
+
+def test_scan(tmp_path):
+    (tmp_path / 'a.png').write_bytes(b'a')
+    (tmp_path / 'empty.png').touch()
+    (tmp_path / 'folder').mkdir()
+    inventory = fresh(tmp_path)
+    assert inventory.names == {'a.png'}
+    assert 'a.png' in inventory and len(inventory) == 1
+    assert (tmp_path / Inventory.journal_name).exists()
+    assert list(inventory.bitmap([tmp_path / 'a.png', tmp_path / 'b.png'])) == [True, False]
+
+
+def test_journal(tmp_path):
+    (tmp_path / 'a.png').write_bytes(b'a')
+    fresh(tmp_path).names
+    mtime = (tmp_path / Inventory.journal_name).stat().st_mtime_ns
+    # a file that appears without changing the directory's mtime is not seen,
+    # as the journal is read rather than the directory scanned
+    (tmp_path / 'b.png').write_bytes(b'b')
+    os.utime(tmp_path, ns=(mtime, mtime))
+    assert fresh(tmp_path).names == {'a.png'}
+    # once the directory is modified, the journal is stale and it is scanned again
+    (tmp_path / 'c.png').write_bytes(b'c')
+    os.utime(tmp_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    assert fresh(tmp_path).names == {'a.png', 'b.png', 'c.png'}
+
+
+def test_add_discard(tmp_path):
+    (tmp_path / 'a.png').write_bytes(b'a')
+    inventory = fresh(tmp_path)
+    inventory.names
+    inventory.add('b.png', 'c.png')
+    assert 'b.png' in inventory
+    inventory.flush()
+    assert fresh(tmp_path).names == {'a.png', 'b.png', 'c.png'}
+    inventory = Inventory(tmp_path)
+    inventory.discard('a.png')
+    assert 'a.png' not in inventory
+    assert fresh(tmp_path).names == {'b.png', 'c.png'}
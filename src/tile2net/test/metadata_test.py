@@ -0,0 +1,114 @@
+import json
+
+import numpy as np
+import pytest
+import requests
+import shapely
+import shapely.geometry
+import shapely.ops
+from geopandas import GeoSeries
+
+from tile2net.raster.metadata import MetadataCache
+from tile2net.raster.source import Source, SourceMeta, transformer
+
+
+def test_ttl(tmp_path):
+    cache = MetadataCache(tmp_path, ttl=60)
+    fetched = []
+
+    def fetch():
+        fetched.append(len(fetched))
+        return {'version': len(fetched)}
+
+    assert cache.get('key', fetch) == {'version': 1}
+    assert cache.get('key', fetch) == {'version': 1}
+    # a new instance reads the entry from disk
+    assert MetadataCache(tmp_path, ttl=60).get('key', fetch) == {'version': 1}
+    assert len(fetched) == 1
+    # once expired, the entry is fetched again
+    assert MetadataCache(tmp_path, ttl=0).get('key', fetch) == {'version': 2}
+    assert cache.get('key', fetch) == {'version': 2}
+    assert len(fetched) == 2
+
+
+def test_stale(tmp_path):
+    cache = MetadataCache(tmp_path, ttl=60)
+    cache.put('key', [1, 2])
+    file = cache.file('key')
+    entry = json.loads(file.read_text())
+    entry['fetched'] -= 120
+    file.write_text(json.dumps(entry))
+
+    def offline():
+        raise requests.ConnectionError('offline')
+
+    # the stale entry is used rather than failing
+    assert cache.get('key', offline) == [1, 2]
+    # and it is still refreshed once the fetch succeeds
+    assert cache.get('key', lambda: [3]) == [3]
+    assert cache.get('key', offline) == [3]
+    # without any entry, the failure is raised
+    with pytest.raises(requests.ConnectionError):
+        cache.get('other', offline)
+
+    def error():
+        raise ValueError('error payload')
+
+    file.write_text(json.dumps(dict(entry, value=[1, 2])))
+    assert cache.get('key', error) == [1, 2]
+
+
+def test_tree():
+    rng = np.random.default_rng(0)
+    names = [f'source{i}' for i in range(8)]
+    catalog = {}
+    for name in names:
+        class Local(Source, init=False):
+            ...
+        Local.name = name
+        catalog[name] = Local
+
+    # overlapping coverages, some of them with several parts per source
+    geometries = []
+    index = []
+    for name in names:
+        for _ in range(rng.integers(1, 4)):
+            x, y = rng.uniform(-80, -70), rng.uniform(35, 45)
+            w, h = rng.uniform(.5, 5, 2)
+            geometries.append(shapely.geometry.box(x, y, x + w, y + h))
+            index.append(name)
+    projected = GeoSeries(geometries, index=index, crs=4326).to_crs(3857)
+
+    def scan(item) -> str | None:
+        # the linear scan over every coverage that the tree replaced
+        item = shapely.ops.transform(transformer().transform, item)
+        matches = projected.loc[projected.intersects(item)]
+        if matches.empty:
+            return None
+        return matches.intersection(item).area.__truediv__(matches.area).idxmax()
+
+    # the class properties are replaced by their values once computed, which
+    # monkeypatch would compute when saving them, from the real catalog
+    saved = {
+        name: SourceMeta.__dict__[name]
+        for name in ('catalog', 'projected', 'tree')
+    }
+    SourceMeta.catalog = catalog
+    SourceMeta.projected = projected
+    SourceMeta.tree = shapely.STRtree(projected.values)
+    try:
+        found = 0
+        for _ in range(200):
+            x, y = rng.uniform(-82, -68), rng.uniform(33, 47)
+            item = shapely.geometry.box(x, y, x + .1, y + .1)
+            source = Source[item]
+            expected = scan(item)
+            if expected is None:
+                assert source is None
+            else:
+                assert source.name == expected
+                found += 1
+        assert found
+    finally:
+        for name, value in saved.items():
+            setattr(SourceMeta, name, value)
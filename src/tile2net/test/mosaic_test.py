@@ -0,0 +1,30 @@
+import numpy as np
+import rasterio
+from pyproj import Transformer
+
+from tile2net.raster.mosaic import Mosaic
+from tile2net.raster.tiles import TileArray
+
+
+def test_mosaic(tmp_path):
+    path = tmp_path / 'predictions.tif'
+    with Mosaic(
+            path, 154373, 197137, (3, 2), zoom=19, step=2, size=512,
+            count=1, nodata=255, resampling='nearest',
+    ) as mosaic:
+        mosaic.write(np.full((512, 512), 2, dtype=np.int64), 1, 0)
+    assert not mosaic.temp.exists()
+    with rasterio.open(path) as src:
+        assert src.shape == (1024, 1536)
+        assert src.tags(ns='IMAGE_STRUCTURE')['LAYOUT'] == 'COG'
+        assert src.overviews(1)
+        band = src.read(1)
+        assert (band[:512, 512:1024] == 2).all()
+        assert (band[512:] == 255).all()
+        # the mosaic is aligned with the slippy tiles in web mercator
+        tiles = TileArray.from_grid(154373, 197137, 6, 4, step=2, size=512)
+        left, bottom, right, top = tiles.bounds[2, 1]
+        transformer = Transformer.from_crs(4326, 3857, always_xy=True)
+        expected = transformer.transform([left, right], [top, bottom])
+        assert np.allclose(src.transform * (1024, 512), np.array(expected)[:, 0])
+        assert np.allclose(src.transform * (1536, 1024), np.array(expected)[:, 1])
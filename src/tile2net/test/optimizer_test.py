@@ -0,0 +1,67 @@
+import os
+
+import pytest
+import torch
+
+import tile2net.tileseg.loss.optimizer as optimizer
+from tile2net.tileseg.loss.optimizer import forgiving_state_restore, load_state_dict, restore_opt
+
+
+def network() -> tuple[torch.nn.Module, torch.optim.Optimizer]:
+    net = torch.nn.Sequential(torch.nn.Conv2d(3, 4, 3), torch.nn.BatchNorm2d(4))
+    optim = torch.optim.SGD(net.parameters(), lr=.1, momentum=.9)
+    return net, optim
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch) -> tuple[str, torch.nn.Module, torch.optim.Optimizer]:
+    # logx is only initialized by Inference.setup
+    monkeypatch.setattr(optimizer.logx, 'msg', lambda msg: None)
+    torch.manual_seed(0)
+    net, optim = network()
+    for _ in range(2):
+        optim.zero_grad()
+        net(torch.rand(2, 3, 8, 8)).sum().backward()
+        optim.step()
+    path = str(tmp_path / 'snapshot.pth')
+    torch.save(dict(state_dict=net.state_dict(), optimizer=optim.state_dict(), epoch=3), path)
+    return path, net, optim
+
+
+def assert_equal(left: dict, right: dict):
+    assert left.keys() == right.keys()
+    for key in left:
+        assert torch.equal(left[key], right[key])
+
+
+def test_load_state_dict(snapshot):
+    path, net, _ = snapshot
+    # converted on the first load, then read from the converted copy
+    for _ in range(2):
+        restored, _ = network()
+        forgiving_state_restore(restored, load_state_dict(path))
+        assert_equal(restored.state_dict(), net.state_dict())
+    cache = os.path.splitext(path)[0] + '.state_dict.pt'
+    assert os.path.exists(cache)
+    # the copy holds only the model state
+    assert_equal(torch.load(cache, weights_only=True), net.state_dict())
+
+
+def test_restore_optimizer(snapshot):
+    path, net, optim = snapshot
+    restored, restored_optim = network()
+    forgiving_state_restore(restored, load_state_dict(path))
+    restore_opt(restored_optim, torch.load(path, map_location='cpu', weights_only=False))
+    expected = optim.state_dict()
+    state = restored_optim.state_dict()
+    assert state['param_groups'] == expected['param_groups']
+    assert state['state'].keys() == expected['state'].keys()
+    for key in state['state']:
+        assert_equal(state['state'][key], expected['state'][key])
+    # a step from the restored state is the step from the original state
+    x = torch.rand(2, 3, 8, 8)
+    for model, opt in ((net, optim), (restored, restored_optim)):
+        opt.zero_grad()
+        model(x).sum().backward()
+        opt.step()
+    assert_equal(restored.state_dict(), net.state_dict())
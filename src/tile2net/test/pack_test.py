@@ -0,0 +1,92 @@
+import os
+import sqlite3
+
+import pytest
+
+from tile2net.raster.pack import PackFile, TilePack
+
+
+def fresh(path) -> TilePack:
+    # instances are unique per path within a process, as if in a new run
+    TilePack.packs.pop(os.path.abspath(path), None)
+    return TilePack(path)
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'static.mbtiles'
+    pack = fresh(path)
+    file = PackFile(pack, 19, 154308, 197167, '154308_197167.png')
+    assert not file.exists()
+    file.write_bytes(b'tile')
+    # buffered writes are read back before they are committed
+    assert file.exists()
+    assert file.read_bytes() == b'tile'
+    pack.flush()
+
+    pack = fresh(path)
+    assert len(pack) == 1
+    assert (19, 154308, 197167) in pack
+    assert pack.read(19, 154308, 197167) == b'tile'
+    assert [file.name for file in pack.files()] == ['154308_197167.png']
+    # rows are stored in the TMS convention, counted from the south
+    with sqlite3.connect(path) as con:
+        row, = con.execute('SELECT tile_row FROM tiles').fetchone()
+    assert row == 2 ** 19 - 1 - 197167
+
+    file = PackFile(pack, 19, 154308, 197167, '154308_197167.png')
+    file.unlink()
+    assert not file.exists()
+    with pytest.raises(FileNotFoundError):
+        pack.read(19, 154308, 197167)
+    with pytest.raises(FileNotFoundError):
+        file.unlink()
+    assert len(fresh(path)) == 0
+
+
+def test_stitched_files(tmp_path):
+    pack = fresh(tmp_path / 'stitched.mbtiles')
+    pack.metadata = dict(format='jpg', xtile=100, ytile=200, step=2, columns=3)
+    # stitched tiles are keyed by their top left tile
+    for r in range(2):
+        for c in range(3):
+            pack.write(19, 100 + 2 * r, 200 + 2 * c, b'%d' % (3 * r + c))
+    pack.flush()
+    files = list(fresh(tmp_path / 'stitched.mbtiles').files())
+    assert [file.name for file in files] == [
+        '0_0_0.jpg', '0_1_1.jpg', '0_2_2.jpg',
+        '1_0_3.jpg', '1_1_4.jpg', '1_2_5.jpg',
+    ]
+    assert [file.read_bytes() for file in files] == [b'%d' % i for i in range(6)]
+    assert files[4].stem == '1_1_4' and files[4].suffix == '.jpg'
+
+
+def test_stitched_metadata(tmp_path):
+    from tile2net import Raster
+    from tile2net.raster.source import Source
+
+    class Local(Source, init=False):
+        name = 'local'
+        zoom = 19
+        tiles = 'http://127.0.0.1/tile/{z}/{y}/{x}'
+
+    raster = Raster(
+        location=[40.7, -74.0, 40.7015, -73.998],
+        name='packed',
+        source=Local(),
+        output_dir=tmp_path,
+        storage='mbtiles',
+    )
+    raster.stitch_step = 2
+    stitched = raster.project.tiles.stitched
+    stitched.mkdir()
+    tiles = raster.tiles[::2, ::2]
+    # listing the files does not write to the pack
+    files = list(stitched.files(tiles))
+    assert 'step' not in stitched.pack.metadata
+    stitched.write_metadata(tiles)
+    for file in files[:2]:
+        file.write_bytes(file.name.encode())
+    stitched.pack.flush()
+    pack = fresh(stitched.path)
+    assert [file.name for file in pack.files()] == [file.name for file in files[:2]]
+    assert [file.read_bytes() for file in pack.files()] == [file.name.encode() for file in files[:2]]
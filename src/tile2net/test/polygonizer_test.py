@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import rasterio
+
+from tile2net.raster.mosaic import Mosaic
+from tile2net.raster.polygonizer import Polygonizer, polygonize_mosaic
+from tile2net.raster.tile import Tile
+
+
+def test_polygonizer():
+    tiles = [
+        Tile(xtile=154308 + i, ytile=197167, idd=i, position=(0, i), size=64)
+        for i in range(4)
+    ]
+    predictions = []
+    for i in range(3):
+        prediction = np.full((64, 64), 3, dtype=np.uint8)
+        prediction[8:40, 8 + 4 * i:40 + 4 * i] = i
+        predictions.append(prediction)
+    # a tile of background has no polygons
+    predictions.append(np.full((64, 64), 3, dtype=np.uint8))
+
+    # fewer slots than tiles, so that submitting waits for a free slot
+    polygonizer = Polygonizer(workers=2, slots=2)
+    for tile, prediction in zip(tiles, predictions):
+        polygonizer.submit(tile, prediction)
+    polygons = polygonizer.close()
+
+    expected = [
+        tile.map_classes(prediction)
+        for tile, prediction in zip(tiles[:3], predictions)
+    ]
+    assert len(polygons) == 3
+    for gdf, other in zip(polygons, expected):
+        assert list(gdf.f_type) == list(other.f_type)
+        assert gdf.geometry.geom_equals_exact(other.geometry, 1e-9).all()
+
+
+def test_polygonize_mosaic(tmp_path):
+    path = tmp_path / 'predictions.tif'
+    predictions = np.full((256, 512), 3, dtype=np.uint8)
+    # a road that crosses the edge of the first two stitched tiles
+    predictions[40:120, 200:320] = 1
+    predictions[150:200, 20:60] = 0
+    with Mosaic(
+            path, 154308, 197167, (3, 1), zoom=19, step=1, size=256,
+            count=1, nodata=255, resampling='nearest',
+    ) as mosaic:
+        # the third stitched tile is never written
+        mosaic.write(predictions[:, :256], 0, 0)
+        mosaic.write(predictions[:, 256:], 1, 0)
+
+    # windows of a stitched tile, whose halos span the road
+    polygons = pd.concat(polygonize_mosaic(path, window=256, halo=128, workers=1))
+    whole = pd.concat(polygonize_mosaic(path, window=1024, workers=1))
+    with rasterio.open(path) as src:
+        assert polygons.crs == src.crs
+        res = src.res[0]
+    assert sorted(polygons.f_type) == sorted(whole.f_type) == ['road', 'sidewalk']
+    road = polygons[polygons.f_type == 'road'].geometry.iloc[0]
+    assert np.isclose(road.area, 80 * 120 * res ** 2)
+    assert road.symmetric_difference(
+        whole[whole.f_type == 'road'].geometry.iloc[0]
+    ).area < 1e-6
+
+
+def test_polygonize_mosaic_beyond_halo(tmp_path):
+    path = tmp_path / 'predictions.tif'
+    predictions = np.full((256, 512), 3, dtype=np.uint8)
+    # a sidewalk that reaches much further than the halo beyond the edge
+    # of the first window, joined to a block across it
+    predictions[100:104, 0:250] = 0
+    predictions[80:140, 250:300] = 0
+    # a crosswalk within the second window, and one across both
+    predictions[20:40, 400:430] = 2
+    predictions[200:230, 240:270] = 2
+    with Mosaic(
+            path, 154308, 197167, (2, 1), zoom=19, step=1, size=256,
+            count=1, nodata=255, resampling='nearest',
+    ) as mosaic:
+        mosaic.write(predictions[:, :256], 0, 0)
+        mosaic.write(predictions[:, 256:], 1, 0)
+
+    polygons = pd.concat(polygonize_mosaic(path, window=256, halo=32, workers=1))
+    whole = pd.concat(polygonize_mosaic(path, window=1024, workers=1))
+    assert sorted(polygons.f_type) == sorted(whole.f_type) == ['crosswalk', 'crosswalk', 'sidewalk']
+    for f_type in ('sidewalk', 'crosswalk'):
+        windowed = polygons[polygons.f_type == f_type].geometry
+        expected = whole[whole.f_type == f_type].geometry
+        assert np.isclose(windowed.area.sum(), expected.area.sum())
+        assert np.allclose(windowed.total_bounds, expected.total_bounds)
+        assert windowed.unary_union.symmetric_difference(expected.unary_union).area < 1e-6
@@ -0,0 +1,64 @@
+import pickle
+
+import imageio.v3
+import numpy as np
+import pytest
+
+from tile2net.raster.stitcher import Stitcher, VirtualTile, assemble, mask
+from tile2net.tileseg.datasets.utils import nodata_ratio
+
+
+def test_assemble():
+    tiles = [
+        np.full((4, 4, 3), i, dtype=np.uint8)
+        for i in range(1, 4)
+    ]
+    # a transparent tile is masked to black
+    transparent = np.full((4, 4, 4), 9, dtype=np.uint8)
+    transparent[:, :, 3] = 255
+    transparent[:2, :, 3] = 0
+    canvas = np.empty((8, 8, 4), dtype=np.uint8)
+    rgb = mask(assemble(canvas, [*tiles[:2], transparent, None], 2))
+    # tiles are listed in column-major order
+    assert (rgb[:4, :4] == 1).all()
+    assert (rgb[4:, :4] == 2).all()
+    assert (rgb[:2, 4:] == 0).all()
+    assert (rgb[2:4, 4:] == 9).all()
+    assert (rgb[4:, 4:] == 0).all()
+
+
+@pytest.mark.parametrize('encoder', ['pil', 'cv2'])
+def test_stitcher(tmp_path, encoder):
+    files = []
+    for i in range(4):
+        file = tmp_path / f'{i}.png'
+        file.write_bytes(imageio.v3.imwrite(
+            '<bytes>', np.full((256, 256, 3), i * 60, dtype=np.uint8), extension='.png'
+        ))
+        files.append(file)
+    written = {}
+    with Stitcher(2, encoder=encoder, compression=1, workers=1) as stitcher:
+        stitcher.stitch(files, lambda data: written.__setitem__('files', data))
+        images = [imageio.v3.imread(file) for file in files[::-1]]
+        stitcher.encode(images, lambda data: written.__setitem__('images', data))
+    image = imageio.v3.imread(written['files'])
+    assert image.shape == (512, 512, 3)
+    assert (image[256:, :256] == 60).all()
+    image = imageio.v3.imread(written['images'])
+    assert (image[:256, :256] == 180).all()
+
+
+def test_virtual_tile(tmp_path):
+    file = tmp_path / '0.png'
+    file.write_bytes(imageio.v3.imwrite(
+        '<bytes>', np.full((4, 4, 3), 7, dtype=np.uint8), extension='.png'
+    ))
+    tile = pickle.loads(pickle.dumps(VirtualTile([None, file], 2, 4, '0_0_0.png')))
+    assert (tile.stem, tile.suffix) == ('0_0_0', '.png')
+    rgb = tile.read()
+    assert rgb.shape == (8, 8, 3)
+    assert (rgb[:4, :4] == 0).all()
+    assert (rgb[4:, :4] == 7).all()
+    # the missing tiles are known to be black without reading them
+    tile = VirtualTile([None, file, file, file], 2, 4, '0_0_0.png')
+    assert tile.missing == nodata_ratio(tile.read()) == .25
@@ -0,0 +1,96 @@
+import numpy as np
+
+from tile2net.raster.tile import Tile
+from tile2net.raster.tiles import PoseDict, TileArray
+
+
+def test_indexing():
+    tiles = TileArray.from_grid(100, 200, 4, 3, zoom=19)
+    assert tiles.shape == (4, 3)
+    assert tiles.size == 12
+    tile = tiles[2, 1]
+    assert isinstance(tile, Tile)
+    assert (tile.xtile, tile.ytile, tile.idd, tile.position) == (102, 201, 7, (2, 1))
+    # tiles are materialized once, so that their state persists
+    assert tiles[2, 1] is tile
+    assert tiles.flat[7] is tile
+    assert tiles.flatten()[7] is tile
+
+    view = tiles[::2, ::2]
+    assert view.shape == (2, 2)
+    assert view[1, 1] is tiles[2, 2]
+    assert [t.idd for t in view.flat] == [0, 2, 6, 8]
+    assert np.array(view).shape == (2, 2)
+
+
+def test_stepped():
+    tiles = TileArray.from_grid(100, 200, 8, 6, step=2, stride=3, size=512)
+    assert tiles.shape == (4, 3)
+    tile = tiles[1, 2]
+    assert (tile.xtile, tile.ytile, tile.idd, tile.tile_step) == (102, 204, 5, 2)
+    assert tiles.bottom[1, 2] == tile.bottom
+    assert tiles.right[1, 2] == tile.right
+
+
+def test_active():
+    tiles = TileArray.from_grid(100, 200, 4, 3)
+    tile = tiles[0, 1]
+    flat = tiles.flatten()
+    active = flat.active
+    active[[1, 5]] = False
+    flat.active = active
+    assert not tile.active
+    assert not tiles[1, 2].active
+    assert tiles.active.sum() == 10
+
+
+def test_pose_dict():
+    tiles = TileArray.from_grid(100, 200, 4, 3)
+    pose = PoseDict(3, tiles.shape)
+    assert dict(pose) == {tile.idd: tile.position for tile in tiles.flat}
+
+
+def test_transforms():
+    tiles = TileArray.from_grid(154373, 197137, 4, 3, step=2, size=512)
+    expected = [tile.tfm for tile in tiles.flat]
+    fresh = TileArray.from_grid(154373, 197137, 4, 3, step=2, size=512)
+    for affine, tfm in zip(fresh[1:].affines(), expected[fresh.shape[1]:]):
+        assert affine.almost_equals(tfm)
+    # tiles materialized after the transforms were computed reuse them
+    assert fresh[1, 0].tfm == fresh[1:].affines()[0]
+    bounds = fresh.bounds[1, 1]
+    assert np.allclose(bounds, fresh[1, 1].tile2poly(*bounds).bounds)
+
+
+def test_map_classes():
+    tile = Tile(xtile=154308, ytile=197167, idd=0, position=(0, 0), size=128)
+    # touching and nested regions of every class on the background
+    classes = np.full((128, 128), 3, dtype=np.uint8)
+    classes[10:90, 10:90] = 0
+    classes[30:50, 30:50] = 3
+    classes[60:120, 20:40] = 1
+    classes[70:100, 40:110] = 2
+    classes[75:80, 60:65] = 0
+    # sidewalks are blue, roads green, and crosswalks red in the colorized masks
+    palette = np.array([[0, 0, 255], [0, 128, 0], [255, 0, 0], [0, 0, 0]], dtype=np.uint8)
+    expected = tile.map_features(palette[classes], img_array=True)
+    polygons = tile.map_classes(classes)
+    assert list(polygons.f_type) == list(expected.f_type)
+    assert polygons.geometry.geom_equals_exact(expected.geometry, 1e-9).all()
+    assert tile.map_classes(np.full((128, 128), 3, dtype=np.uint8)) is None
+
+
+def test_labels_to_poly():
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    labels[4:36, 4:36] = 1
+    labels[12:20, 12:20] = 0
+    labels[40:60, 40:50] = 2
+    # smaller than the minimum area
+    labels[50:53, 5:8] = 1
+    polygons = Tile.labels_to_poly(labels, mask=labels != 0)
+    assert list(polygons.value) == [1, 2]
+    square, rectangle = polygons.geometry
+    assert len(square.interiors) == 1
+    assert square.area == 32 * 32 - 8 * 8
+    assert rectangle.bounds == (40, 40, 50, 60)
+    assert Tile.labels_to_poly(labels, mask=labels == 3).empty
@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+
+import imageio.v3
+import pytest
+import torch
+
+from tile2net.tileseg.config import cfg
+from tile2net.tileseg.utils.misc import AverageMeter, ImageDumper, fmt_scale
+from tile2net.tileseg.utils.trnval_utils import eval_minibatch, flip_tensor, resize_tensor
+
+NUM_CLASSES = 4
+
+
+class Net(torch.nn.Module):
+    # a small deterministic network that predicts each pixel's class
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.conv = torch.nn.Conv2d(3, NUM_CLASSES, 3, padding=1)
+
+    def forward(self, inputs):
+        return {'pred': self.conv(inputs['images'])}
+
+
+@pytest.fixture
+def classes(monkeypatch):
+    monkeypatch.setitem(cfg.DATASET, 'NUM_CLASSES', NUM_CLASSES)
+
+
+def arguments(**kwargs) -> SimpleNamespace:
+    args = dict(
+        device='cpu',
+        default_scale=1.0,
+        multi_scale_inference=True,
+        # 0.5 and 0.51 infer at the same size
+        model=SimpleNamespace(extra_scales='0.5,0.51,1.5'),
+        do_flip=True,
+        channels_last=False,
+        bf16=False,
+        dump_assets=True,
+    )
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+def minibatch():
+    torch.manual_seed(1)
+    images = torch.rand(2, 3, 16, 16)
+    gts = torch.randint(0, NUM_CLASSES, (2, 16, 16))
+    return images, gts, ['a', 'b'], 1.0
+
+
+def sequential(images, net, scales, do_flip):
+    # flips and scales inferred one at a time, as eval_minibatch used to
+    input_size = images.shape[2:]
+    flips = [1, 0] if do_flip else [0]
+    output = 0.0
+    preds = {}
+    with torch.no_grad():
+        for flip in flips:
+            for scale in scales:
+                inputs = flip_tensor(images, 3) if flip else images
+                if scale != 1.0:
+                    inputs = resize_tensor(inputs, [round(sz * scale) for sz in input_size])
+                pred = net({'images': inputs})['pred']
+                if not flip:
+                    preds[fmt_scale('pred', scale)] = pred.argmax(1).numpy()
+                if scale != 1.0:
+                    pred = resize_tensor(pred, input_size)
+                output = output + (flip_tensor(pred, 3) if flip else pred)
+    return output / len(scales) / len(flips), preds
+
+
+def test_batched_tta(classes):
+    net = Net().eval()
+    data = minibatch()
+    args = arguments()
+    # val_idx is not 0 so that the scales are not logged without a logx setup
+    assets, _ = eval_minibatch(
+        data, net, torch.nn.CrossEntropyLoss(), AverageMeter(), True, args, 1,
+    )
+    output, preds = sequential(data[0], net, [1.0, .5, .51, 1.5], True)
+    assert (assets['predictions'] == output.argmax(1).numpy()).all()
+    # each scale keeps its own prediction, including those sharing a pass
+    assert sorted(preds) == sorted(item for item in assets if item.startswith('pred_'))
+    for item, pred in preds.items():
+        assert (assets[item] == pred).all()
+
+
+def test_uint8_predictions(classes, monkeypatch, tmp_path):
+    net = Net().eval()
+    data = minibatch()
+    args = arguments(multi_scale_inference=False, do_flip=False, dump_assets=False)
+    assets, _ = eval_minibatch(
+        data, net, torch.nn.CrossEntropyLoss(), AverageMeter(), True, args, 1,
+    )
+    # the softmax and the max taken on the host, as eval_minibatch used to
+    output, _ = sequential(data[0], net, [1.0], False)
+    max_probs, predictions = torch.nn.functional.softmax(output, dim=1).max(1)
+    assert assets['predictions'].dtype == 'uint8'
+    assert (assets['predictions'] == predictions.numpy()).all()
+
+    # the prob mask is dumped with the error mask when metrics are calculated
+    monkeypatch.setitem(cfg, 'RESULT_DIR', str(tmp_path))
+    dumper = ImageDumper(val_len=1, args=args, tensorboard=False, write_webpage=False)
+    (tmp_path / 'seg_results').mkdir()
+    dump_dict = {'err_mask': assets['err_mask'], 'assets': assets}
+    saved, _ = dumper.save_prob_and_err_mask(dump_dict, 'a', 0, assets['predictions'][0])
+    assert saved
+    prob = imageio.v3.imread(tmp_path / 'seg_results' / 'a_prob.png')
+    expected = max_probs[0].numpy() * 255
+    assert abs(prob.astype(float) - expected).max() <= 1
+    assert (tmp_path / 'seg_results' / 'a_err_mask.png').exists()
@@ -190,6 +190,12 @@ __C.MODEL.BBLUR = True
 __C.MODEL.FULL_CROP_MODELING = False
 __C.MODEL.EVAL = 'test'
 __C.EVAL_FOLDER = None
+# assemble the stitched tiles from the static tiles in the loader; see Raster.virtual_stitched
+__C.VIRTUAL_STITCH = False
+# write the predictions into a Cloud Optimized GeoTIFF; see Raster.mosaic
+__C.MOSAIC = False
+# tiles with a greater fraction of black, no-data pixels are skipped before inference
+__C.NODATA_RATIO = 0.25
 __C.MODEL.PRE_SIZE = None
 __C.MODEL.RAND_AUGMENT = None
 __C.MODEL.RMI_LOSS = False
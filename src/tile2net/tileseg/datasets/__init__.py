@@ -40,6 +40,7 @@ from runx.logx import logx
 
 from tile2net.tileseg.config import cfg, update_dataset_cfg, update_dataset_inst
 from tile2net.tileseg.datasets.randaugment import RandAugment
+from tile2net.tileseg.datasets.utils import collate_data
 from toolz import pipe, curried
 
 def setup_loaders(args):
@@ -159,10 +160,12 @@ def setup_loaders(args):
     else:
         val_sampler = None
 
+    # when testing, the batches are paired with the number of images without data skipped
     val_loader = DataLoader(val_set, batch_size=cfg.MODEL.BS_VAL,
                             num_workers=cfg.NUM_WORKERS // 2,
                             shuffle=False, drop_last=False,
-                            sampler=val_sampler)
+                            sampler=val_sampler,
+                            collate_fn=collate_data if val_name == 'test' else None)
 
     if cfg.MODEL.EVAL is not None:
         # Don't create train dataloader if eval
@@ -29,6 +29,7 @@ POSSIBILITY OF SUCH DAMAGE.
 
 Generic dataloader base class
 """
+import io
 import os
 import glob
 import numpy as np
@@ -37,7 +38,10 @@ from PIL import Image
 from torch.utils import data
 from tile2net.tileseg.config import cfg
 from tile2net.tileseg.datasets import uniform
+from tile2net.tileseg.datasets.utils import nodata_ratio
 from tile2net.tileseg.utils.misc import tensor_to_pil
+from tile2net.raster.pack import PackFile
+from tile2net.raster.stitcher import VirtualTile
 
 
 class BaseLoader(data.Dataset):
@@ -148,7 +152,15 @@ class BaseLoader(data.Dataset):
         return img, mask, scale_float
 
     def read_images(self, img_path, mask_path):
-        img = Image.open(img_path).convert('RGB')
+        if isinstance(img_path, PackFile):
+            img = Image.open(io.BytesIO(img_path.read_bytes())).convert('RGB')
+            img_path = img_path.name
+        elif isinstance(img_path, VirtualTile):
+            # assembled from the static tiles by this worker
+            img = Image.fromarray(img_path.read())
+            img_path = img_path.name
+        else:
+            img = Image.open(img_path).convert('RGB')
         if mask_path is None or mask_path == '':
             w, h = img.size
             mask = np.zeros((h, w))
@@ -174,6 +186,8 @@ class BaseLoader(data.Dataset):
         - image: image, tensor
         - mask: mask, tensor
         - image_name: basename of file, string
+
+        or None for a tile to test that is mostly without data
         """
         # Pick an image, fill in defaults if not using class uniform
         if len(self.imgs[index]) == 2:
@@ -185,6 +199,10 @@ class BaseLoader(data.Dataset):
 
         img, mask, img_name = self.read_images(img_path, mask_path)
 
+        if self.mode == 'test' and nodata_ratio(img) > cfg.NODATA_RATIO:
+            # the tile never reaches the network; see collate_data
+            return None
+
         if 'refinement' in mask_path:
             mask = np.array(mask)
             prob_mask_path = mask_path.replace('.png', '_prob.png')
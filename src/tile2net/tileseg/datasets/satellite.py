@@ -30,7 +30,7 @@ from collections import namedtuple
 from tile2net.tileseg.config import cfg
 from runx.logx import logx
 from tile2net.tileseg.datasets.base_loader import BaseLoader
-from tile2net.tileseg.datasets.utils import make_dataset_folder
+from tile2net.tileseg.datasets.utils import make_dataset_folder, make_dataset_virtual
 from tile2net.tileseg.datasets import uniform
 
 Label = namedtuple( 'Label' , [
@@ -106,7 +106,9 @@ class Loader(BaseLoader):
         ######################################################################
         # Assemble image lists
         ######################################################################
-        if mode == 'folder':
+        if mode in ('folder', 'test') and cfg.VIRTUAL_STITCH:
+            self.all_imgs = make_dataset_virtual(cfg.CITY_INFO_PATH, testing=mode == 'test')
+        elif mode == 'folder':
             self.all_imgs = make_dataset_folder(eval_folder)
         elif mode =='test':
             self.all_imgs = make_dataset_folder(eval_folder, testing=True)
@@ -1,6 +1,34 @@
 import os
 import numpy as np
 from PIL import Image
+from torch.utils.data import default_collate
+
+from tile2net.raster.pack import TilePack
+
+
+def make_dataset_virtual(city_info, testing=None):
+    """
+    Create the list of stitched tiles of a project, which are assembled
+    from its static tiles when read rather than read from the stitched folder
+
+    input: path to the city_info.json of the project
+       testing: skip the stitched tiles that are mostly missing, from the
+       inventory alone, as they would be skipped once read
+
+    returns: items list with '' filled for mask path
+    """
+    from tile2net.raster.raster import Raster
+    from tile2net.tileseg.config import cfg
+    tiles = Raster.from_info(city_info).virtual_stitched()
+    items = [
+        (tile, '')
+        for tile in tiles
+        if not testing or tile.missing <= cfg.NODATA_RATIO
+    ]
+    print(f'Found {len(items)} virtual imgs')
+    if len(items) < len(tiles):
+        print(f'Skipped {len(tiles) - len(items)} virtual imgs without data')
+    return items
 
 
 def make_dataset_folder(folder, testing=None):
@@ -12,7 +40,15 @@ def make_dataset_folder(folder, testing=None):
    
     returns: items list with None filled for mask path
     """
-    items = os.listdir(folder)
+    if folder.endswith('.mbtiles'):
+        # tiles packed in a single file have no ground truth
+        if not os.path.exists(folder):
+            raise FileNotFoundError(folder)
+        items = [(f, '') for f in TilePack(folder).files()]
+        print(f'Found {len(items)} packed imgs')
+        return items
+    # skip hidden files such as the directory's .inventory
+    items = [f for f in os.listdir(folder) if not f.startswith('.')]
     if testing:
                 
         items = [(os.path.join(folder, f), '') for f in items]
@@ -35,3 +71,26 @@ def make_dataset_folder(folder, testing=None):
     """
 
     return items
+
+
+def nodata_ratio(img):
+    """
+    The fraction of the pixels of an RGB image that are black, i.e. without data
+    """
+    img = np.asarray(img)
+    return 1 - np.count_nonzero(img.any(axis=2)) / (img.shape[0] * img.shape[1])
+
+
+def collate_data(batch):
+    """
+    Collate the images of a batch that have data; the loader reads the
+    images without data as None so that they never reach the network.
+
+    returns: the batch, or None if no image has data, and the number of
+    images skipped
+    """
+    data = [item for item in batch if item is not None]
+    skipped = len(batch) - len(data)
+    if not data:
+        return None, skipped
+    return default_collate(data), skipped
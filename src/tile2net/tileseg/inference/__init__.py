@@ -34,6 +34,8 @@ import geopandas as gpd
 
 import os
 import sys
+from functools import cached_property
+from typing import Callable, Optional
 
 import argh
 import torch
@@ -47,8 +49,10 @@ from tile2net.tileseg.config import assert_and_infer_cfg, cfg
 from tile2net.tileseg.utils.misc import AverageMeter, prep_experiment
 from tile2net.tileseg.utils.misc import ImageDumper, ThreadedDumper
 from tile2net.tileseg.utils.trnval_utils import eval_minibatch
+from tile2net.tileseg.utils.device import bf16_supported, configure_cpu, get_device
 from tile2net.tileseg.loss.utils import get_loss
 from tile2net.tileseg.loss.optimizer import get_optimizer, restore_opt, restore_net
+from tile2net.tileseg.loss.optimizer import forgiving_state_restore, load_state_dict
 
 from tile2net.tileseg import datasets
 from tile2net.tileseg import network
@@ -57,6 +61,7 @@ from tile2net.namespace import Namespace
 from tile2net.logger import logger
 
 from tile2net.raster.pednet import PedNet
+from tile2net.raster.polygonizer import Polygonizer, polygonize_mosaic
 import logging
 
 import numpy as np
@@ -273,6 +278,10 @@ def inference_(args: Namespace):
         pred = dict()
         _temp = dict.fromkeys([i for i in range(10)], None)
         for val_idx, data in enumerate(val_loader):
+            if testing:
+                data, _ = data
+                if data is None:
+                    continue
             input_images, labels, img_names, _ = data
 
             # Run network
@@ -329,6 +338,7 @@ def inference_(args: Namespace):
 class Inference:
     def __init__(self, args: Namespace):
         self.args = args
+        self.start = time.perf_counter()
         if args.dump_percent:
             if not os.path.exists(args.result_dir):
                 os.mkdir(args.result_dir)
@@ -363,8 +373,9 @@ class Inference:
         if args.options.test_mode:
             args.max_epoch = 2
 
-        num_gpus = torch.cuda.device_count()
-        if num_gpus > 1:
+        device = get_device(args.device)
+        num_gpus = torch.cuda.device_count() if device.type == 'cuda' else 0
+        if num_gpus > 1 and device.index is None:
             # Distributed training setup
 
             args.world_size = int(os.environ.get('WORLD_SIZE', num_gpus))
@@ -373,60 +384,124 @@ class Inference:
             torch.cuda.set_device(args.local_rank)
             args.distributed = True
             args.global_rank = int(os.environ['RANK'])
+            device = torch.device('cuda', args.local_rank)
             print(f'Using distributed training with {args.world_size} GPUs.')
-        elif num_gpus == 1:
+        elif num_gpus:
             # Single GPU setup
             print('Using a single GPU.')
-            args.local_rank = 0
+            args.local_rank = device.index or 0
             torch.cuda.set_device(args.local_rank)
+            device = torch.device('cuda', args.local_rank)
         else:
             # CPU setup
-            print('Using CPU.')
             args.local_rank = -1  # Indicating CPU usage
+            world_size = int(os.environ.get('WORLD_SIZE', 1))
+            if world_size > 1:
+                # workers launched by torchrun each infer a shard of the tiles
+                dist.init_process_group(backend='gloo', init_method='env://')
+                args.world_size = world_size
+                args.distributed = True
+                args.global_rank = dist.get_rank()
+            socket = (
+                int(os.environ.get('LOCAL_RANK', 0))
+                if args.worker_per_socket
+                else None
+            )
+            configure_cpu(args.cpu_threads, args.cpu_interop_threads, socket)
+            print(f'Using CPU with {args.world_size} workers.')
+
+        if args.bf16 and not bf16_supported(device):
+            logger.warning(f'{device} does not support bfloat16; inferring in float32')
+            args.bf16 = False
+        args.device = str(device)
+        # the loaders read cfg.DISTRIBUTED and cfg.WORLD_SIZE
+        cfg.immutable(False)
+        args.update_cfg()
 
         assert args.result_dir is not None, 'need to define result_dir arg'
 
-    def inference(self, rasterfactory=None):
+    def setup(self) -> DataLoader:
+        """
+        Point the config at the current raster and build its loader; this
+        is repeated for every raster, while the network is loaded once.
+        """
         train_loader: DataLoader
         val_loader: DataLoader
         train_obj: datasets.Loader
-        net: torch.nn.parallel.DataParallel
-        optim: torch.optim.sgd.SGD
-
         args = self.args
 
+        if getattr(logx, 'tb_writer', None) is not None:
+            # release the log files of the previous raster
+            logx.tb_writer.close()
+            logx.log_file.close()
+            logx.metrics_fp.close()
         logx.initialize(
             logdir=str(args.result_dir),
             tensorboard=True, hparams=vars(args),
             global_rank=args.global_rank
         )
 
+        cfg.immutable(False)
+        args.update_cfg()
         assert_and_infer_cfg(args)
         prep_experiment(args)
         train_loader, val_loader, train_obj = datasets.setup_loaders(args)
+        return val_loader
+
+    @cached_property
+    def model(self) -> tuple[torch.nn.parallel.DataParallel, torch.nn.Module, Optional[torch.optim.Optimizer]]:
+        """
+        The network, its validation criterion, and its optimizer, loaded once.
+        The optimizer is only built if its state is to be restored, as
+        inference never steps it, and only the model state of the snapshot
+        is loaded, memory-mapped from a converted copy; see load_state_dict.
+        """
+        net: torch.nn.parallel.DataParallel
+        optim: Optional[torch.optim.sgd.SGD] = None
+        args = self.args
+        start = time.perf_counter()
+
         criterion, criterion_val = get_loss(args)
+        state_dict = None
         if args.model.snapshot:
             if 'ASSETS_PATH' in args.model.snapshot:
                 args.model.snapshot = args.model.snapshot.replace('ASSETS_PATH', cfg.ASSETS_PATH)
-            checkpoint = torch.load(args.model.snapshot, map_location=torch.device('cpu'))
-            args.restore_net = True
             msg = "Loading weights from: checkpoint={}".format(args.model.snapshot)
             logx.msg(msg)
+            state_dict = load_state_dict(args.model.snapshot)
+            args.restore_net = True
+            # the snapshot replaces the ImageNet weights of the trunk, which need not be read
+            cfg.immutable(False)
+            cfg.MODEL.HRNET_CHECKPOINT = ''
+            cfg.immutable(True)
+        read = time.perf_counter() - start
 
         net: tile2net.tileseg.network.ocrnet.MscaleOCR = network.get_net(args, criterion)
-
-        optim, scheduler = get_optimizer(args, net)
-
+        if args.restore_optimizer:
+            optim, scheduler = get_optimizer(args, net)
 
         net = network.wrap_network_in_dataparallel(args, net)
         if args.restore_optimizer:
+            checkpoint = torch.load(args.model.snapshot, map_location='cpu', weights_only=False)
             restore_opt(optim, checkpoint)
-        if args.restore_net:
-            restore_net(net, checkpoint)
+        if state_dict is not None:
+            forgiving_state_restore(net, state_dict)
         if args.options.init_decoder:
             net.module.init_mods()
         torch.cuda.empty_cache()
 
+        now = time.perf_counter()
+        logger.info(
+            f'Loaded the network in {now - start:.1f}s, {read:.1f}s of which reading '
+            f'the weights; cold start took {now - self.start:.1f}s'
+        )
+        return net, criterion_val, optim
+
+    def inference(self, rasterfactory=None, progress: Callable[[int, int], None] = None):
+        args = self.args
+        val_loader = self.setup()
+        net, criterion_val, optim = self.model
+
         if args.tile2net:
             if rasterfactory:
                 city_data = rasterfactory
@@ -446,7 +521,7 @@ class Inference:
                     val_loader, net, criterion=None, optim=None, epoch=0,
                     calc_metrics=False, dump_assets=args.dump_assets,
                     dump_all_images=True, testing=True, grid=city_data,
-                    args=args,
+                    progress=progress, args=args,
                 )
                 return 0
 
@@ -455,7 +530,7 @@ class Inference:
                 self.validate(
                     val_loader, net, criterion=criterion_val, optim=optim, epoch=0,
                     calc_metrics=False, dump_assets=args.dump_assets,
-                    dump_all_images=True,
+                    dump_all_images=True, progress=progress,
                     args=args,
                 )
                 return 0
@@ -475,11 +550,13 @@ class Inference:
             dump_all_images=False,
             testing=None,
             grid=None,
+            progress: Callable[[int, int], None] = None,
             **kwargs
     ):
         """
         Run validation for one epoch
         :val_loader: data loader for validation
+        :progress: called with the number of images inferred and the total after each batch
         """
         input_images: torch.Tensor
         labels: torch.Tensor
@@ -488,7 +565,6 @@ class Inference:
         pred: dict
         values: numpy.ndarray
         args = self.args
-        # todo map_feature is how Tile generates poly
         gdfs: list[GeoDataFrame] = []
 
         dumper = ThreadedDumper(
@@ -498,12 +574,48 @@ class Inference:
             args=args,
         )
 
+        mosaic = None
+        windowed = False
+        if testing and grid and (args.mosaic or args.polygonize_mosaic) and args.distributed:
+            logger.warning('The predictions mosaic is not written by distributed workers')
+        elif testing and grid and (args.mosaic or args.polygonize_mosaic):
+            # class-index predictions, written as each batch finishes
+            palette = cfg.DATASET_INST.color_mapping
+            colormap = {
+                i: tuple(palette[3 * i: 3 * i + 3])
+                for i in range(cfg.DATASET_INST.num_classes)
+            }
+            mosaic = grid.mosaic(
+                grid.project.mosaics.predictions,
+                count=1,
+                nodata=255,
+                colormap=colormap,
+                resampling='nearest',
+            )
+            # the mosaic is polygonized in windows once every tile is written
+            windowed = args.polygonize_mosaic
+
+        polygonizer = None
+        if testing and grid and not windowed:
+            # the predictions are polygonized in processes while the network runs
+            polygonizer = Polygonizer(workers=args.polygon_workers)
+
         net.eval()
         val_loss = AverageMeter()
         iou_acc = 0
         pred = dict()
         _temp = dict.fromkeys([i for i in range(10)], None)
+        inferred = 0
+        skipped = 0
         for val_idx, data in enumerate(val_loader):
+            if testing:
+                # the images without data are dropped by the loader; see collate_data
+                data, nodata = data
+                skipped += nodata
+                if data is None:
+                    if progress is not None:
+                        progress(inferred + skipped, len(val_loader.dataset))
+                    continue
             input_images, labels, img_names, _ = data
 
             # Run network
@@ -513,6 +625,17 @@ class Inference:
 
             iou_acc += _iou_acc
 
+            if mosaic is not None:
+                for prediction, img_name in zip(assets['predictions'], img_names):
+                    # stitched tiles are named r_c_i
+                    r, c, _ = img_name.split('_')[-3:]
+                    mosaic.write(prediction, int(r), int(c))
+
+            if polygonizer is not None:
+                for prediction, img_name in zip(assets['predictions'], img_names):
+                    i = img_name.split('_')[-1]
+                    polygonizer.submit(grid.tiles[grid.pose_dict[int(i)]], prediction)
+
             input_images, labels, img_names, _ = data
 
             dumpdict = dict(
@@ -522,17 +645,16 @@ class Inference:
                 assets=assets,
             )
             if testing:
-                prediction = assets['predictions'][0]
-                values, counts = np.unique(prediction, return_counts=True)
-                pred[img_names[0]] = copy.copy(_temp)
+                for prediction, img_name in zip(assets['predictions'], img_names):
+                    values, counts = np.unique(prediction, return_counts=True)
+                    pred[img_name] = copy.copy(_temp)
 
-                for v in range(len(values)):
-                    pred[img_names[0]][values[v]] = counts[v]
+                    for v in range(len(values)):
+                        pred[img_name][values[v]] = counts[v]
 
-                dump = dumper.dump(dumpdict, val_idx, testing=True, grid=grid)
+                dumper.dump(dumpdict, val_idx, testing=True)
             else:
-                dump = dumper.dump(dumpdict, val_idx)
-            gdfs.extend(dump)
+                dumper.dump(dumpdict, val_idx)
 
             if (
                     args.options.test_mode
@@ -542,6 +664,27 @@ class Inference:
 
             if val_idx % 20 == 0:
                 logx.msg(f'Inference [Iter: {val_idx + 1} / {len(val_loader)}]')
+            inferred += len(img_names)
+            if progress is not None:
+                progress(inferred + skipped, len(val_loader.dataset))
+
+        dumper.shutdown()
+        if skipped:
+            logger.info(f'Skipped {skipped:,} of {inferred + skipped:,} tiles without data')
+        if mosaic is not None:
+            path = mosaic.close()
+            if windowed and path is not None:
+                gdfs = polygonize_mosaic(path, workers=args.polygon_workers)
+        if polygonizer is not None:
+            gdfs = polygonizer.close()
+
+        if args.distributed:
+            # the polygons of every worker are saved by the first
+            gathered = [None] * args.world_size if args.global_rank == 0 else None
+            dist.gather_object(gdfs, gathered, dst=0)
+            if args.global_rank != 0:
+                return
+            gdfs = [gdf for shard in gathered for gdf in shard]
 
         if testing:
             if grid:
@@ -561,6 +704,122 @@ class Inference:
                 net = PedNet(poly=polys, project=grid.project)
                 net.convert_whole_poly2line()
 
+
+class InferenceSession:
+    """
+    Infers successive rasters in this process, loading the network once,
+    rather than spawning `python -m tile2net inference` for every raster:
+
+        session = InferenceSession(device='cpu', bf16=True)
+        for raster in rasters:
+            raster.generate(2)
+            raster.inference(session=session)
+    """
+
+    def __init__(
+            self,
+            device: str = None,
+            batch_size: int = None,
+            channels_last: bool = False,
+            bf16: bool = False,
+            cpu_threads: int = None,
+            cpu_interop_threads: int = None,
+            snapshot: str = None,
+            **options,
+    ):
+        """
+        Parameters
+        ----------
+        device : str
+            'cpu', 'cuda', or 'cuda:N'; the GPU if there is one by default
+        batch_size : int
+            stitched tiles per forward pass; 1 by default
+        channels_last : bool
+            run the network in the channels_last memory format
+        bf16 : bool
+            run the network under bfloat16 autocast where it is supported
+        cpu_threads : int
+            intra-op threads on CPU
+        cpu_interop_threads : int
+            inter-op threads on CPU
+        snapshot : str
+            weights of the network; those of the project by default
+        options
+            any other option of `python -m tile2net inference`, by its
+            Namespace attribute, e.g. dump_assets=True
+        """
+        self.options = {
+            'device': device,
+            'model.bs_val': batch_size,
+            'channels_last': channels_last,
+            'bf16': bf16,
+            'cpu_threads': cpu_threads,
+            'cpu_interop_threads': cpu_interop_threads,
+            'model.snapshot': snapshot,
+            **options,
+        }
+        self.inference: Optional[Inference] = None
+
+    def __repr__(self):
+        loaded = self.inference is not None and 'model' in self.inference.__dict__
+        return f'<{self.__class__.__qualname__} loaded={loaded}>'
+
+    def infer(
+            self,
+            raster,
+            eval_folder: str = None,
+            virtual_stitch: bool = False,
+            mosaic: bool = False,
+            polygonize_mosaic: bool = False,
+            dump_percent: int = None,
+            progress: Callable[[int, int], None] = None,
+    ):
+        """
+        Infer the stitched tiles of a raster and save its polygons and network.
+
+        Parameters
+        ----------
+        raster : Raster
+            a raster whose tiles have been generated
+        eval_folder : str
+            folder of the images to infer; the stitched tiles by default
+        virtual_stitch : bool
+            assemble the stitched tiles from the static tiles while loading them
+        mosaic : bool
+            also write the predictions into a Cloud Optimized GeoTIFF
+        polygonize_mosaic : bool
+            polygonize the predictions mosaic in windows rather than each tile
+        dump_percent : int
+            percentage of the segmentation results to save
+        progress : Callable[[int, int], None]
+            called with the number of images inferred and the total after each batch
+        """
+        project = raster.save_info_json(return_dict=True)['project']
+        if not os.path.exists(project['tiles']['info']):
+            # the loaders read the raster from its info, as a subprocess would
+            raster.save_info_json()
+        if self.inference is None:
+            # the first raster determines the defaults, as the command line would
+            args = Namespace(
+                city_info_path=project['tiles']['info'],
+                interactive=True,
+                **self.options,
+            )
+            self.inference = Inference(args)
+        args = self.inference.args
+        args.city_info_path = project['tiles']['info']
+        args.eval_folder = str(eval_folder or project['tiles']['stitched'])
+        args.result_dir = project['segmentation']
+        args.dataset.name = project['name']
+        args.virtual_stitch = virtual_stitch
+        args.mosaic = mosaic
+        args.polygonize_mosaic = polygonize_mosaic
+        args.dump_percent = dump_percent or 0
+        if args.dump_percent and not os.path.exists(args.result_dir):
+            os.makedirs(args.result_dir)
+        return self.inference.inference(rasterfactory=raster, progress=progress)
+
+
 @commandline
 def inference(args: Namespace):
     return Inference(args).inference()
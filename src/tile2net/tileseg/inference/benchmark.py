@@ -0,0 +1,97 @@
+"""
+Measure the throughput of the segmentation network, in tiles per second,
+on random stitched tiles, e.g. to choose the CPU options of a machine:
+
+    python -m tile2net.tileseg.inference.benchmark --device cpu --channels_last --bf16
+"""
+from __future__ import annotations
+
+import tempfile
+import time
+
+import argh
+import torch
+from runx.logx import logx
+
+from tile2net.logger import logger
+from tile2net.tileseg import network
+from tile2net.tileseg.config import assert_and_infer_cfg, cfg, update_dataset_cfg
+from tile2net.tileseg.datasets.satellite import Loader
+from tile2net.tileseg.loss.optimizer import restore_net
+from tile2net.tileseg.utils.device import autocast, bf16_supported, configure_cpu, get_device
+
+
+@argh.arg('--device', help="'cpu', 'cuda', or 'cuda:N'; the GPU if there is one by default")
+@argh.arg('--batch_size', help='stitched tiles per forward pass')
+@argh.arg('--size', help='size of each stitched tile in pixels')
+@argh.arg('--iterations', help='timed forward passes')
+@argh.arg('--warmup', help='untimed forward passes before timing')
+@argh.arg('--threads', type=int, help='intra-op threads on CPU')
+@argh.arg('--interop_threads', type=int, help='inter-op threads on CPU')
+@argh.arg('--socket', type=int, help='pin to the CPUs of this socket')
+@argh.arg('--channels_last', help='run in the channels_last memory format')
+@argh.arg('--bf16', help='run under bfloat16 autocast')
+@argh.arg('--snapshot', help='weights to load; random weights by default')
+@argh.arg('--arch', help='network architecture')
+def benchmark(
+        device: str = None,
+        batch_size: int = 1,
+        size: int = 1024,
+        iterations: int = 10,
+        warmup: int = 2,
+        threads: int = None,
+        interop_threads: int = None,
+        socket: int = None,
+        channels_last: bool = False,
+        bf16: bool = False,
+        snapshot: str = None,
+        arch: str = 'ocrnet.HRNet_Mscale',
+) -> float:
+    """Time the forward passes of the network and log the tiles per second."""
+    device = get_device(device)
+    if device.type == 'cpu':
+        configure_cpu(threads, interop_threads, socket)
+    if bf16 and not bf16_supported(device):
+        logger.warning(f'{device} does not support bfloat16; benchmarking float32')
+        bf16 = False
+
+    logx.initialize(logdir=tempfile.mkdtemp(), tensorboard=False, global_rank=0)
+    # the trunk is not initialized from ImageNet; the snapshot, if any, replaces it
+    cfg.MODEL.HRNET_CHECKPOINT = ''
+    assert_and_infer_cfg(None, train_mode=False)
+    update_dataset_cfg(Loader.num_classes, Loader.ignore_label)
+    net = network.get_model(f'tile2net.tileseg.network.{arch}', Loader.num_classes, None)
+    net = torch.nn.DataParallel(net.to(device))
+    if snapshot:
+        restore_net(net, torch.load(snapshot, map_location='cpu'))
+    images = torch.rand(batch_size, 3, size, size, device=device)
+    if channels_last:
+        net = net.to(memory_format=torch.channels_last)
+        images = images.contiguous(memory_format=torch.channels_last)
+    net.eval()
+
+    def forward():
+        with torch.no_grad(), autocast(device, bf16):
+            net({'images': images})
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    for _ in range(warmup):
+        forward()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        forward()
+    elapsed = time.perf_counter() - start
+
+    tiles = iterations * batch_size
+    rate = tiles / elapsed
+    logger.info(
+        f'Inferred {tiles:,} {size}x{size} tiles in {elapsed:.1f}s ({rate:,.2f} tiles/sec) '
+        f'on {device} with {torch.get_num_threads()} threads, '
+        f'{channels_last=}, {bf16=}'
+    )
+    return rate
+
+
+if __name__ == '__main__':
+    argh.dispatch_command(benchmark)
@@ -25,6 +25,54 @@ commandline = compose_left(
         help='The path to the folder to run inference on; if False, '
              'then it determines the eval folder from the city_info.json',
     ),
+    arg(
+        '--virtual_stitch', action='store_true',
+        help='Assemble the stitched tiles from the static tiles while loading them, '
+             'rather than reading them from the eval folder',
+    ),
+    arg(
+        '--mosaic', action='store_true',
+        help='Also write the class-index predictions into a single Cloud Optimized GeoTIFF',
+    ),
+    arg(
+        '--nodata_ratio', type=float,
+        help='Skip the tiles with a greater fraction of black, no-data pixels; 0.25 by default',
+    ),
+    arg(
+        '--polygon_workers', type=int,
+        help='Processes that polygonize the predictions while the network runs; '
+             'every CPU by default',
+    ),
+    arg(
+        '--polygonize_mosaic', action='store_true',
+        help='Write the predictions mosaic and polygonize it in windows once inferred, '
+             'rather than polygonizing each tile; objects are not cut at the tile edges',
+    ),
+    arg(
+        '--device', type=str,
+        help="'cpu', 'cuda', or 'cuda:N'; the GPU if there is one by default",
+    ),
+    arg(
+        '--cpu_threads', type=int,
+        help='Intra-op threads on CPU; every CPU, or every CPU of the socket, by default',
+    ),
+    arg(
+        '--cpu_interop_threads', type=int,
+        help='Inter-op threads on CPU',
+    ),
+    arg(
+        '--channels_last', action='store_true',
+        help='Run the network in the channels_last memory format, which is faster on CPU',
+    ),
+    arg(
+        '--bf16', action='store_true',
+        help='Run the network under bfloat16 autocast where the device supports it',
+    ),
+    arg(
+        '--worker_per_socket', action='store_true',
+        help='Pin each worker to a CPU socket; launch one worker per socket with '
+             'torchrun --nproc_per_node=<sockets>',
+    ),
     arg(
         '--result_dir', type=str,
     ),
@@ -104,7 +152,8 @@ commandline = compose_left(
     arg(
         '--bs_val', type=int,
         # default=1,
-        help='Batch size for Validation per gpu'
+        help='Batch size for Validation per gpu',
+        dest='model.bs_val',
     ),
     arg(
         '--restore_net', action='store_true',
@@ -138,6 +187,11 @@ commandline = compose_left(
         help='Run multi scale inference',
     ),
 
+    arg(
+        '--do_flip', action='store_true',
+        help='Also infer the horizontally flipped images, in the same forward pass, '
+             'and average the predictions',
+    ),
     arg(
         '--default_scale', type=float,
         # default=1.0,
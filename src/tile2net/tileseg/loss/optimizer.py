@@ -31,6 +31,7 @@ POSSIBILITY OF SUCH DAMAGE.
 # Optimizer and scheduler related tasks
 
 import math
+import os
 import torch
 
 from torch import optim
@@ -124,6 +125,44 @@ def restore_snapshot(net, optimizer, snapshot, restore_optimizer_bool):
     return net, optimizer
 
 
+def load_state_dict(snapshot):
+    """
+    Load only the model state of a snapshot, for inference.
+
+    The state is converted once to {snapshot}.state_dict.pt beside the
+    snapshot, in torch's zipfile format, without the optimizer or any other
+    training state. Later loads memory-map that file with weights_only, so
+    pages are read as the tensors are copied into the network instead of
+    unpickling the whole checkpoint into memory first.
+    """
+    cache = os.path.splitext(snapshot)[0] + '.state_dict.pt'
+    if (
+            os.path.exists(cache)
+            and os.path.getmtime(cache) >= os.path.getmtime(snapshot)
+    ):
+        try:
+            return torch.load(cache, map_location='cpu', mmap=True, weights_only=True)
+        except TypeError:
+            # mmap requires torch >= 2.1; the installation docs list 2.0
+            return torch.load(cache, map_location='cpu', weights_only=True)
+
+    # the snapshot may pickle training state besides tensors
+    checkpoint = torch.load(snapshot, map_location='cpu', weights_only=False)
+    state_dict = checkpoint.get('state_dict', checkpoint)
+    temp = f'{cache}.{os.getpid()}.tmp'
+    try:
+        torch.save(state_dict, temp)
+        os.replace(temp, cache)
+    except OSError as e:
+        # e.g. the weights are read-only; load the snapshot every time
+        logx.msg(f'Could not cache the state of {snapshot}: {e}')
+        if os.path.exists(temp):
+            os.remove(temp)
+    else:
+        logx.msg(f'Cached the state of {snapshot} to {cache}')
+    return state_dict
+
+
 def restore_opt(optimizer, checkpoint):
     assert 'optimizer' in checkpoint, 'cant find optimizer in checkpoint'
     optimizer.load_state_dict(checkpoint['optimizer'])
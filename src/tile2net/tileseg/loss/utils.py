@@ -34,6 +34,7 @@ import torch.nn.functional as F
 
 from runx.logx import logx
 from tile2net.tileseg.config import cfg
+from tile2net.tileseg.utils.device import get_device
 from tile2net.tileseg.loss.rmi import RMILoss
 from tile2net.namespace import Namespace
 
@@ -44,27 +45,27 @@ def get_loss(args: Namespace):
     args: commandline arguments
     return: criterion, criterion_val
     """
-
+    device = get_device(args.device)
     if cfg.MODEL.RMI_LOSS:
         criterion = RMILoss(
             num_classes=cfg.DATASET.NUM_CLASSES,
-            ignore_index=cfg.DATASET.IGNORE_LABEL).cuda()
+            ignore_index=cfg.DATASET.IGNORE_LABEL).to(device)
     elif cfg.MODEL.IMG_WT_LOSS:
         criterion = ImageBasedCrossEntropyLoss2d(
             classes=cfg.DATASET.NUM_CLASSES,
             ignore_index=cfg.DATASET.IGNORE_LABEL,
-            upper_bound=args.wt_bound, fp16=args.train.fp16).cuda()
+            upper_bound=args.wt_bound, fp16=args.train.fp16).to(device)
     elif cfg.MODEL.JOINTBORDER:
         criterion = ImgWtLossSoftNLL(
             classes=cfg.DATASET.NUM_CLASSES,
             ignore_index=cfg.DATASET.IGNORE_LABEL,
-            upper_bound=args.wt_bound).cuda()
+            upper_bound=args.wt_bound).to(device)
     else:
         criterion = CrossEntropyLoss2d(
-            ignore_index=cfg.DATASET.IGNORE_LABEL).cuda()
+            ignore_index=cfg.DATASET.IGNORE_LABEL).to(device)
 
     criterion_val = CrossEntropyLoss2d(
-        weight=None, ignore_index=cfg.DATASET.IGNORE_LABEL).cuda()
+        weight=None, ignore_index=cfg.DATASET.IGNORE_LABEL).to(device)
     return criterion, criterion_val
 
 
@@ -7,6 +7,7 @@ import torch
 
 from runx.logx import logx
 from tile2net.tileseg.config import cfg
+from tile2net.tileseg.utils.device import get_device
 
 
 def get_net(args, criterion):
@@ -19,7 +20,9 @@ def get_net(args, criterion):
     num_params = sum([param.nelement() for param in net.parameters()])
     logx.msg('Model params = {:2.1f}M'.format(num_params / 1000000))
 
-    net = net.cuda()
+    net = net.to(get_device(args.device))
+    if args.channels_last:
+        net = net.to(memory_format=torch.channels_last)
     return net
 
 
@@ -35,7 +38,11 @@ def wrap_network_in_dataparallel(args, net):
     Wrap the network in Dataparallel using PyTorch's native SyncBatchNorm
     """
     # net = torch.nn.SyncBatchNorm.convert_sync_batchnorm(net)
-    if args.distributed:
+    if get_device(args.device).type == 'cpu':
+        # DistributedDataParallel only syncs gradients, and SyncBatchNorm is
+        # CUDA-only; workers on CPU each run their shard independently
+        net = torch.nn.DataParallel(net)
+    elif args.distributed:
         net = torch.nn.SyncBatchNorm.convert_sync_batchnorm(net)
         net = torch.nn.parallel.DistributedDataParallel(net,
                                                         device_ids=[args.local_rank],
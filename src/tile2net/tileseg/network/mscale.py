@@ -290,7 +290,7 @@ class MscaleV3Plus(MscaleBase):
                 scale_tensor = a_tensor
             else:
                 scale_tensor = torch.cat([scale_tensor, a_tensor])
-        scale_tensor = scale_tensor.cuda()
+        scale_tensor = scale_tensor.to(next(self.parameters()).device)
         return scale_tensor
 
     def _fwd(self, x, aspp_lo=None, aspp_attn=None, scale_float=None):
@@ -0,0 +1,105 @@
+"""
+Device placement and CPU tuning for inference
+"""
+from __future__ import annotations
+
+import contextlib
+import glob
+import os
+from collections import defaultdict
+
+import torch
+
+from tile2net.logger import logger
+
+DEVICES = 'auto', 'cpu', 'cuda'
+
+
+def get_device(name: str = None) -> torch.device:
+    """
+    Resolve a device name; None or 'auto' is the first GPU if there is one,
+    otherwise the CPU.
+    """
+    if name is None or name == 'auto':
+        return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    device = torch.device(name)
+    if device.type == 'cuda' and not torch.cuda.is_available():
+        raise ValueError(f'{name=} was requested but CUDA is not available')
+    return device
+
+
+def sockets() -> list[list[int]]:
+    """
+    The CPUs that this process may run on, grouped by physical socket;
+    a single group if the topology is unknown.
+    """
+    allowed = os.sched_getaffinity(0)
+    groups: dict[int, list[int]] = defaultdict(list)
+    for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology/physical_package_id'):
+        cpu = int(path.split('/')[-3][3:])
+        if cpu not in allowed:
+            continue
+        with open(path) as f:
+            groups[int(f.read())].append(cpu)
+    if not groups:
+        return [sorted(allowed)]
+    return [sorted(cpus) for _, cpus in sorted(groups.items())]
+
+
+def configure_cpu(
+        threads: int = None,
+        interop_threads: int = None,
+        socket: int = None,
+):
+    """
+    Set the intra-op and inter-op thread pools of torch, optionally pinning
+    this process to the CPUs of a single socket so that its threads share
+    that socket's caches and memory.
+
+    Parameters
+    ----------
+    threads : int
+        intra-op threads; the CPUs of the socket if pinned, else torch's default
+    interop_threads : int
+        inter-op threads; torch's default if None
+    socket : int
+        index of the socket to pin this process to, modulo the number of sockets
+    """
+    if socket is not None:
+        groups = sockets()
+        cpus = groups[socket % len(groups)]
+        os.sched_setaffinity(0, cpus)
+        threads = threads or len(cpus)
+        logger.info(f'Pinned to socket {socket % len(groups)} with CPUs {cpus[0]}-{cpus[-1]}')
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # the pool can only be sized before any inter-op work has started
+            logger.warning(
+                f'Could not set {interop_threads} inter-op threads; '
+                f'using {torch.get_num_interop_threads()}'
+            )
+    logger.info(
+        f'Using {torch.get_num_threads()} intra-op and '
+        f'{torch.get_num_interop_threads()} inter-op threads'
+    )
+
+
+def bf16_supported(device: torch.device) -> bool:
+    """Whether the device runs bfloat16 natively, e.g. with AVX512-BF16 or AMX on CPU."""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def autocast(device: torch.device, bf16: bool = False):
+    """A bfloat16 autocast context on the device, or a no-op if not bf16."""
+    if not bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device.type, dtype=torch.bfloat16)
@@ -50,15 +50,11 @@ from PIL import Image
 
 from tile2net.tileseg.config import cfg
 from tile2net.namespace import Namespace
-from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from runx.logx import logx
 
-from geopandas import GeoDataFrame
-
-if False:
-    from tile2net.raster.tile import Tile
-
 
 def fast_hist(pred, gtruth, num_classes):
     # mask indicates pixels we care about
@@ -263,6 +259,7 @@ class ImageDumper:
             dump_for_auto_labelling=False,
             dump_for_submission=False,
             dump_num=10,
+            tensorboard_num: Optional[int] = None,
     ):
         """
         Parameters
@@ -278,6 +275,7 @@ class ImageDumper:
         dump_err_prob: dump error probability
         dump_for_auto_labelling: dump images for auto-labelling
         dump_for_submission: dump images for submission
+        tensorboard_num: keep at most this many images for tensorboard; all if None
         """
         self.val_len = val_len
         self.tensorboard = tensorboard
@@ -308,6 +306,7 @@ class ImageDumper:
 
         self.imgs_to_tensorboard = []
         self.imgs_to_webpage = []
+        self.tensorboard_num = tensorboard_num
 
         self.visualize = standard_transforms.Compose([
             standard_transforms.Resize(384),
@@ -320,6 +319,13 @@ class ImageDumper:
         self.imgs_to_tensorboard = []
         self.imgs_to_webpage = []
 
+    @property
+    def tensorboard_full(self) -> bool:
+        return (
+                self.tensorboard_num is not None
+                and len(self.imgs_to_tensorboard) >= self.tensorboard_num
+        )
+
     def save_image(self, image, filename):
         cv2.imwrite(os.path.join(self.save_dir, filename), image)
 
@@ -328,7 +334,8 @@ class ImageDumper:
         if 'err_mask' in dump_dict and 'prob_mask' in dump_dict['assets']:
             prob_image = dump_dict['assets']['prob_mask'][idx]
             err_mask = dump_dict['err_mask'][idx]
-            self.save_image((prob_image.cpu().numpy() * 255).astype(np.uint8), f'{img_name}_prob.png')
+            # quantized to uint8 by eval_minibatch
+            self.save_image(prob_image.cpu().numpy(), f'{img_name}_prob.png')
             err_pil = Image.fromarray(prediction.astype(np.uint8)).convert('RGB')
             err_pil.save(os.path.join(self.save_dir, f'{img_name}_err_mask.png'))
             return True, err_pil
@@ -367,8 +374,10 @@ class ImageDumper:
                     mask = mask.squeeze().cpu().numpy()
                 else:
                     mask = mask.squeeze()
-                mask = (mask * 255)
-                mask = mask.astype(np.uint8)
+                # the probabilities are quantized to uint8 by eval_minibatch
+                if asset != 'prob_mask':
+                    mask = (mask * 255)
+                    mask = mask.astype(np.uint8)
                 mask_pil = Image.fromarray(mask)
                 mask_pil = mask_pil.convert('RGB')
                 mask_pil.save(mask_fn)
@@ -571,15 +580,74 @@ def fmt_scale(prefix, scale):
     return f'{prefix}_{scale_str}x'
 
 
+class BoundedWriter:
+    """
+    Saves images in a dedicated pool of threads. At most `bound` saves are
+    pending at once; submitting another blocks until one completes, so the
+    memory held by the pending images stays constant however many are saved.
+    No futures are kept; the errors of the saves are raised by wait.
+    """
+
+    def __init__(self, workers: Optional[int] = None, bound: Optional[int] = None):
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.threads = ThreadPoolExecutor(workers, thread_name_prefix='writer')
+        self.bound = threading.BoundedSemaphore(bound or 2 * workers)
+        self.idle = threading.Condition()
+        self.pending = 0
+        self.errors: list[BaseException] = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.bound.acquire()
+        with self.idle:
+            self.pending += 1
+        try:
+            self.threads.submit(self._run, fn, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except BaseException as e:
+            with self.idle:
+                self.errors.append(e)
+        finally:
+            self._release()
+
+    def _release(self):
+        with self.idle:
+            self.pending -= 1
+            self.idle.notify_all()
+        self.bound.release()
+
+    def wait(self):
+        """Wait for the pending saves, and raise the first error of any save."""
+        with self.idle:
+            self.idle.wait_for(lambda: not self.pending)
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        self.wait()
+        self.threads.shutdown()
+
+
 class ThreadedDumper(ImageDumper):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.futures: list[Future] = []
-        self.threads = ThreadPoolExecutor()
+    def __init__(self, *args, tensorboard_num: Optional[int] = 10, **kwargs):
+        super().__init__(*args, tensorboard_num=tensorboard_num, **kwargs)
+        self.writer = BoundedWriter()
         os.makedirs(self.save_dir, exist_ok=True)
 
-    def dump(self, dump_dict, val_idx, testing=None, grid=None):
+    def shutdown(self):
+        self.writer.shutdown()
 
+    def dump(self, dump_dict, val_idx, testing=None):
+        """
+        Dump every image of the batch; the images are saved by the writer,
+        and the predictions are polygonized by Inference.validate.
+        """
         colorize_mask_fn = cfg.DATASET_INST.colorize_mask
 
         for idx in range(len(dump_dict['input_images'])):
@@ -596,60 +664,30 @@ class ThreadedDumper(ImageDumper):
             input_image = standard_transforms.ToPILImage()(input_image)
             input_image = input_image.convert("RGB")
 
-            gt_pil = colorize_mask_fn(gt_image.cpu().numpy())
-
-            if testing:
-                alpha = False
-                all_pix = (np.array(input_image).shape[0] * np.array(input_image).shape[1])
-                if np.array(input_image).shape[-1] == 3:
-                    black = np.count_nonzero(np.all(np.array(input_image) == [0, 0, 0], axis=2))
-                elif np.array(input_image).shape[-1] == 4:
-                    black = np.count_nonzero(np.all(np.array(input_image) == [0, 0, 0, 0], axis=-1))
-                    alpha = True
-                ratio = black / all_pix
-
-                if ratio > 0.25 or alpha:
-                    continue
+            # when testing, the tiles without data were skipped by the loader
+            prediction_pil = colorize_mask_fn(prediction)
+            prediction_pil = prediction_pil.convert('RGB')
+            self.create_composite_image(input_image, prediction_pil, img_name)
 
-                else:
-                    prediction_pil = colorize_mask_fn(prediction)
-                    prediction_pil = prediction_pil.convert('RGB')
-                    self.create_composite_image(input_image, prediction_pil, img_name)
-
-                    if grid:
-                        idd_ = img_name.split('_')[-1]
-                        save_dir = os.path.join(cfg.RESULT_DIR, 'seg_results')
-                        self.save_dir = save_dir
-                        tile = grid.tiles[grid.pose_dict[int(idd_)]]
-                        polygons = self.map_features(tile, np.array(prediction_pil), img_array=True)
-                        if polygons is not None:
-                            yield polygons
+            if self.tensorboard_full:
+                to_tensorboard = None
             else:
-                # gt_fn = '{}_gt.png'.format(img_name)
                 gt_pil = colorize_mask_fn(gt_image.cpu().numpy())
-                # prediction_fn = '{}_prediction.png'.format(img_name)
-                prediction_pil = colorize_mask_fn(prediction)
-                prediction_pil = prediction_pil.convert('RGB')
-                self.create_composite_image(input_image, prediction_pil, img_name)
-
-            to_tensorboard = [
-                self.visualize(input_image.convert('RGB')),
-                self.visualize(gt_pil.convert('RGB')),
-                self.visualize(prediction_pil.convert('RGB')),
-            ]
-            if er_prob and err_pil is not None:
-                to_tensorboard.append(self.visualize(err_pil.convert('RGB')))
+                to_tensorboard = [
+                    self.visualize(input_image.convert('RGB')),
+                    self.visualize(gt_pil.convert('RGB')),
+                    self.visualize(prediction_pil.convert('RGB')),
+                ]
+                if er_prob and err_pil is not None:
+                    to_tensorboard.append(self.visualize(err_pil.convert('RGB')))
 
             self.get_dump_assets(dump_dict, img_name, idx, colorize_mask_fn, to_tensorboard)
 
-            self.imgs_to_tensorboard.append(to_tensorboard)
-
-            for future in self.futures:
-                future.result()
+            if to_tensorboard is not None:
+                self.imgs_to_tensorboard.append(to_tensorboard)
 
     def create_composite_image(self, input_image, prediction_pil, img_name):
-        threads = self.threads
-        futures = self.futures
+        writer = self.writer
         if not self.args.dump_percent:
             return
         self.dump_percent += self.args.dump_percent
@@ -665,12 +703,10 @@ class ThreadedDumper(ImageDumper):
         composited_fn = os.path.join(self.save_dir, composited_fn)
         # print(f'saving {composited_fn}')
         # composited.save(composited_fn)
-        future = threads.submit(composited.save, composited_fn)
-        futures.append(future)
+        writer.submit(composited.save, composited_fn)
 
     def get_dump_assets(self, dump_dict, img_name, idx, colorize_mask_fn, to_tensorboard):
-        threads = self.threads
-        futures = self.futures
+        writer = self.writer
         if self.dump_assets:
             assets = dump_dict['assets']
             for asset in assets:
@@ -678,20 +714,21 @@ class ThreadedDumper(ImageDumper):
                 mask_fn = os.path.join(self.save_dir, f'{img_name}_{asset}.png')
                 if 'pred_' in asset:
                     pred_pil = colorize_mask_fn(mask)
-                    future = threads.submit(pred_pil.save, mask_fn)
-                    futures.append(future)
+                    writer.submit(pred_pil.save, mask_fn)
                     continue
                 if type(mask) == torch.Tensor:
                     mask = mask.squeeze().cpu().numpy()
                 else:
                     mask = mask.squeeze()
-                mask = (mask * 255)
-                mask = mask.astype(np.uint8)
+                # the probabilities are quantized to uint8 by eval_minibatch
+                if asset != 'prob_mask':
+                    mask = (mask * 255)
+                    mask = mask.astype(np.uint8)
                 mask_pil = Image.fromarray(mask)
                 mask_pil = mask_pil.convert('RGB')
-                future = threads.submit(mask_pil.save, mask_fn)
-                futures.append(future)
-                to_tensorboard.append(self.visualize(mask_pil))
+                writer.submit(mask_pil.save, mask_fn)
+                if to_tensorboard is not None:
+                    to_tensorboard.append(self.visualize(mask_pil))
 
     def save_prob_and_err_mask(
             self,
@@ -700,76 +737,18 @@ class ThreadedDumper(ImageDumper):
             idx,
             prediction,
     ):
-        threads = self.threads
-        futures = self.futures
+        writer = self.writer
         err_pil = None
         if 'err_mask' in dump_dict and 'prob_mask' in dump_dict['assets']:
             prob_image = dump_dict['assets']['prob_mask'][idx]
             err_mask = dump_dict['err_mask'][idx]
-            image = (prob_image.cpu().numpy() * 255).astype(np.uint8)
-            future = threads.submit(self.save_image, image, f'{img_name}_prob.png')
-            futures.append(future)
+            # quantized to uint8 by eval_minibatch
+            image = prob_image.cpu().numpy()
+            writer.submit(self.save_image, image, f'{img_name}_prob.png')
             err_pil = Image.fromarray(prediction.astype(np.uint8)).convert('RGB')
             # err_pil.save(os.path.join(self.save_dir, f'{img_name}_err_mask.png'))
             path = os.path.join(self.save_dir, f'{img_name}_err_mask.png')
-            future = threads.submit(err_pil.save, path)
-            futures.append(future)
+            writer.submit(err_pil.save, path)
             return True, err_pil
             # return True, err_pil
         return False, err_pil
-
-    def map_features(
-            self,
-            tile: Tile,
-            src_img: np.ndarray,
-            img_array=True,
-    ) -> Optional[GeoDataFrame]:
-        """Converts a raster mask to a GeoDataFrame of polygons
-        Parameters
-        ----------
-        src_img : str
-            path to the image
-        img_array : array, optional
-            if the image is already read, pass the array to avoid reading it again
-        Returns
-        -------
-        geoms : GeoDataFrame
-            GeoDataFrame of polygons
-        """
-        swcw = []
-        threads = self.threads
-        futures = self.futures
-
-        sidewalks = tile.mask2poly(
-            src_img,
-            class_name='sidewalk',
-            class_id=2,
-            img_array=img_array
-        )
-        if sidewalks is not False:
-            swcw.append(sidewalks)
-
-        crosswalks = tile.mask2poly(
-            src_img,
-            class_name='crosswalk',
-            class_id=0,
-            class_hole_size=15,
-            img_array=img_array
-        )
-        if crosswalks is not False:
-            swcw.append(crosswalks)
-
-        roads = tile.mask2poly(
-            src_img,
-            class_name='road',
-            class_id=1,
-            class_hole_size=30,
-            img_array=img_array
-        )
-        if roads is not False:
-            swcw.append(roads)
-        if len(swcw) > 0:
-            # noinspection PyTypeChecker
-            rswcw: GeoDataFrame = pd.concat(swcw)
-            rswcw.reset_index(drop=True, inplace=True)
-            return rswcw
@@ -33,6 +33,7 @@ from tile2net.tileseg.utils.misc import fast_hist, fmt_scale
 from tile2net.tileseg.utils.misc import AverageMeter, eval_metrics
 from tile2net.tileseg.utils.misc import metrics_per_image
 from tile2net.tileseg.utils.misc import ImageDumper
+from tile2net.tileseg.utils.device import autocast, get_device
 from runx.logx import logx
 
 
@@ -87,11 +88,13 @@ def eval_minibatch(data, net, criterion, val_loss, calc_metrics, args, val_idx):
          handled within the model itself (see networks/mscale.py -> nscale_forward())
       2. 'multi_scale_inference', where we use Averaging to combine scales
     """
-    torch.cuda.empty_cache()
+    device = get_device(args.device)
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
 
     scales = [args.default_scale]
     if args.multi_scale_inference:
-        scales.extend([float(x) for x in args.extra_scales.split(',')])
+        scales.extend([float(x) for x in args.model.extra_scales.split(',')])
         if val_idx == 0:
             logx.msg(f'Using multi-scale inference (AVGPOOL) with scales {scales}')
 
@@ -103,60 +106,72 @@ def eval_minibatch(data, net, criterion, val_loss, calc_metrics, args, val_idx):
     batch_pixel_size = images.size(0) * images.size(2) * images.size(3)
     input_size = images.size(2), images.size(3)
 
+    # scales that infer at the same size share a forward pass; those of
+    # different sizes cannot share a batch without padding the smaller inputs,
+    # which would change the predictions near their borders
+    sizes = {}
+    for scale in scales:
+        infer_size = tuple(round(sz * scale) for sz in input_size)
+        sizes.setdefault(infer_size, []).append(scale)
+
+    # copied to the device once, and resized there
+    images = images.to(device)
+    gts = gt_image.to(device)
     if args.do_flip:
-        # By ending with flip=0, we insure that the images that are dumped
-        # out correspond to the unflipped versions. A bit hacky.
-        flips = [1, 0]
-    else:
-        flips = [0]
+        # the flipped images follow the images in the batch, so that
+        # both are inferred in the same forward pass
+        gts = torch.cat([gts, flip_tensor(gts, 2)])
 
     with torch.no_grad():
         output = 0.0
-
-        for flip in flips:
-            for scale in scales:
-                if flip == 1:
-                    inputs = flip_tensor(images, 3)
-                else:
-                    inputs = images
-
-                infer_size = [round(sz * scale) for sz in input_size]
-
-                if scale != 1.0:
-                    inputs = resize_tensor(inputs, infer_size)
-
-                inputs = {'images': inputs, 'gts': gt_image}
-                inputs = {k: v.cuda() for k, v in inputs.items()}
-
-                # Expected Model outputs:
-                #   required:
-                #     'pred'  the network prediction, shape (1, 19, h, w)
-                #
-                #   optional:
-                #     'pred_*' - multi-scale predictions from mscale model
-                #     'attn_*' - multi-scale attentions from mscale model
+        # the AVGPOOL style multi-scale output of each scale
+        scale_preds = {}
+
+        for infer_size, group in sizes.items():
+            inputs = images
+            if infer_size != input_size:
+                inputs = resize_tensor(inputs, infer_size)
+            if args.do_flip:
+                inputs = torch.cat([inputs, flip_tensor(inputs, 3)])
+            if args.channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+            inputs = {'images': inputs, 'gts': gts}
+
+            # Expected Model outputs:
+            #   required:
+            #     'pred'  the network prediction, shape (1, 19, h, w)
+            #
+            #   optional:
+            #     'pred_*' - multi-scale predictions from mscale model
+            #     'attn_*' - multi-scale attentions from mscale model
+            with autocast(device, args.bf16):
                 output_dict = net(inputs)
-
-                _pred = output_dict['pred']
-
-                # save AVGPOOL style multi-scale output for visualizing
-                if not cfg.MODEL.MSCALE:
-                    scale_name = fmt_scale('pred', scale)
-                    output_dict[scale_name] = _pred
-
-                # resize tensor down to 1.0x scale in order to combine
-                # with other scales of prediction
-                if scale != 1.0:
-                    _pred = resize_tensor(_pred, input_size)
-
-                if flip == 1:
-                    output = output + flip_tensor(_pred, 3)
-                else:
-                    output = output + _pred
-
-    output = output / len(scales) / len(flips)
+            _pred = output_dict['pred'].float()
+            # the assets are those of the unflipped images
+            output_dict = {
+                k: v[:len(images)].float() if torch.is_tensor(v) else v
+                for k, v in output_dict.items()
+            }
+
+            # save AVGPOOL style multi-scale output for visualizing
+            if not cfg.MODEL.MSCALE:
+                for scale in group:
+                    scale_preds[fmt_scale('pred', scale)] = output_dict['pred']
+
+            # resize tensor down to 1.0x scale in order to combine
+            # with other scales of prediction
+            if infer_size != input_size:
+                _pred = resize_tensor(_pred, input_size)
+
+            if args.do_flip:
+                _pred, flipped = _pred.chunk(2)
+                _pred = _pred + flip_tensor(flipped, 3)
+
+            output = output + _pred * len(group)
+
+    output = output / len(scales) / (2 if args.do_flip else 1)
     assert_msg = 'output_size {} gt_cuda size {}'
-    gt_cuda = gt_image.cuda()
+    gt_cuda = gts[:len(images)]
     assert_msg = assert_msg.format(
         output.size()[2:], gt_cuda.size()[1:])
     assert output.size()[2:] == gt_cuda.size()[1:], assert_msg
@@ -164,25 +179,30 @@ def eval_minibatch(data, net, criterion, val_loss, calc_metrics, args, val_idx):
 
     # Update loss and scoring datastructure
     if calc_metrics:
-        val_loss.update(criterion(output, gt_image.cuda()).item(),
+        val_loss.update(criterion(output, gt_cuda).item(),
                         batch_pixel_size)
 
-    output_data = torch.nn.functional.softmax(output, dim=1).cpu().data
-    max_probs, predictions = output_data.max(1)
+    # only the class indices are transferred from the device, as uint8;
+    # argmax needs no softmax, which is only taken for the dumped assets
+    predictions = output.argmax(1).to(torch.uint8).cpu().numpy()
 
     # Assemble assets to visualize
     assets = {}
-    for item in output_dict:
-        if 'attn_' in item:
-            assets[item] = output_dict[item]
-        if 'pred_' in item:
-            smax = torch.nn.functional.softmax(output_dict[item], dim=1)
-            _, pred = smax.data.max(1)
-            assets[item] = pred.cpu().numpy()
+    if args.dump_assets:
+        output_dict.update(scale_preds)
+        for item in output_dict:
+            if 'attn_' in item:
+                assets[item] = output_dict[item]
+            if 'pred_' in item:
+                pred = output_dict[item].argmax(1).to(torch.uint8)
+                assets[item] = pred.cpu().numpy()
+    if args.dump_assets or calc_metrics:
+        # the probability of each prediction, quantized to uint8; dumped as an
+        # asset, and alongside the error mask when metrics are calculated
+        max_probs = torch.nn.functional.softmax(output, dim=1).amax(1)
+        assets['prob_mask'] = max_probs.mul(255).round().to(torch.uint8).cpu()
 
-    predictions = predictions.numpy()
     assets['predictions'] = predictions
-    assets['prob_mask'] = max_probs
     if calc_metrics:
         assets['err_mask'] = calc_err_mask_all(predictions,
                                                gt_image.numpy(),